@@ -1,6 +1,9 @@
+import uuid
 import warnings 
 warnings.filterwarnings('ignore', module="langsmith.client")
 from modular_agent import create_agent
+from checkpointing import get_checkpointer
+from tracing import trace
 from langchain.tools import StructuredTool
 from langchain_openai import ChatOpenAI
 from finance.corporate_finance import *
@@ -18,7 +21,10 @@ from response_transformation import ResponseTransformer
 from typing_extensions import TypedDict
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables.config import RunnableConfig
-config = RunnableConfig(recursion_limit=60)
+
+def new_config() -> RunnableConfig:
+    """Config of one request. Checkpoints of the supervisor are stored under its own thread_id."""
+    return RunnableConfig(recursion_limit=60, configurable={"thread_id": str(uuid.uuid4())})
 
 joiner_prompt = hub.pull("yankee/llm-compiler-joiner").partial(examples='')
 finance_prompt = hub.pull('yankee/llm-compiler-finance')
@@ -105,67 +111,34 @@ finance_tool_agent = StructuredTool.from_function(
 
 tools = [maths_tool_agent,finance_group_tool,data_node_tool,reportgen_tool]
 
-supervisor = create_agent(llm, tools, supervisor_prompt, joiner_prompt,'supervisor')
-
-class StateCompression(TypedDict):
-    summary: str = Field(description="A summary of the state, including all the function calls and their results, and any conclusions if drawn")
-
-system_compressor = """You are an expert at compressing the state of the system. 
-You have been given the task to compress the state of the system into a summary. 
-You must include all the function calls and their results, and any conclusions if drawn.
-You must provide this summary in a structured format as per the Act model. """
-route_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system", system_compressor),
-        ("human", "{messages}"),
-    ]
-)
-
-def restart(messages,response):
-    # query = state['user_question']
-    # response = input(f'Enter the response for the query-> {query}:\nAnswer: ')
-    messages.append(HumanMessage(content=response))
-    structured_llm_compressor = llm_mini.with_structured_output(StateCompression)
-    state_compressor = route_prompt | structured_llm_compressor
-    summary = state_compressor.invoke({"messages": messages})
-    print('Summary:',summary)
-    # state["messages"].append(HumanMessage(content=summary["summary"]))
-    return summary["summary"]
-
+# Pauses before asking the user, and resumes from its checkpoint once answered
+supervisor = create_agent(llm, tools, supervisor_prompt, joiner_prompt,'supervisor',checkpointer=get_checkpointer())
 
 if __name__ == '__main__':
     # query = "What is the GDP of India and USA. What is the difference between two. What is the precentage increase in their GDPs"
     # query = "What is GDP of Ireland, also generate a report about Google's finances and their progress in field of quantum computing"
     query = "Which segment of 3M performed the worst in 2018?"
     final_answer = ""
-    for step in supervisor.stream({'messages': [HumanMessage(content=query)],'hitl_flag':False},config=config,stream_mode='values'):
-        print('============================================STEP START========================================================')
-        last_state = step
-        print('Last State:',last_state.__dict__)
-        print('Last State:',type(last_state))
-        print(step)
-        print('=============================================STEP END=======================================================')
-
-
-    hitl_flag = last_state["hitl_flag"]
-    print(hitl_flag)
-    if hitl_flag:
-        messages = last_state['messages']
-        user_question = last_state["user_question"]
+    config = new_config()
+    # Timeline of the request (nodes, LLM calls, tool tasks, retrievals) in traces/, for chrome://tracing
+    thread_id = config["configurable"]["thread_id"]
+    with trace('supervisor', path=f'traces/{thread_id}.json') as tracer:
+        for step in supervisor.stream({'messages': [HumanMessage(content=query)],'hitl_flag':False},config=tracer.attach(config),stream_mode='values'):
+            last_state = step
+            print('Step:',last_state['messages'][-1].pretty_repr())
+
+
+    # Paused before "hitl": answer, then go on from the stored state with the
+    # observations of the plans already run
+    resumes = 0
+    while supervisor.get_state(config).next == ("hitl",):
+        user_question = supervisor.get_state(config).values["user_question"]
         print('User Question:',user_question)
         response = input('Enter the response: ')
-        # print('To Replay:',to_replay)
-        last_message = last_state["messages"][-1]
-        print('Last Message:',last_message)
-        # last_message['content'] = response
-        summary = restart(messages,response)
-        new_state = {'messages':[HumanMessage(content=summary)]}
-        # branch_config = supervisor.update_state(to_replay.config, {'messages':[HumanMessage(content=summary)],'user_response': response})
-        # for step in supervisor.stream(new_state,stream_mode='values'):
-        #     print("NEW BRANCH ACTIVATED")
-        #     print(step)
-        response = supervisor.invoke(new_state,config=config)["messages"][-1].content
-    else:
-        response = last_state["messages"][-1].content
+        supervisor.update_state(config, {'user_answer': response})
+        resumes += 1
+        with trace('supervisor-resume', path=f'traces/{thread_id}-resume-{resumes}.json') as tracer:
+            last_state = supervisor.invoke(None,config=tracer.attach(config))
+    response = last_state["messages"][-1].content
 
     print(response)
\ No newline at end of file
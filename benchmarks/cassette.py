@@ -0,0 +1,312 @@
+"""
+Record / replay cassette for OpenAI calls.
+
+Patches the OpenAI client classes, so every chat completion and embedding
+request of the process goes through the cassette: ChatOpenAI and
+OpenAIEmbeddings in the RAG modules, modular_agent.py and finance_group.py,
+as well as the raw OpenAI clients of report_gen.py, code_executor.py,
+Bad_queries.py and response_transformation.py.
+
+- record: call the API and append every request -> response pair to the cassette
+- replay: answer from the cassette without network access, an unknown request raises CassetteMiss
+- auto: replay known requests, record the others
+
+Requests are keyed by a hash of their canonical form: the request fields that
+change the response, with random tool call IDs replaced by their position.
+Identical requests made several times are replayed in recording order.
+Replay sleeps the recorded latency times `latency_scale`, or a fixed
+`latency` (0 replays instantly), so runs can be repeated exactly and the
+scheduling and graph overhead profiled on its own.
+
+Install the cassette before a UsageMeter, so replayed calls are metered too:
+
+    with Cassette("cassettes/financebench.jsonl", mode="replay"), UsageMeter():
+        ...
+"""
+
+import copy
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+# Request fields that do not change the response
+IGNORED_FIELDS = {"stream", "stream_options", "timeout", "extra_headers", "extra_query", "extra_body", "user", "encoding_format"}
+
+
+class CassetteMiss(KeyError):
+    """Raised in replay mode for a request that was never recorded."""
+
+
+def _normalize_ids(messages: List[Any]) -> List[Any]:
+    """Replace tool call IDs, random per run, with their order of appearance."""
+    ids: Dict[str, str] = {}
+
+    def alias(value: str) -> str:
+        return ids.setdefault(value, f"call_{len(ids)}")
+
+    messages = copy.deepcopy(messages)
+    for message in messages:
+        if not isinstance(message, dict):
+            continue
+        for call in message.get("tool_calls") or []:
+            if isinstance(call, dict) and "id" in call:
+                call["id"] = alias(call["id"])
+        if "tool_call_id" in message:
+            message["tool_call_id"] = alias(message["tool_call_id"])
+    return messages
+
+
+def canonical_request(kind: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Fields of a request that determine its response, in canonical form."""
+    request = {key: value for key, value in kwargs.items() if key not in IGNORED_FIELDS}
+    if "messages" in request:
+        request["messages"] = _normalize_ids(list(request["messages"]))
+    request["kind"] = kind
+    return json.loads(json.dumps(request, sort_keys=True, default=str))
+
+
+def request_key(request: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ReplayStream:
+    """Replayed streamed completion, usable like openai.Stream and openai.AsyncStream."""
+
+    def __init__(self, chunks: List[Any], first_delay: float, chunk_delay: float):
+        self.chunks = chunks
+        self.first_delay = first_delay
+        self.chunk_delay = chunk_delay
+
+    def __iter__(self):
+        for i, chunk in enumerate(self.chunks):
+            time.sleep(self.first_delay if i == 0 else self.chunk_delay)
+            yield chunk
+
+    async def __aiter__(self):
+        import asyncio
+
+        for i, chunk in enumerate(self.chunks):
+            await asyncio.sleep(self.first_delay if i == 0 else self.chunk_delay)
+            yield chunk
+
+    def close(self) -> None:
+        pass
+
+    async def aclose(self) -> None:
+        pass
+
+    def __enter__(self) -> "ReplayStream":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        pass
+
+    async def __aenter__(self) -> "ReplayStream":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        pass
+
+
+class RecordingStream:
+    """Pass-through wrapper of a live stream, recording its chunks once it is consumed."""
+
+    def __init__(self, stream: Any, on_done: Callable[[List[Any], float, float], None]):
+        self._stream = stream
+        self._on_done = on_done
+        self._chunks: List[Any] = []
+        self._start = time.perf_counter()
+        self._first: Optional[float] = None
+
+    def _collect(self, chunk: Any) -> Any:
+        if self._first is None:
+            self._first = time.perf_counter() - self._start
+        self._chunks.append(chunk)
+        return chunk
+
+    def _finish(self) -> None:
+        total = time.perf_counter() - self._start
+        self._on_done(self._chunks, self._first or total, total)
+
+    def __iter__(self):
+        for chunk in self._stream:
+            yield self._collect(chunk)
+        self._finish()
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield self._collect(chunk)
+        self._finish()
+
+    def __enter__(self) -> "RecordingStream":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._stream.close()
+
+    async def __aenter__(self) -> "RecordingStream":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self._stream.close()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+
+class Cassette:
+    """Record / replay store of OpenAI responses, see the module docstring."""
+
+    def __init__(self, path: str, mode: str = "replay", latency: Optional[float] = None, latency_scale: float = 1.0):
+        """
+        Args:
+            path (str): JSON lines cassette file
+            mode (str): 'record', 'replay' or 'auto'
+            latency (float, optional): Fixed replay latency in seconds, overrides the recorded latency
+            latency_scale (float): Factor applied to the recorded latency
+        """
+        if mode not in ("record", "replay", "auto"):
+            raise ValueError(f"Unknown cassette mode '{mode}', expected 'record', 'replay' or 'auto'.")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.latency_scale = latency_scale
+        self._entries: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._played: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self._originals: Dict[Any, Callable] = {}
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                for line in file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry["key"]].append(entry)
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._entries.values())
+
+    def _next_entry(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries or self.mode == "record":
+                return None
+            entry = entries[self._played[key] % len(entries)]
+            self._played[key] += 1
+            self.hits += 1
+            return entry
+
+    def _save(self, key: str, request: Dict[str, Any], entry: Dict[str, Any]) -> None:
+        entry = {"key": key, "request": request, **entry}
+        with self._lock:
+            self._entries[key].append(entry)
+            self.misses += 1
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(entry) + "\n")
+
+    def _delay(self, recorded: float) -> float:
+        return self.latency if self.latency is not None else recorded * self.latency_scale
+
+    def _replay(self, entry: Dict[str, Any], response_type: Any, chunk_type: Any) -> Any:
+        if entry.get("chunks") is not None:
+            chunks = [chunk_type.model_validate(chunk) for chunk in entry["chunks"]]
+            first = self._delay(entry["first_chunk_s"])
+            rest = max(0.0, self._delay(entry["latency_s"]) - first)
+            return ReplayStream(chunks, first, rest / max(1, len(chunks) - 1))
+        return response_type.model_validate(entry["response"])
+
+    def _lookup(self, kind: str, kwargs: Dict[str, Any]):
+        request = canonical_request(kind, kwargs)
+        key = request_key(request)
+        entry = self._next_entry(key)
+        if entry is None and self.mode == "replay":
+            with self._lock:
+                self.misses += 1
+            raise CassetteMiss(f"No recorded {kind} response for request {key[:12]} (model {request.get('model')}).")
+        return request, key, entry
+
+    def _on_stream_done(self, key: str, request: Dict[str, Any]) -> Callable[[List[Any], float, float], None]:
+        def save(chunks: List[Any], first: float, total: float) -> None:
+            self._save(key, request, {"chunks": [c.model_dump() for c in chunks], "first_chunk_s": first, "latency_s": total})
+
+        return save
+
+    def _wrap(self, create: Callable, kind: str, response_type: Any, chunk_type: Any) -> Callable:
+        cassette = self
+
+        @functools.wraps(create)
+        def wrapper(self, *args, **kwargs):
+            request, key, entry = cassette._lookup(kind, kwargs)
+            if entry is not None:
+                replayed = cassette._replay(entry, response_type, chunk_type)
+                if not isinstance(replayed, ReplayStream):
+                    time.sleep(cassette._delay(entry["latency_s"]))
+                return replayed
+            start = time.perf_counter()
+            response = create(self, *args, **kwargs)
+            if kwargs.get("stream"):
+                return RecordingStream(response, cassette._on_stream_done(key, request))
+            cassette._save(key, request, {"response": response.model_dump(), "latency_s": time.perf_counter() - start})
+            return response
+
+        return wrapper
+
+    def _wrap_async(self, create: Callable, kind: str, response_type: Any, chunk_type: Any) -> Callable:
+        cassette = self
+
+        @functools.wraps(create)
+        async def wrapper(self, *args, **kwargs):
+            import asyncio
+
+            request, key, entry = cassette._lookup(kind, kwargs)
+            if entry is not None:
+                replayed = cassette._replay(entry, response_type, chunk_type)
+                if not isinstance(replayed, ReplayStream):
+                    await asyncio.sleep(cassette._delay(entry["latency_s"]))
+                return replayed
+            start = time.perf_counter()
+            response = await create(self, *args, **kwargs)
+            if kwargs.get("stream"):
+                return RecordingStream(response, cassette._on_stream_done(key, request))
+            cassette._save(key, request, {"response": response.model_dump(), "latency_s": time.perf_counter() - start})
+            return response
+
+        return wrapper
+
+    def install(self) -> "Cassette":
+        """Patch the OpenAI client classes."""
+        from openai.resources.chat.completions import AsyncCompletions, Completions
+        from openai.resources.embeddings import AsyncEmbeddings, Embeddings
+        from openai.types import CreateEmbeddingResponse
+        from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+        for cls, kind, is_async, response_type, chunk_type in (
+            (Completions, "chat", False, ChatCompletion, ChatCompletionChunk),
+            (AsyncCompletions, "chat", True, ChatCompletion, ChatCompletionChunk),
+            (Embeddings, "embedding", False, CreateEmbeddingResponse, None),
+            (AsyncEmbeddings, "embedding", True, CreateEmbeddingResponse, None),
+        ):
+            if cls in self._originals:
+                continue
+            self._originals[cls] = cls.create
+            wrap = self._wrap_async if is_async else self._wrap
+            cls.create = wrap(cls.create, kind, response_type, chunk_type)
+        return self
+
+    def uninstall(self) -> None:
+        for cls, create in self._originals.items():
+            cls.create = create
+        self._originals.clear()
+
+    def __enter__(self) -> "Cassette":
+        return self.install()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.uninstall()
@@ -0,0 +1,287 @@
+"""
+Microbenchmarks of the financial indicator and finance tool functions.
+
+Times every list-processing function of financial_markets.py,
+finance/financial_markets.py, finance/corporate_finance.py and
+finance/personal_finance.py for input sizes from 10 to 10 million points,
+next to a numpy reference implementation, and checks that all implementations
+agree with the reference.
+
+Timings are compared with the baseline stored in
+benchmarks/baselines/finance_micro.json; a function slower than its baseline
+by more than the threshold is flagged and the command exits with status 1.
+Baselines are machine specific, refresh them on the machine running the
+comparison:
+
+    python -m benchmarks.finance_micro                     # compare with the baseline
+    python -m benchmarks.finance_micro --update-baseline   # record a new baseline
+    python -m benchmarks.finance_micro --max-size 100000 --cases rsi ema
+
+calculate_internal_rate_of_return is not benchmarked, it imports scipy.optimize.irr
+which no scipy release provides.
+"""
+
+import argparse
+import importlib
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "finance_micro.json")
+SIZES = [10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+# Slowdown over the baseline flagged as a regression
+DEFAULT_THRESHOLD = 0.25
+# Slowdowns smaller than this, in seconds, are timer noise and never flagged
+NOISE_FLOOR_S = 50e-6
+# Relative tolerance of the agreement check, sums are accumulated in different orders
+AGREEMENT_RTOL = 1e-6
+# Seconds spent on repeats of one measurement
+TIME_BUDGET = 1.0
+MAX_REPEATS = 7
+
+
+@dataclass
+class Case:
+    """A benchmarked function: its implementations, how to build inputs and a numpy reference."""
+
+    name: str
+    function: str
+    modules: List[str]
+    make_args: Callable[[np.ndarray], Tuple]
+    reference: Callable[..., Any]
+
+
+def _prices(size: int, seed: int = 0) -> np.ndarray:
+    """Geometric random walk around 100, scaled so its spread does not grow with the size."""
+    rng = np.random.default_rng(seed)
+    walk = np.cumsum(rng.normal(0.0, 1.0, size)) / np.sqrt(size)
+    return 100 * np.exp(0.3 * walk)
+
+
+def _window(prices: np.ndarray) -> int:
+    return max(2, len(prices) // 2)
+
+
+def _ma_reference(prices, period):
+    return float(np.mean(prices[-period:]))
+
+
+def _std_reference(prices, period):
+    return float(np.std(prices[-period:]))
+
+
+def _bollinger_reference(prices, period, num_std_dev):
+    ma, std = _ma_reference(prices, period), _std_reference(prices, period)
+    return {"upper_band": ma + num_std_dev * std, "lower_band": ma - num_std_dev * std, "moving_average": ma}
+
+
+def _ema_reference(prices, period):
+    # ema_n = (1 - a)^(n-1) p_0 + a * sum_{i>=1} (1 - a)^(n-1-i) p_i
+    prices = np.asarray(prices)
+    alpha = 2 / (period + 1)
+    n = len(prices)
+    weights = (1 - alpha) ** np.arange(n - 2, -1, -1, dtype=np.float64)
+    return float((1 - alpha) ** (n - 1) * prices[0] + alpha * np.dot(weights, prices[1:]))
+
+
+def _rsi_reference(prices, period):
+    changes = np.diff(np.asarray(prices[: period + 1]))
+    avg_gain = changes[changes > 0].sum() / period
+    avg_loss = -changes[changes <= 0].sum() / period
+    rs = avg_gain / avg_loss if avg_loss != 0 else 0
+    return 100 - 100 / (1 + rs)
+
+
+def _npv_reference(cash_flows, discount_rate):
+    cash_flows = np.asarray(cash_flows)
+    return float(np.sum(cash_flows / (1 + discount_rate) ** np.arange(len(cash_flows))))
+
+
+def _payback_reference(cash_flows, initial_investment):
+    reached = np.nonzero(np.cumsum(cash_flows) >= initial_investment)[0]
+    return int(reached[0]) + 1 if len(reached) else "Payback period exceeds available cash flows."
+
+
+def _depreciation_reference(initial_cost, salvage_value, useful_life):
+    return np.full(useful_life, (initial_cost - salvage_value) / useful_life).tolist()
+
+
+def _retirement_reference(current_savings, monthly_contribution, annual_rate_of_return, years_until_retirement):
+    rate = annual_rate_of_return / 12 / 100
+    months = years_until_retirement * 12
+    # Closed form of the contributions annuity
+    annuity = monthly_contribution * (((1 + rate) ** months - 1) / rate if rate else months)
+    return current_savings * (1 + rate) ** months + annuity
+
+
+MARKET_MODULES = ["financial_markets", "finance.financial_markets"]
+
+CASES = [
+    Case("moving_average", "moving_average", MARKET_MODULES,
+         lambda p: (p.tolist(), _window(p)), _ma_reference),
+    Case("bollinger_bands", "bollinger_bands", MARKET_MODULES,
+         lambda p: (p.tolist(), _window(p), 2.0), _bollinger_reference),
+    Case("volatility", "volatility", MARKET_MODULES,
+         lambda p: (p.tolist(), _window(p)), _std_reference),
+    Case("ema", "exponential_moving_average", MARKET_MODULES,
+         lambda p: (p.tolist(), min(20, len(p))), _ema_reference),
+    # The RSI only looks at the first period + 1 prices, the period grows with the input
+    Case("rsi", "rsi", MARKET_MODULES,
+         lambda p: (p.tolist(), len(p) - 1), _rsi_reference),
+    # A small rate keeps (1 + rate) ** n finite for 10 million periods
+    Case("npv", "calculate_net_present_value", ["finance.corporate_finance"],
+         lambda p: (p.tolist(), 1e-6), _npv_reference),
+    # The investment is only recovered by the last cash flow, so the whole list is scanned
+    Case("payback_period", "calculate_payback_period", ["finance.corporate_finance"],
+         lambda p: (p.tolist(), float(np.sum(p)) * (1 - 1e-12)), _payback_reference),
+    Case("depreciation_schedule", "depreciation_schedule", ["finance.corporate_finance"],
+         lambda p: (1e6, 1e4, len(p)), _depreciation_reference),
+    # One month per point
+    Case("retirement_savings", "retirement_savings", ["finance.personal_finance"],
+         lambda p: (1e4, 500.0, 1e-4, max(1, len(p) // 12)), _retirement_reference),
+]
+
+
+def relative_error(value: Any, reference: Any) -> float:
+    """Largest relative difference between two results, inf if they are not comparable."""
+    if isinstance(reference, dict):
+        if not isinstance(value, dict) or value.keys() != reference.keys():
+            return math.inf
+        return max(relative_error(value[key], reference[key]) for key in reference)
+    if isinstance(reference, list):
+        if not isinstance(value, list) or len(value) != len(reference):
+            return math.inf
+        a, b = np.asarray(value, dtype=np.float64), np.asarray(reference, dtype=np.float64)
+        return float(np.max(np.abs(a - b) / np.maximum(np.abs(b), 1e-12))) if len(b) else 0.0
+    if isinstance(reference, str) or isinstance(value, str):
+        return 0.0 if value == reference else math.inf
+    return float(abs(value - reference) / max(abs(reference), 1e-12))
+
+
+def measure(function: Callable, args: Tuple, time_budget: float = TIME_BUDGET) -> Tuple[Any, Dict[str, float]]:
+    """
+    Time a call, repeating it while the time budget allows.
+
+    Returns:
+        Tuple[Any, dict]: Result of the call, and {"min_s", "median_s", "repeats"}
+    """
+    timings = []
+    start = time.perf_counter()
+    result = function(*args)
+    timings.append(time.perf_counter() - start)
+    repeats = min(MAX_REPEATS, int(time_budget / max(timings[0], 1e-9)))
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return result, {"min_s": min(timings), "median_s": statistics.median(timings), "repeats": len(timings)}
+
+
+def run(cases: List[Case], sizes: List[int], time_budget: float = TIME_BUDGET) -> Dict[str, Dict[str, Any]]:
+    """
+    Benchmark the cases.
+
+    Returns:
+        Dict[str, dict]: Measurements keyed by 'case/implementation/size', the numpy reference
+            is the 'numpy' implementation
+    """
+    results = {}
+    for size in sizes:
+        prices = _prices(size)
+        for case in cases:
+            args = case.make_args(prices)
+            array_args = (prices,) + args[1:] if isinstance(args[0], list) else args
+            reference, timing = measure(case.reference, array_args, time_budget)
+            results[f"{case.name}/numpy/{size}"] = timing
+            for module in case.modules:
+                function = getattr(importlib.import_module(module), case.function)
+                value, timing = measure(function, args, time_budget)
+                error = relative_error(value, reference)
+                results[f"{case.name}/{module}/{size}"] = {**timing, "relative_error": error, "agrees": bool(error <= AGREEMENT_RTOL)}
+            print(f"size={size:>9} {case.name:22} " + " ".join(
+                f"{impl}={results[f'{case.name}/{impl}/{size}']['min_s'] * 1e3:.3f}ms" for impl in ["numpy"] + case.modules
+            ))
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], threshold: float) -> List[Dict[str, Any]]:
+    """
+    Implementations slower than their baseline by more than `threshold`, as {"key", "baseline_s",
+    "current_s", "slowdown"}. The numpy references are not flagged, they only give scale.
+    """
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if previous is None or key.split("/")[1] == "numpy":
+            continue
+        slowdown = current["min_s"] / max(previous["min_s"], 1e-9) - 1
+        if slowdown > threshold and current["min_s"] - previous["min_s"] > NOISE_FLOOR_S:
+            regressions.append({"key": key, "baseline_s": previous["min_s"], "current_s": current["min_s"], "slowdown": slowdown})
+    return regressions
+
+
+def machine_info() -> Dict[str, str]:
+    return {"python": sys.version.split()[0], "platform": platform.platform(), "machine": platform.machine(), "numpy": np.__version__}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the finance tool functions.")
+    parser.add_argument("--cases", nargs="+", choices=[case.name for case in CASES], help="Run only these cases")
+    parser.add_argument("--max-size", type=int, default=SIZES[-1])
+    parser.add_argument("--time-budget", type=float, default=TIME_BUDGET, help="Seconds spent repeating each measurement")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Slowdown flagged as a regression, 0.25 is 25%%")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--report", help="Also write the results and regressions to this JSON file")
+    args = parser.parse_args(argv)
+
+    cases = [case for case in CASES if not args.cases or case.name in args.cases]
+    results = run(cases, [size for size in SIZES if size <= args.max_size], args.time_budget)
+
+    disagreements = [key for key, result in results.items() if result.get("agrees") is False]
+    for key in disagreements:
+        print(f"DISAGREES with numpy: {key} (relative error {results[key]['relative_error']:.3g})")
+
+    if args.update_baseline:
+        baseline = {"machine": machine_info(), "results": {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as file:
+                baseline = json.load(file)
+            baseline["machine"] = machine_info()
+        baseline["results"].update(results)
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        # Written aside and moved in place, an interrupted run keeps the previous baseline
+        with open(args.baseline + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(baseline, file, indent=1, sort_keys=True)
+        os.replace(args.baseline + ".tmp", args.baseline)
+        print(f"Baseline written to {args.baseline}")
+        regressions = []
+    else:
+        baseline = {"results": {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as file:
+                baseline = json.load(file)
+        else:
+            print(f"No baseline at {args.baseline}, run with --update-baseline to record one")
+        regressions = compare(results, baseline["results"], args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression['key']}: {regression['baseline_s'] * 1e3:.3f}ms -> "
+                  f"{regression['current_s'] * 1e3:.3f}ms (+{regression['slowdown']:.0%})")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as file:
+            json.dump({"machine": machine_info(), "results": results, "regressions": regressions,
+                       "disagreements": disagreements}, file, indent=1)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
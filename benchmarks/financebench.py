@@ -0,0 +1,368 @@
+"""
+FinanceBench end-to-end benchmark.
+
+Runs the RAG data node or the full supervisor over dataset_finance_bench.csv
+and records, per question, the answer, latency, LLM / embedding call counts,
+token usage and numeric-tolerance correctness. Results are appended to a JSON
+lines file as questions finish, so an interrupted run resumes where it
+stopped, and questions can be sharded across processes:
+
+    python -m benchmarks.financebench --target rag --concurrency 8 \
+        --shard 0 --num-shards 2 --results results/fb-0.jsonl
+    python -m benchmarks.financebench --target rag --concurrency 8 \
+        --shard 1 --num-shards 2 --results results/fb-1.jsonl
+    python -m benchmarks.financebench --merge results/fb-0.jsonl results/fb-1.jsonl \
+        --report results/fb.json
+
+The report is a JSON document with latency percentiles, throughput, usage
+totals and accuracy, so a change can be judged on speed and quality together.
+With --stand-in, the run goes against the local stand-in server instead of
+the live services. With --cassette, OpenAI calls are recorded to, or replayed
+from, a cassette file, see benchmarks/cassette.py.
+"""
+
+import argparse
+import contextvars
+import csv
+import json
+import os
+import re
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from benchmarks.usage import UNATTRIBUTED, UsageMeter, current_item
+
+DATASET_PATH = "dataset_finance_bench.csv"
+# Relative tolerance of numeric answers
+DEFAULT_TOLERANCE = 0.01
+NUMBER_PATTERN = r"\(?-?\$?\d[\d,]*\.?\d*\)?"
+# Units after a number, bare m / b / k only count after a currency sign ("$1561M", not "3M")
+UNIT_PATTERN = r"\s?(%|percent\b|billion\b|million\b|thousand\b|bn\b|mn\b|times\b|x\b|[mbk]\b)"
+# unmetered_llm_calls: streamed completions whose usage is unknown, their tokens are missing from the totals
+USAGE_KEYS = ["llm_calls", "unmetered_llm_calls", "prompt_tokens", "completion_tokens", "embedding_calls",
+              "embedding_tokens"]
+
+
+def load_questions(path: str = DATASET_PATH, shard: int = 0, num_shards: int = 1, limit: Optional[int] = None) -> List[Dict[str, str]]:
+    """Questions of one shard, shard membership is decided by row index."""
+    with open(path, encoding="utf-8") as file:
+        rows = list(csv.DictReader(file))
+    rows = [row for i, row in enumerate(rows) if i % num_shards == shard]
+    return rows[:limit] if limit is not None else rows
+
+
+def extract_quantities(text: str) -> List[Tuple[float, bool]]:
+    """
+    Numbers of a text with whether they carry a currency sign or a unit.
+
+    '(1,234)' and '-1,234' both give -1234. Years (a bare 2022, FY 2022), and numbers
+    glued to letters or an apostrophe (FY2022, Q2, Jun'23, 3M, MMM26) are left out.
+
+    Returns:
+        List[Tuple[float, bool]]: (value, has_unit) in the order of the text
+    """
+    text = text or ""
+    quantities = []
+    for match in re.finditer(NUMBER_PATTERN, text):
+        raw = match.group(0)
+        before = text[match.start() - 1] if match.start() else " "
+        if before.isalpha() or before in "'’":
+            continue
+        digits = re.sub(r"[^\d.]", "", raw).rstrip(".")
+        if not digits or digits.count(".") > 1:
+            continue
+        currency = "$" in raw
+        unit = re.match(UNIT_PATTERN, text[match.end():], re.IGNORECASE)
+        if unit and unit.group(1).lower() in ("m", "b", "k") and not currency:
+            unit = None
+        after = text[match.end():match.end() + 1]
+        if not unit and after.isalpha():
+            continue
+        value = float(digits)
+        is_year = re.fullmatch(r"(19|20)\d\d", digits) is not None
+        if is_year and not currency and not unit:
+            continue
+        negative = raw.startswith("(") and raw.endswith(")") or "-" in raw
+        quantities.append((-value if negative else value, currency or unit is not None))
+    return quantities
+
+
+def extract_numbers(text: str) -> List[float]:
+    """Numbers in a text, years and identifiers left out, see extract_quantities."""
+    return [value for value, _ in extract_quantities(text)]
+
+
+def _close(a: float, b: float, tolerance: float) -> bool:
+    return abs(a - b) <= tolerance * max(abs(a), abs(b), 1e-9)
+
+
+def score_answer(prediction: str, gold: str, tolerance: float = DEFAULT_TOLERANCE) -> Dict[str, Any]:
+    """
+    Judge an answer against the gold answer.
+
+    Gold answers starting with yes or no are correct when the prediction starts with the same
+    word. Numeric gold answers are correct when any number of the prediction matches the gold
+    number within the relative tolerance, also in thousands / millions scale (1.577 billion for
+    1577 million), and ignoring the sign, since filings write decreases in parentheses. The gold
+    number is its first one with a currency sign or a unit, else its first one, years excluded
+    on both sides. Other answers are judged by the share of gold words found in the prediction.
+
+    Returns:
+        dict: {"numeric": bool, "correct": bool}
+    """
+    gold_words = re.findall(r"[a-z0-9]+", (gold or "").lower())
+    predicted = (prediction or "").lower()
+    if gold_words and gold_words[0] in ("yes", "no"):
+        return {"numeric": False, "correct": re.match(r"\W*" + gold_words[0] + r"\b", predicted) is not None}
+    gold_quantities = extract_quantities(gold)
+    if gold_quantities:
+        with_unit = [value for value, has_unit in gold_quantities if has_unit]
+        target = abs(with_unit[0] if with_unit else gold_quantities[0][0])
+        candidates = [abs(n) * scale for n in extract_numbers(prediction) for scale in (1, 1e3, 1e-3)]
+        return {"numeric": True, "correct": any(_close(c, target, tolerance) for c in candidates)}
+    if not gold_words:
+        return {"numeric": False, "correct": False}
+    found = sum(1 for word in set(gold_words) if word in predicted)
+    return {"numeric": False, "correct": found / len(set(gold_words)) >= 0.5}
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Linearly interpolated percentile, q in [0, 100]."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def read_results(paths: Iterable[str]) -> List[Dict[str, Any]]:
+    """Records of results files, the last record of a question wins."""
+    records: Dict[str, Dict[str, Any]] = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    record = json.loads(line)
+                    records[record["financebench_id"]] = record
+    return list(records.values())
+
+
+def make_target(target: str, rag_module: str) -> Callable[[str], str]:
+    """
+    Function answering a question, imported lazily so clients pick up the stand-in routing.
+
+    Args:
+        target (str): 'rag' for the data node, 'supervisor' for the full agent
+        rag_module (str): Module providing data_node_function for the 'rag' target
+    """
+    if target == "rag":
+        import importlib
+
+        return importlib.import_module(rag_module).data_node_function
+    if target == "supervisor":
+        from langchain_core.messages import HumanMessage
+
+        from Architecture import new_config, supervisor
+
+        def ask_supervisor(question: str) -> str:
+            # A checkpoint thread per question, concurrent questions never share state
+            state = supervisor.invoke({"messages": [HumanMessage(content=question)], "hitl_flag": False}, config=new_config())
+            return state["messages"][-1].content
+
+        return ask_supervisor
+    raise ValueError(f"Unknown target '{target}', expected 'rag' or 'supervisor'.")
+
+
+class FinanceBenchRunner:
+    """Runs questions concurrently and appends their records to a results file."""
+
+    def __init__(self, answer: Callable[[str], str], results_path: str, meter: UsageMeter,
+                 concurrency: int = 4, tolerance: float = DEFAULT_TOLERANCE, shard: int = 0):
+        self.answer = answer
+        self.results_path = results_path
+        self.meter = meter
+        self.concurrency = concurrency
+        self.tolerance = tolerance
+        self.shard = shard
+        self._write_lock = threading.Lock()
+
+    def pending(self, questions: List[Dict[str, str]], retry_errors: bool = False) -> List[Dict[str, str]]:
+        """Questions without a record in the results file yet."""
+        done = {
+            record["financebench_id"]
+            for record in read_results([self.results_path])
+            if not (retry_errors and record.get("error"))
+        }
+        return [row for row in questions if row["financebench_id"] not in done]
+
+    def _run_one(self, row: Dict[str, str]) -> Dict[str, Any]:
+        question_id = row["financebench_id"]
+        current_item.set(question_id)
+        prediction, error = "", None
+        start = time.perf_counter()
+        try:
+            prediction = self.answer(row["question"])
+        except Exception:
+            error = traceback.format_exc(limit=3)
+        latency = time.perf_counter() - start
+        record = {
+            "financebench_id": question_id,
+            "company": row["company"],
+            "question_type": row["question_type"],
+            "question": row["question"],
+            "gold": row["answer"],
+            "prediction": prediction,
+            "latency_s": round(latency, 4),
+            "error": error,
+            "usage": self.meter.usage(question_id),
+            "shard": self.shard,
+            **score_answer(prediction, row["answer"], self.tolerance),
+        }
+        with self._write_lock:
+            with open(self.results_path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(record) + "\n")
+        status = "ERROR" if error else ("OK" if record["correct"] else "WRONG")
+        print(f"[{status}] {question_id} {latency:.2f}s")
+        return record
+
+    def run(self, questions: List[Dict[str, str]]) -> float:
+        """Answer the questions, returns the wall time in seconds."""
+        os.makedirs(os.path.dirname(self.results_path) or ".", exist_ok=True)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            # A fresh context per question keeps the usage attribution of concurrent questions apart
+            futures = [executor.submit(contextvars.copy_context().run, self._run_one, row) for row in questions]
+            for future in futures:
+                future.result()
+        return time.perf_counter() - start
+
+
+def build_report(records: List[Dict[str, Any]], run: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Aggregate question records.
+
+    Args:
+        records: Question records, e.g. from read_results
+        run (dict, optional): Information about the run that produced them (wall time, config, unattributed usage)
+    """
+    latencies = [r["latency_s"] for r in records if not r.get("error")]
+    answered = [r for r in records if not r.get("error")]
+    numeric = [r for r in answered if r["numeric"]]
+    usage_totals = {key: sum(r["usage"].get(key, 0) for r in records) for key in USAGE_KEYS}
+    report = {
+        "questions": len(records),
+        "errors": len(records) - len(answered),
+        "latency_s": {
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies) if latencies else None,
+        },
+        "usage": {
+            "total": usage_totals,
+            "per_question": {key: value / len(records) if records else None for key, value in usage_totals.items()},
+        },
+        "accuracy": {
+            "overall": sum(r["correct"] for r in answered) / len(records) if records else None,
+            "numeric": sum(r["correct"] for r in numeric) / len(numeric) if numeric else None,
+            "numeric_questions": len(numeric),
+        },
+    }
+    if run:
+        report["run"] = run
+        if run.get("wall_time_s") and run.get("questions_run"):
+            report["throughput_qps"] = run["questions_run"] / run["wall_time_s"]
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Run the FinanceBench questions end to end.")
+    parser.add_argument("--target", choices=["rag", "supervisor"], default="rag")
+    parser.add_argument("--rag-module", default="new_adaptive_rag", help="Module providing data_node_function")
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--limit", type=int, help="Run only the first N questions of the shard")
+    parser.add_argument("--shard", type=int, default=0)
+    parser.add_argument("--num-shards", type=int, default=1)
+    parser.add_argument("--results", default="benchmark_results/financebench.jsonl")
+    parser.add_argument("--report", help="Report path, defaults to the results path with a .report.json suffix")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--retry-errors", action="store_true", help="Run again questions whose record is an error")
+    parser.add_argument("--merge", nargs="+", metavar="RESULTS", help="Only build a report from existing results files")
+    parser.add_argument("--stand-in", action="store_true", help="Run against the local stand-in server")
+    parser.add_argument("--stand-in-config", help="JSON configuration of the stand-in server")
+    parser.add_argument("--cassette", help="Record / replay the OpenAI calls with this cassette file")
+    parser.add_argument("--cassette-mode", choices=["record", "replay", "auto"], default="auto")
+    parser.add_argument("--replay-latency", type=float, help="Fixed replay latency in seconds, default is the recorded one")
+    parser.add_argument("--replay-latency-scale", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    report_path = args.report or os.path.splitext(args.results)[0] + ".report.json"
+    if args.merge:
+        report = build_report(read_results(args.merge))
+    else:
+        if not 0 <= args.shard < args.num_shards:
+            parser.error("--shard must be in [0, --num-shards)")
+        if args.stand_in:
+            from benchmarks.stand_in import load_config, route_clients, server_url, start_server
+
+            config = load_config(args.stand_in_config)
+            config["port"] = 0
+            server, _ = start_server(config)
+            route_clients(server_url(server))
+
+        cassette = None
+        if args.cassette:
+            from benchmarks.cassette import Cassette
+
+            # Installed before the meter, so replayed calls are metered too
+            cassette = Cassette(
+                args.cassette, args.cassette_mode,
+                latency=args.replay_latency, latency_scale=args.replay_latency_scale,
+            ).install()
+            os.environ.setdefault("OPENAI_API_KEY", "cassette")
+        meter = UsageMeter().install()
+        runner = FinanceBenchRunner(
+            make_target(args.target, args.rag_module), args.results, meter,
+            concurrency=args.concurrency, tolerance=args.tolerance, shard=args.shard,
+        )
+        questions = runner.pending(load_questions(args.dataset, args.shard, args.num_shards, args.limit), args.retry_errors)
+        print(f"{len(questions)} questions to run")
+        wall_time = runner.run(questions)
+        report = build_report(
+            read_results([args.results]),
+            run={
+                "target": args.target if args.target == "supervisor" else args.rag_module,
+                "concurrency": args.concurrency,
+                "shard": args.shard,
+                "num_shards": args.num_shards,
+                "stand_in": args.stand_in,
+                "cassette": {"path": args.cassette, "mode": args.cassette_mode, "hits": cassette.hits, "misses": cassette.misses}
+                if cassette else None,
+                "questions_run": len(questions),
+                "wall_time_s": wall_time,
+                "unattributed_usage": meter.usage(UNATTRIBUTED),
+                "usage_this_run": meter.totals(),
+            },
+        )
+        meter.uninstall()
+        if cassette:
+            cassette.uninstall()
+
+    os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    main()
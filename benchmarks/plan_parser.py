@@ -0,0 +1,213 @@
+"""
+Throughput benchmark of LLMCompilerPlanParser.
+
+Feeds the plan parser synthetic planner outputs, cut into token streams of
+different granularity, without any model in the loop:
+
+- plans of 5 to 500 tasks, each task depending on earlier ones through $N
+  references ('chain': the previous task, 'fan': a few random earlier tasks,
+  'deep': the last `--deep-window` tasks)
+- tokens of 1 character, 4 characters (about a BPE token), 16 characters, or whole lines
+
+For each combination it reports tokens/s, the latency from the token that
+completes a plan line to the parser emitting its task (p50 / p99 / max), and
+the peak memory allocated while parsing (tracemalloc, measured in a separate
+pass so it does not slow the timed ones). The parser is driven both directly
+(`_transform`) and through `transform`, the Runnable path plan_and_schedule
+streams it through.
+
+    python -m benchmarks.plan_parser --tasks 5 50 500 --token-sizes 1 4 line
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+import tracemalloc
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.tools import StructuredTool
+from pydantic import BaseModel, Field
+
+from benchmarks.financebench import percentile
+from output_parser import END_OF_PLAN, LLMCompilerPlanParser
+
+TOOL_NAMES = ["data_node_tool", "maths_tool_agent", "finance_group_tool", "reportgen_tool"]
+
+
+class SyntheticToolInput(BaseModel):
+    query: str = Field(description="The query")
+    context: Optional[List[str]] = Field(default=None, description="Outputs of earlier tasks")
+
+
+def _noop(query: str, context: Optional[List[str]] = None) -> str:
+    return query
+
+
+def make_tools() -> List[StructuredTool]:
+    """Tools with the names and argument shape of the supervisor tools."""
+    return [
+        StructuredTool.from_function(_noop, name=name, description=f"{name}(query, context)", args_schema=SyntheticToolInput)
+        for name in TOOL_NAMES
+    ]
+
+
+def make_plan(n_tasks: int, dependencies: str, deep_window: int = 8, seed: int = 0) -> Tuple[str, int]:
+    """
+    Planner output with `n_tasks` tool calls and a final join.
+
+    Args:
+        n_tasks (int): Number of tool calls
+        dependencies (str): 'chain', 'fan' or 'deep'
+        deep_window (int): Number of preceding tasks referenced by the 'deep' pattern
+        seed (int): Seed of the 'fan' pattern
+
+    Returns:
+        Tuple[str, int]: The plan text, and the number of tasks it holds including the join
+    """
+    rng = random.Random(seed)
+    lines = []
+    for idx in range(1, n_tasks + 1):
+        if idx == 1:
+            refs = []
+        elif dependencies == "chain":
+            refs = [idx - 1]
+        elif dependencies == "fan":
+            refs = sorted(rng.sample(range(1, idx), min(3, idx - 1)))
+        elif dependencies == "deep":
+            refs = list(range(max(1, idx - deep_window), idx))
+        else:
+            raise ValueError(f"Unknown dependency pattern '{dependencies}'.")
+        tool = TOOL_NAMES[idx % len(TOOL_NAMES)]
+        context = "[" + ", ".join(f'"${ref}"' for ref in refs) + "]"
+        lines.append(f"Thought: Task {idx} needs the results of {len(refs)} earlier tasks")
+        lines.append(f'{idx}. {tool}(query="Revenue of company {idx} in USD for fiscal year 2022", context={context})')
+    lines.append(f"{n_tasks + 1}. join()")
+    lines.append(END_OF_PLAN)
+    return "\n".join(lines) + "\n", n_tasks + 1
+
+
+def tokenize_plan(plan: str, token_size: str) -> List[str]:
+    """Cut a plan into tokens of `token_size` characters, or whole lines for 'line'."""
+    if token_size == "line":
+        return plan.splitlines(keepends=True)
+    size = int(token_size)
+    return [plan[i:i + size] for i in range(0, len(plan), size)]
+
+
+def _timed_tokens(tokens: List[str], completed_at: Dict[int, float]) -> Iterator[str]:
+    """Yield tokens, recording when the token completing each line was handed to the parser."""
+    line = 0
+    for token in tokens:
+        newlines = token.count("\n")
+        now = time.perf_counter()
+        for _ in range(newlines):
+            line += 1
+            completed_at[line] = now
+        yield token
+
+
+def _task_lines(tokens: List[str]) -> Dict[int, int]:
+    """Task index -> number of the line holding it (1-based)."""
+    lines = {}
+    for number, line in enumerate("".join(tokens).splitlines(), start=1):
+        head = line.split(".", 1)[0]
+        if head.isdigit():
+            lines[int(head)] = number
+    return lines
+
+
+def run_once(parser: LLMCompilerPlanParser, tokens: List[str], mode: str) -> Dict[str, Any]:
+    """Parse one token stream, returning its duration and the line-to-task latencies."""
+    completed_at: Dict[int, float] = {}
+    task_lines = _task_lines(tokens)
+    source = _timed_tokens(tokens, completed_at)
+    stream = parser._transform(source) if mode == "direct" else parser.transform(source)
+    latencies = []
+    emitted = 0
+    start = time.perf_counter()
+    for task in stream:
+        now = time.perf_counter()
+        emitted += 1
+        # The last line may be flushed at the end of the stream, after its newline
+        completed = completed_at.get(task_lines.get(task["idx"], -1))
+        if completed is not None:
+            latencies.append(now - completed)
+    duration = time.perf_counter() - start
+    return {"duration_s": duration, "latencies_s": latencies, "tasks": emitted}
+
+
+def peak_memory(parser: LLMCompilerPlanParser, tokens: List[str], mode: str) -> int:
+    """Peak bytes allocated while parsing the token stream."""
+    tracemalloc.start()
+    try:
+        stream = parser._transform(iter(tokens)) if mode == "direct" else parser.transform(iter(tokens))
+        for _ in stream:
+            pass
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(n_tasks: int, dependencies: str, token_size: str, mode: str, repeats: int, deep_window: int) -> Dict[str, Any]:
+    parser = LLMCompilerPlanParser(tools=make_tools())
+    plan, expected_tasks = make_plan(n_tasks, dependencies, deep_window)
+    tokens = tokenize_plan(plan, token_size)
+    runs = [run_once(parser, tokens, mode) for _ in range(repeats)]
+    if runs[0]["tasks"] != expected_tasks:
+        raise RuntimeError(f"Parser emitted {runs[0]['tasks']} tasks, the plan holds {expected_tasks}.")
+    duration = statistics.median(run["duration_s"] for run in runs)
+    latencies = [latency for run in runs for latency in run["latencies_s"]]
+    return {
+        "tasks": n_tasks,
+        "dependencies": dependencies,
+        "token_size": token_size,
+        "mode": mode,
+        "tokens": len(tokens),
+        "chars": len(plan),
+        "duration_ms": duration * 1e3,
+        "tokens_per_s": len(tokens) / duration,
+        "tasks_per_s": expected_tasks / duration,
+        "emit_latency_us": {
+            "p50": percentile(latencies, 50) * 1e6,
+            "p99": percentile(latencies, 99) * 1e6,
+            "max": max(latencies) * 1e6,
+        },
+        "peak_memory_kb": peak_memory(parser, tokens, mode) / 1024,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    parser = argparse.ArgumentParser(description="Benchmark LLMCompilerPlanParser on synthetic token streams.")
+    parser.add_argument("--tasks", nargs="+", type=int, default=[5, 50, 500])
+    parser.add_argument("--dependencies", nargs="+", choices=["chain", "fan", "deep"], default=["chain", "deep"])
+    parser.add_argument("--deep-window", type=int, default=8)
+    parser.add_argument("--token-sizes", nargs="+", default=["1", "4", "16", "line"])
+    parser.add_argument("--modes", nargs="+", choices=["direct", "runnable"], default=["direct", "runnable"])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--report", default="benchmark_results/plan_parser.json")
+    args = parser.parse_args(argv)
+
+    rows = []
+    for n_tasks in args.tasks:
+        for dependencies in args.dependencies:
+            for token_size in args.token_sizes:
+                for mode in args.modes:
+                    row = benchmark(n_tasks, dependencies, token_size, mode, args.repeats, args.deep_window)
+                    rows.append(row)
+                    print(
+                        f"tasks={n_tasks:>4} deps={dependencies:5} token={token_size:>4} {mode:8} "
+                        f"{row['tokens_per_s']:>12,.0f} tok/s  emit p50={row['emit_latency_us']['p50']:8.1f}us "
+                        f"p99={row['emit_latency_us']['p99']:8.1f}us  peak={row['peak_memory_kb']:8.1f}KiB"
+                    )
+
+    os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+    with open(args.report, "w", encoding="utf-8") as file:
+        json.dump({"config": vars(args), "results": rows}, file, indent=2)
+    return rows
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+Retrieval-only benchmark on the FinanceBench evidence.
+
+Every question of dataset_finance_bench.csv lists its evidence: document,
+page number and page text. The pages of all questions form the corpus, split locally with a
+RecursiveCharacterTextSplitter at each swept chunk size (the RAG pipeline
+itself relies on Pathway's server-side chunking), and each retriever backend
+is scored against the gold pages without running any LLM:
+
+- recall@k: share of the gold evidence pages found in the top k chunks
+- evidence recall@k: same, counting only chunks that overlap the evidence text itself
+- MRR: reciprocal rank of the first chunk from a gold page
+- latency: per query, p50 / p95
+
+Backends:
+- bm25: local BM25 index (rag.local_index)
+- dense: local in-memory cosine index over OpenAI (or offline hash) embeddings
+- hybrid: reciprocal rank fusion of bm25 and dense
+- pathway: the remote Pathway server at PATHWAY_URL, chunked server side, so not part of the chunk size sweep
+
+    python -m benchmarks.retrieval --backends bm25 dense hybrid --chunk-sizes 500 1000 2000 \
+        --top-k 1 3 5 10 --report benchmark_results/retrieval.json
+
+The gold pages alone are an easy corpus: filtered to the gold document, as the
+RAG graphs filter by company and year (--scope doc), a question has only its
+own evidence pages to pick from. --filings points at a directory of the full
+filings (<doc_name>.pdf, e.g. the FinanceBench pdfs), whose other pages are
+indexed as distractors. Without it, --scope corpus (the default) searches all
+the evidence pages, and --scope doc numbers are reported as an upper bound.
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from benchmarks.financebench import DATASET_PATH, percentile
+from rag.local_index import BM25Index, tokenize
+
+# Reciprocal rank fusion constant
+RRF_K = 60
+# Share of a chunk's words that must appear in the evidence text for an evidence hit
+EVIDENCE_OVERLAP = 0.5
+
+Page = Tuple[str, int]
+
+
+def load_evidence(path: str = DATASET_PATH) -> Tuple[List[Dict[str, Any]], Dict[Page, str]]:
+    """
+    Questions with their gold evidence, and the corpus of evidence pages.
+
+    Returns:
+        Tuple[List[dict], Dict[Page, str]]: Questions as {"id", "question", "doc_name", "evidence":
+            [{"page": (doc_name, page_num), "text"}]}, and the text of every (doc_name, page_num)
+    """
+    pages: Dict[Page, str] = {}
+    questions = []
+    with open(path, encoding="utf-8") as file:
+        for row in csv.DictReader(file):
+            evidence = []
+            for item in json.loads(row["evidence"]):
+                page = (item["doc_name"], int(item["evidence_page_num"]))
+                pages.setdefault(page, item["evidence_text_full_page"])
+                evidence.append({"page": page, "text": item["evidence_text"]})
+            questions.append(
+                {"id": row["financebench_id"], "question": row["question"], "doc_name": row["doc_name"], "evidence": evidence}
+            )
+    return questions, pages
+
+
+def load_filings(directory: str, pages: Dict[Page, str]) -> Dict[Page, str]:
+    """
+    The corpus with every page of the full filings added as distractors.
+
+    Args:
+        directory (str): Directory of <doc_name>.pdf filings, missing ones are skipped
+        pages (Dict[Page, str]): Gold evidence pages, kept as they are
+
+    Returns:
+        Dict[Page, str]: Text of every (doc_name, page_num), page numbers starting at 0 as in FinanceBench
+    """
+    from pypdf import PdfReader
+
+    corpus = dict(pages)
+    for doc_name in sorted({doc_name for doc_name, _ in pages}):
+        path = os.path.join(directory, f"{doc_name}.pdf")
+        if not os.path.exists(path):
+            continue
+        for page_num, page in enumerate(PdfReader(path).pages):
+            corpus.setdefault((doc_name, page_num), page.extract_text() or "")
+    return corpus
+
+
+def chunk_pages(pages: Dict[Page, str], chunk_size: int, chunk_overlap: int) -> List[dict]:
+    """Split the corpus pages into {"text", "metadata"} chunks."""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = []
+    for (doc_name, page_num), text in pages.items():
+        for piece in splitter.split_text(text):
+            chunks.append({"text": piece, "metadata": {"path": f"{doc_name}.pdf", "doc_name": doc_name, "page": page_num}})
+    return chunks
+
+
+def doc_filter(doc_name: str) -> str:
+    """Metadata filter on the source document, in the form the RAG graphs send to Pathway."""
+    return f"contains(path,`{doc_name}`)"
+
+
+class DenseIndex:
+    """Exact cosine similarity index over chunk embeddings."""
+
+    def __init__(self, chunks: Sequence[dict], embed_documents: Callable, embed_query: Callable, batch_size: int = 256):
+        self.chunks = list(chunks)
+        self.embed_query = embed_query
+        vectors = []
+        texts = [chunk["text"] for chunk in self.chunks]
+        for start in range(0, len(texts), batch_size):
+            vectors.extend(embed_documents(texts[start:start + batch_size]))
+        matrix = np.array(vectors, dtype=np.float32)
+        self.matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        self.paths = [chunk["metadata"]["path"] for chunk in self.chunks]
+
+    def query(self, query: str, k: int = 3, metadata_filter: Optional[str] = None) -> List[dict]:
+        vector = np.array(self.embed_query(query), dtype=np.float32)
+        similarities = self.matrix @ (vector / max(np.linalg.norm(vector), 1e-12))
+        if metadata_filter:
+            # Only the contains(path, `...`) filters of the benchmark are supported
+            needle = metadata_filter.split("`")[1]
+            mask = np.array([needle in path for path in self.paths])
+            similarities = np.where(mask, similarities, -np.inf)
+        order = np.argsort(-similarities)[:k]
+        return [
+            {**self.chunks[i], "dist": float(1 - similarities[i])}
+            for i in order
+            if np.isfinite(similarities[i])
+        ]
+
+
+class HybridIndex:
+    """Reciprocal rank fusion of several indexes."""
+
+    def __init__(self, indexes: Sequence[Any], depth: int = 50):
+        self.indexes = list(indexes)
+        self.depth = depth
+
+    def query(self, query: str, k: int = 3, metadata_filter: Optional[str] = None) -> List[dict]:
+        scores: Dict[str, float] = defaultdict(float)
+        chunks: Dict[str, dict] = {}
+        for index in self.indexes:
+            for rank, result in enumerate(index.query(query, k=max(k, self.depth), metadata_filter=metadata_filter)):
+                scores[result["text"]] += 1 / (RRF_K + rank + 1)
+                chunks.setdefault(result["text"], result)
+        ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+        return [{**chunks[text], "dist": 1 - scores[text] * RRF_K / len(self.indexes)} for text in ranked]
+
+
+def make_embeddings(model: str) -> Tuple[Callable, Callable]:
+    """
+    embed_documents and embed_query functions.
+
+    Args:
+        model (str): OpenAI embedding model name, or 'hash' for offline bag-of-words hashing
+    """
+    if model == "hash":
+        from benchmarks.stand_in import hash_embedding
+
+        def embed_documents(texts):
+            return [hash_embedding(tokenize(text), 1024) for text in texts]
+
+        return embed_documents, lambda text: embed_documents([text])[0]
+    from langchain_openai import OpenAIEmbeddings
+
+    embeddings = OpenAIEmbeddings(model=model)
+    return embeddings.embed_documents, embeddings.embed_query
+
+
+def _overlaps(chunk: str, evidence: str) -> bool:
+    words = set(tokenize(chunk))
+    return bool(words) and len(words & set(tokenize(evidence))) / len(words) >= EVIDENCE_OVERLAP
+
+
+def _result_page(result: dict, evidence: List[dict]) -> Optional[Page]:
+    """
+    Page a result comes from. Without page metadata (Pathway chunks), a result of a gold
+    document is assigned the gold page whose evidence text it overlaps.
+    """
+    metadata = result.get("metadata", {})
+    doc_name = metadata.get("doc_name") or os.path.splitext(os.path.basename(str(metadata.get("path", ""))))[0]
+    page = metadata.get("page")
+    if page is not None:
+        return (doc_name, int(page))
+    return next(
+        (item["page"] for item in evidence if item["page"][0] == doc_name and _overlaps(result["text"], item["text"])),
+        None,
+    )
+
+
+def score_question(results: List[dict], evidence: List[dict], k: int) -> Dict[str, float]:
+    """recall@k, evidence recall@k and reciprocal rank of one question."""
+    top = results[:k]
+    pages = [_result_page(result, evidence) for result in top]
+    gold_pages = {item["page"] for item in evidence}
+    found = {page for page in pages if page in gold_pages}
+    evidence_found = sum(
+        1
+        for item in evidence
+        if any(page == item["page"] and _overlaps(result["text"], item["text"]) for page, result in zip(pages, top))
+    )
+    rank = next((i + 1 for i, page in enumerate(pages) if page in gold_pages), None)
+    return {
+        "recall": len(found) / len(gold_pages),
+        "evidence_recall": evidence_found / len(evidence),
+        "reciprocal_rank": 1 / rank if rank else 0.0,
+    }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    # None without any question, as in the financebench report
+    return seconds * 1000 if seconds is not None else None
+
+
+def evaluate(index: Any, questions: List[dict], top_ks: Sequence[int], scope: str) -> Dict[str, Any]:
+    """Query every question once at the largest k and score all cut-offs."""
+    max_k = max(top_ks)
+    latencies, per_k = [], defaultdict(list)
+    for question in questions:
+        metadata_filter = doc_filter(question["doc_name"]) if scope == "doc" else None
+        start = time.perf_counter()
+        results = index.query(question["question"], k=max_k, metadata_filter=metadata_filter)
+        latencies.append(time.perf_counter() - start)
+        for k in top_ks:
+            per_k[k].append(score_question(results, question["evidence"], k))
+    return {
+        "latency_ms": {"p50": _ms(percentile(latencies, 50)), "p95": _ms(percentile(latencies, 95))},
+        "metrics": {
+            k: {
+                "recall": float(np.mean([s["recall"] for s in scores])),
+                "evidence_recall": float(np.mean([s["evidence_recall"] for s in scores])),
+                "mrr": float(np.mean([s["reciprocal_rank"] for s in scores])),
+            }
+            for k, scores in per_k.items()
+        },
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    parser = argparse.ArgumentParser(description="Score retriever backends against the FinanceBench evidence.")
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    parser.add_argument("--backends", nargs="+", choices=["bm25", "dense", "hybrid", "pathway"], default=["bm25", "dense", "hybrid"])
+    parser.add_argument("--chunk-sizes", nargs="+", type=int, default=[500, 1000, 2000])
+    parser.add_argument("--chunk-overlap", type=float, default=0.1, help="Overlap as a share of the chunk size")
+    parser.add_argument("--top-k", nargs="+", type=int, default=[1, 3, 5, 10, 20])
+    parser.add_argument("--scope", choices=["doc", "corpus"], default="corpus")
+    parser.add_argument("--filings", help="Directory of the full filings, <doc_name>.pdf, indexed as distractors")
+    parser.add_argument("--embedding-model", default="text-embedding-3-small", help="OpenAI model, or 'hash' to run offline")
+    parser.add_argument("--limit", type=int, help="Score only the first N questions")
+    parser.add_argument("--report", default="benchmark_results/retrieval.json")
+    args = parser.parse_args(argv)
+
+    questions, pages = load_evidence(args.dataset)
+    questions = questions[: args.limit] if args.limit else questions
+    evidence_pages = len(pages)
+    if args.filings:
+        pages = load_filings(args.filings, pages)
+    print(f"{len(questions)} questions, {evidence_pages} evidence pages, {len(pages) - evidence_pages} distractor pages")
+    # Filtered to its document, a question only has its own evidence pages to pick from
+    upper_bound = args.scope == "doc" and len(pages) == evidence_pages
+    if upper_bound:
+        print("--scope doc without distractor pages: recall is an upper bound")
+    embed = make_embeddings(args.embedding_model) if {"dense", "hybrid"} & set(args.backends) else None
+
+    rows = []
+
+    def record(backend: str, chunk_size: Optional[int], n_chunks: Optional[int], index: Any) -> None:
+        result = evaluate(index, questions, args.top_k, args.scope)
+        for k, metrics in result["metrics"].items():
+            rows.append({"backend": backend, "chunk_size": chunk_size, "chunks": n_chunks, "k": k,
+                         **metrics, "latency_ms": result["latency_ms"], "upper_bound": upper_bound})
+            print(f"{backend:8} chunk={chunk_size!s:>5} k={k:>3} recall={metrics['recall']:.3f} "
+                  f"evidence_recall={metrics['evidence_recall']:.3f} mrr={metrics['mrr']:.3f} "
+                  f"p50={result['latency_ms']['p50']:.1f}ms" + (" (upper bound)" if upper_bound else ""))
+
+    for chunk_size in args.chunk_sizes:
+        local = [backend for backend in args.backends if backend != "pathway"]
+        if not local:
+            break
+        chunks = chunk_pages(pages, chunk_size, int(chunk_size * args.chunk_overlap))
+        indexes: Dict[str, Any] = {}
+        if {"bm25", "hybrid"} & set(local):
+            indexes["bm25"] = BM25Index(chunks)
+        if {"dense", "hybrid"} & set(local):
+            indexes["dense"] = DenseIndex(chunks, *embed)
+        if "hybrid" in local:
+            indexes["hybrid"] = HybridIndex([indexes["bm25"], indexes["dense"]])
+        for backend in local:
+            record(backend, chunk_size, len(chunks), indexes[backend])
+
+    if "pathway" in args.backends:
+        from rag.transport import get_transport
+
+        record("pathway", None, None, get_transport(os.getenv("PATHWAY_URL", "http://172.30.2.194:8767")))
+
+    report = {"config": {k: v for k, v in vars(args).items()}, "questions": len(questions),
+              "evidence_pages": evidence_pages, "distractor_pages": len(pages) - evidence_pages, "results": rows}
+    os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+    with open(args.report, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    return rows
+
+
+if __name__ == "__main__":
+    main()
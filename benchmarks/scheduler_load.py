@@ -0,0 +1,400 @@
+"""
+Load test of the LLMCompiler scheduler and the graph built by create_agent.
+
+Drives create_agent with a deterministic fake chat model and synthetic tools,
+so only the orchestration code is measured:
+
+- the fake planner streams a plan of `--tasks` tool calls with a dependency
+  pattern ('chain', 'fan', 'wide'), at `--token-delay-ms` per token
+- the fake joiner answers through the same tool-calling path as
+  with_structured_output, replanning `--replans` times before answering
+- synthetic tools sleep a lognormal latency of median `--tool-latency-ms`
+
+Requests are sent at each concurrency level of `--concurrency`. Each tool
+call records when it started and ended, and the fake planner records when
+each plan line was emitted. From those timestamps the harness reports, per
+concurrency level:
+
+- throughput (requests/s) and end-to-end latency percentiles
+- queue wait: time from a task being ready (line emitted and all
+  dependencies done) to its tool starting
+- scheduling overhead: how much later the last task of a plan finished than
+  with zero-cost dispatch, given the same emission times and tool durations
+- peak and mean number of live threads
+
+    python -m benchmarks.scheduler_load --concurrency 1 4 16 --requests 32 --tasks 8
+    python -m benchmarks.scheduler_load --async --tool-limits tool_0=2 --concurrency 64 --requests 256
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.tools import StructuredTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import BaseModel, ConfigDict, Field
+
+from benchmarks.financebench import percentile
+from benchmarks.stand_in import sample_latency
+from execution_service import EXECUTION_MAX_WORKERS, configure_execution_service, get_execution_service, parse_limits
+from output_parser import END_OF_PLAN
+
+REQUEST_PATTERN = r"\br(\d+)\b"
+BEGIN_COUNTING_PATTERN = r"Begin counting at : (\d+)"
+
+
+class Recorder:
+    """Thread safe store of the timestamps of a load test."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (request, task idx) -> time the plan line was handed to the parser
+        self.emitted: Dict[Tuple[int, int], float] = {}
+        # (request, task idx) -> dependencies
+        self.dependencies: Dict[Tuple[int, int], List[int]] = {}
+        # (request, task idx) -> (start, end) of the tool call
+        self.calls: Dict[Tuple[int, int], Tuple[float, float]] = {}
+
+    def plan_line(self, request: int, idx: int, dependencies: List[int]) -> None:
+        with self._lock:
+            self.emitted[(request, idx)] = time.perf_counter()
+            self.dependencies[(request, idx)] = dependencies
+
+    def tool_call(self, request: int, idx: int, start: float, end: float) -> None:
+        with self._lock:
+            self.calls[(request, idx)] = (start, end)
+
+    def request_metrics(self, request: int) -> Dict[str, Any]:
+        """Queue waits of the tasks of a request, and its scheduling overhead."""
+        with self._lock:
+            calls = {idx: span for (r, idx), span in self.calls.items() if r == request}
+            emitted = {idx: t for (r, idx), t in self.emitted.items() if r == request}
+            dependencies = {idx: deps for (r, idx), deps in self.dependencies.items() if r == request}
+        waits = []
+        ideal_end: Dict[int, float] = {}
+        for idx in sorted(calls):
+            start, end = calls[idx]
+            deps = [dep for dep in dependencies.get(idx, []) if dep in calls]
+            ready = max([emitted.get(idx, start)] + [calls[dep][1] for dep in deps])
+            waits.append(max(0.0, start - ready))
+            ideal_start = max([emitted.get(idx, start)] + [ideal_end[dep] for dep in deps if dep in ideal_end])
+            ideal_end[idx] = ideal_start + (end - start)
+        overhead = max(end for _, end in calls.values()) - max(ideal_end.values()) if calls else 0.0
+        return {"queue_waits_s": waits, "overhead_s": max(0.0, overhead)}
+
+
+class FakeCompilerModel(BaseChatModel):
+    """
+    Deterministic stand-in for the planner and joiner LLMs.
+
+    Without bound tools it streams an LLMCompiler plan, with bound tools (the joiner's
+    with_structured_output) it returns a JoinOutputs tool call.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    recorder: Any
+    tool_names: List[str]
+    tasks: int = 5
+    dependencies: str = "fan"
+    replans: int = 0
+    token_delay: float = 0.0
+    seed: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-llm-compiler"
+
+    def bind_tools(self, tools: Sequence[Any], tool_choice: Optional[Any] = None, **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    @staticmethod
+    def _request(messages: List[BaseMessage]) -> int:
+        for message in messages:
+            if isinstance(message, HumanMessage) and (match := re.search(REQUEST_PATTERN, str(message.content))):
+                return int(match.group(1))
+        return -1
+
+    def _plan(self, messages: List[BaseMessage]) -> Tuple[int, List[Tuple[str, Optional[Tuple[int, List[int]]]]]]:
+        """Plan lines, each with the (task idx, dependencies) it holds, if any."""
+        request = self._request(messages)
+        first = 1
+        if match := re.search(BEGIN_COUNTING_PATTERN, str(messages[-1].content)):
+            first = max(1, int(match.group(1)))
+        rng = random.Random(f"{self.seed}-{request}-{first}")
+        lines = [(f"Thought: Plan for r{request}", None)]
+        for idx in range(first, first + self.tasks):
+            earlier = list(range(first, idx))
+            if not earlier or self.dependencies == "wide":
+                deps = []
+            elif self.dependencies == "chain":
+                deps = [idx - 1]
+            else:
+                deps = sorted(rng.sample(earlier, min(2, len(earlier))))
+            context = "[" + ", ".join(f'"${dep}"' for dep in deps) + "]"
+            tool = self.tool_names[idx % len(self.tool_names)]
+            lines.append((f'{idx}. {tool}(query="r{request} t{idx}", context={context})', (idx, deps)))
+        lines.append((f"{first + self.tasks}. join()", None))
+        lines.append((END_OF_PLAN, None))
+        return request, lines
+
+    def _join(self, messages: List[BaseMessage], tools: List[dict]) -> AIMessage:
+        # Replan feedback, not the system message of the joiner prompt
+        attempts = sum(
+            1 for message in messages
+            if isinstance(message, SystemMessage) and str(message.content).startswith("Context from last attempt")
+        )
+        if attempts < self.replans:
+            action = {"feedback": f"Attempt {attempts + 1} needs another round"}
+        else:
+            action = {"response": f"Answer for r{self._request(messages)}"}
+        name = tools[0]["function"]["name"]
+        return AIMessage(
+            content="",
+            tool_calls=[{"name": name, "args": {"thought": "Enough results", "action": action}, "id": f"call_{attempts}"}],
+        )
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        if kwargs.get("tools"):
+            message = self._join(messages, kwargs["tools"])
+        else:
+            content = "".join(chunk.message.content for chunk in self._stream(messages, stop, run_manager, **kwargs))
+            message = AIMessage(content=content)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        request, lines = self._plan(messages)
+        for line, task in lines:
+            # Roughly one token per word
+            words = re.findall(r"\S+\s*", line + "\n")
+            for i, word in enumerate(words):
+                if self.token_delay:
+                    time.sleep(self.token_delay)
+                if task is not None and i == len(words) - 1:
+                    self.recorder.plan_line(request, task[0], task[1])
+                yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+
+
+class SyntheticToolInput(BaseModel):
+    query: str = Field(description="The query")
+    context: Optional[List[str]] = Field(default=None, description="Outputs of earlier tasks")
+
+
+def make_tools(recorder: Recorder, n_tools: int, latency_ms: float, sigma: float, seed: int = 0,
+               native_async: bool = False) -> List[StructuredTool]:
+    """
+    Tools sleeping a lognormal latency and recording their call spans.
+
+    With `native_async`, the tools also have a coroutine, so the asyncio scheduler awaits them
+    instead of offloading them to the threads of the event loop's executor.
+    """
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+    spec = {"distribution": "lognormal", "median_ms": latency_ms, "sigma": sigma}
+
+    def sample() -> float:
+        with rng_lock:
+            return sample_latency(spec, rng)
+
+    def record(query: str, start: float) -> str:
+        match = re.search(r"r(-?\d+) t(\d+)", query)
+        if match:
+            recorder.tool_call(int(match.group(1)), int(match.group(2)), start, time.perf_counter())
+        return f"result of {query}"
+
+    def call(query: str, context: Optional[List[str]] = None) -> str:
+        start = time.perf_counter()
+        time.sleep(sample())
+        return record(query, start)
+
+    async def acall(query: str, context: Optional[List[str]] = None) -> str:
+        start = time.perf_counter()
+        await asyncio.sleep(sample())
+        return record(query, start)
+
+    return [
+        StructuredTool.from_function(call, coroutine=acall if native_async else None, name=f"tool_{i}",
+                                     description=f"tool_{i}(query: str, context: list) -> str",
+                                     args_schema=SyntheticToolInput)
+        for i in range(n_tools)
+    ]
+
+
+def make_prompts() -> Tuple[ChatPromptTemplate, ChatPromptTemplate]:
+    """Local planner and joiner prompts with the variables of the hub prompts."""
+    planner_prompt = ChatPromptTemplate.from_messages(
+        [("system", "Plan with {num_tools} tools:\n{tool_descriptions}\n{replan}"), MessagesPlaceholder("messages")]
+    )
+    joiner_prompt = ChatPromptTemplate.from_messages(
+        [("system", "Decide the next action.{examples}"), MessagesPlaceholder("messages")]
+    ).partial(examples="")
+    return planner_prompt, joiner_prompt
+
+
+class ThreadSampler:
+    """Samples the number of live threads in the background."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: List[int] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.samples.append(threading.active_count())
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "ThreadSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def run_level(agent: Any, recorder: Recorder, concurrency: int, requests: int, first_request: int,
+              use_async: bool = False) -> Dict[str, Any]:
+    """Send `requests` requests with `concurrency` in flight and aggregate their metrics."""
+    latencies: Dict[int, float] = {}
+    errors = []
+
+    def send(request: int) -> None:
+        start = time.perf_counter()
+        try:
+            agent.invoke({"messages": [HumanMessage(content=f"Question r{request}")]}, {"recursion_limit": 100})
+        except Exception as e:
+            errors.append(repr(e))
+        latencies[request] = time.perf_counter() - start
+
+    async def asend(request: int, slots: asyncio.Semaphore) -> None:
+        async with slots:
+            start = time.perf_counter()
+            try:
+                await agent.ainvoke({"messages": [HumanMessage(content=f"Question r{request}")]}, {"recursion_limit": 100})
+            except Exception as e:
+                errors.append(repr(e))
+            latencies[request] = time.perf_counter() - start
+
+    async def asend_all(ids: List[int]) -> None:
+        slots = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*(asend(request, slots) for request in ids))
+
+    ids = list(range(first_request, first_request + requests))
+    with ThreadSampler() as sampler:
+        start = time.perf_counter()
+        if use_async:
+            asyncio.run(asend_all(ids))
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(send, ids))
+        wall = time.perf_counter() - start
+
+    per_request = [recorder.request_metrics(request) for request in ids]
+    waits = [wait for metrics in per_request for wait in metrics["queue_waits_s"]]
+    overheads = [metrics["overhead_s"] for metrics in per_request]
+    e2e = list(latencies.values())
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "throughput_rps": requests / wall,
+        "latency_ms": {"p50": percentile(e2e, 50) * 1e3, "p95": percentile(e2e, 95) * 1e3, "max": max(e2e) * 1e3},
+        "queue_wait_ms": {
+            "mean": statistics.mean(waits) * 1e3 if waits else None,
+            "p50": percentile(waits, 50) * 1e3 if waits else None,
+            "p95": percentile(waits, 95) * 1e3 if waits else None,
+        },
+        "overhead_ms": {"mean": statistics.mean(overheads) * 1e3, "p95": percentile(overheads, 95) * 1e3},
+        "threads": {"peak": max(sampler.samples), "mean": statistics.mean(sampler.samples)},
+        "execution_service": get_execution_service().metrics(),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    parser = argparse.ArgumentParser(description="Load test the LLMCompiler scheduler with a fake LLM.")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 2, 4, 8, 16])
+    parser.add_argument("--requests", type=int, default=16, help="Requests per concurrency level")
+    parser.add_argument("--tasks", type=int, default=6, help="Tool calls per plan")
+    parser.add_argument("--dependencies", choices=["chain", "fan", "wide"], default="fan")
+    parser.add_argument("--replans", type=int, default=0)
+    parser.add_argument("--tools", type=int, default=4)
+    parser.add_argument("--tool-latency-ms", type=float, default=50.0)
+    parser.add_argument("--tool-latency-sigma", type=float, default=0.3)
+    parser.add_argument("--token-delay-ms", type=float, default=0.0)
+    parser.add_argument("--max-parallelism", type=int, help="Tool calls of a plan running at once")
+    parser.add_argument("--no-pipeline", dest="pipeline", action="store_false",
+                        help="Parse the whole plan before scheduling its tasks")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Send requests with ainvoke, running the asyncio scheduler")
+    parser.add_argument("--sync-tools", action="store_true",
+                        help="With --async, give the tools no coroutine, so they run on executor threads")
+    parser.add_argument("--tool-limits", nargs="*", default=[], metavar="TOOL=N",
+                        help="Concurrent calls per tool, for the asyncio scheduler")
+    parser.add_argument("--max-workers", type=int, help="Threads of the shared execution service")
+    parser.add_argument("--tool-rate-limits", nargs="*", default=[], metavar="TOOL=RPS",
+                        help="Calls per second per tool, on the execution service")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="Keep the scheduler's prints")
+    parser.add_argument("--report", default="benchmark_results/scheduler_load.json")
+    args = parser.parse_args(argv)
+
+    from modular_agent import create_agent
+
+    if args.max_workers or args.tool_rate_limits:
+        configure_execution_service(
+            max_workers=args.max_workers or EXECUTION_MAX_WORKERS,
+            tool_rate_limits=parse_limits(",".join(args.tool_rate_limits)),
+        )
+    recorder = Recorder()
+    tools = make_tools(recorder, args.tools, args.tool_latency_ms, args.tool_latency_sigma, args.seed,
+                       native_async=args.use_async and not args.sync_tools)
+    llm = FakeCompilerModel(
+        recorder=recorder, tool_names=[tool.name for tool in tools], tasks=args.tasks,
+        dependencies=args.dependencies, replans=args.replans, token_delay=args.token_delay_ms / 1000, seed=args.seed,
+    )
+    planner_prompt, joiner_prompt = make_prompts()
+    agent = create_agent(llm, tools, planner_prompt, joiner_prompt, "load-test", args.max_parallelism, args.pipeline,
+                         {name: int(limit) for name, limit in (item.split("=") for item in args.tool_limits)})
+
+    rows = []
+    next_request = 0
+    for concurrency in args.concurrency:
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with quiet:
+            row = run_level(agent, recorder, concurrency, args.requests, next_request, args.use_async)
+        next_request += args.requests
+        rows.append(row)
+        print(
+            f"concurrency={concurrency:>3} {row['throughput_rps']:7.2f} req/s  p50={row['latency_ms']['p50']:8.1f}ms "
+            f"queue wait mean={row['queue_wait_ms']['mean'] or 0:7.1f}ms  overhead mean={row['overhead_ms']['mean']:7.1f}ms "
+            f"threads peak={row['threads']['peak']:>4}  errors={row['errors']}"
+        )
+
+    os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+    with open(args.report, "w", encoding="utf-8") as file:
+        json.dump({"config": vars(args), "results": rows}, file, indent=2)
+    return rows
+
+
+if __name__ == "__main__":
+    main()
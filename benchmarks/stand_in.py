@@ -0,0 +1,672 @@
+"""
+Local stand-in for the external services used by the agents.
+
+Speaks the subset of the APIs the code calls, so the supervisor, the RAG
+graphs and the report generator can be driven at high concurrency without
+network access or API keys:
+
+- OpenAI: POST /v1/chat/completions (plain, tool / structured output calls and
+  SSE streaming) and POST /v1/embeddings
+- Pathway vector server: POST /v1/retrieve, /v1/statistics, /v1/inputs
+- Tavily: POST /search
+- Yahoo Finance: GET /v8/finance/chart/<ticker>, /v10/finance/quoteSummary/<ticker>,
+  the fundamentals time series, and the cookie and crumb yfinance fetches first
+
+Latency, error rate and responses are configured through a JSON file, see
+DEFAULT_CONFIG for the keys. Each endpoint can override the "default" latency
+and error rate, e.g.
+
+    {
+        "latency": {"default": {"distribution": "lognormal", "median_ms": 300, "sigma": 0.4},
+                    "/v1/embeddings": {"distribution": "constant", "ms": 20}},
+        "error_rate": {"default": 0.0, "/v1/retrieve": 0.05},
+        "rules": [{"path": "/v1/chat/completions", "tool": "GradeDocuments",
+                   "pattern": "3M", "response": {"binary_score": "yes"}}]
+    }
+
+Usage:
+    python -m benchmarks.stand_in --config stand_in.json --port 8900
+
+and point the clients at it before the agent modules are imported:
+
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 PATHWAY_URL=http://127.0.0.1:8900
+
+Tavily and yfinance have their hosts hard-coded. In-process, `route_clients`
+redirects the Tavily wrapper used by the graphs, and gives yfinance a session
+sending every request for a yahoo.com host to the stand-in. OpenAIEmbeddings
+downloads its tiktoken encoding on first use, fully offline runs need it in
+TIKTOKEN_CACHE_DIR.
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+
+from rag.local_index import BM25Index, tokenize
+
+DEFAULT_CONFIG: Dict[str, Any] = {
+    "host": "127.0.0.1",
+    "port": 8900,
+    # Per endpoint path, "default" applies to the others
+    "latency": {"default": {"distribution": "constant", "ms": 0}},
+    "error_rate": {"default": 0.0},
+    "error_status": 503,
+    # Streaming speed of chat completions, after the sampled time to first token
+    "tokens_per_second": 0,
+    "embedding_dim": 1536,
+    # Value of string fields of synthesized tool calls without an enum, "yes" lets the graders pass
+    "default_string": "yes",
+    # JSON lines file with {"text", "metadata"} chunks served by /v1/retrieve, the RAG graphs
+    # read metadata["path"] and metadata["category"] ("Table" or "NarrativeText")
+    "corpus": "",
+    "rules": [],
+    "seed": None,
+}
+
+CANNED_CHUNKS = [
+    {
+        "text": "3M Company 2022 Form 10-K. Net sales were $34.2 billion, a decrease of 3.2% from 2021. "
+        "Organic sales growth excluding M&A: Safety and Industrial -0.8%, Transportation and "
+        "Electronics 1.1%, Health Care 3.2%, Consumer -0.9%.",
+        "metadata": {"path": "Financial_Reports/3M_2022.pdf", "category": "NarrativeText"},
+    },
+    {
+        "text": "| Segment | 2022 | 2021 |\n| --- | --- | --- |\n| Safety and Industrial | 11,604 | 12,197 |\n"
+        "| Transportation and Electronics | 8,902 | 9,177 |\n| Health Care | 8,421 | 8,638 |",
+        "metadata": {"path": "Financial_Reports/3M_2022.pdf", "category": "Table"},
+    },
+    {
+        "text": "Capital expenditures were $1,749 million in 2022 and $1,603 million in 2021. "
+        "Free cash flow conversion was 94%.",
+        "metadata": {"path": "Financial_Reports/3M_2022.pdf", "category": "NarrativeText"},
+    },
+]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count, about four characters per token."""
+    return max(1, len(text) // 4)
+
+
+def sample_latency(spec: Dict[str, Any], rng: random.Random) -> float:
+    """
+    Sample a latency in seconds.
+
+    Args:
+        spec (dict): {"distribution": "constant", "ms"}, {"distribution": "uniform", "min_ms", "max_ms"},
+            {"distribution": "normal", "mean_ms", "std_ms"} or {"distribution": "lognormal", "median_ms", "sigma"}
+
+    Returns:
+        float: Latency in seconds, never negative
+    """
+    distribution = spec.get("distribution", "constant")
+    if distribution == "constant":
+        ms = spec.get("ms", 0)
+    elif distribution == "uniform":
+        ms = rng.uniform(spec["min_ms"], spec["max_ms"])
+    elif distribution == "normal":
+        ms = rng.gauss(spec["mean_ms"], spec["std_ms"])
+    elif distribution == "lognormal":
+        ms = spec["median_ms"] * math.exp(rng.gauss(0, spec.get("sigma", 0.5)))
+    else:
+        raise ValueError(f"Unknown latency distribution '{distribution}'.")
+    return max(0.0, ms) / 1000
+
+
+def hash_embedding(tokens: List[Any], dim: int) -> List[float]:
+    """
+    Deterministic bag-of-words embedding, so texts sharing words are close in cosine distance.
+
+    Args:
+        tokens (List): Words or token IDs
+        dim (int): Embedding size
+
+    Returns:
+        List[float]: Unit norm vector
+    """
+    vector = [0.0] * dim
+    for token, count in Counter(tokens).items():
+        digest = hashlib.md5(str(token).encode("utf-8")).digest()
+        index = int.from_bytes(digest[:4], "little") % dim
+        sign = 1.0 if digest[4] % 2 else -1.0
+        vector[index] += sign * count
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def example_value(schema: Dict[str, Any], default_string: str) -> Any:
+    """Value conforming to a JSON schema, used for tool call arguments no rule provides."""
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "const" in schema:
+        return schema["const"]
+    if "default" in schema:
+        return schema["default"]
+    for union in ("anyOf", "oneOf", "allOf"):
+        if union in schema:
+            return example_value(schema[union][0], default_string)
+    kind = schema.get("type", "string")
+    if isinstance(kind, list):
+        kind = kind[0]
+    if kind == "object":
+        return {
+            name: example_value(prop, default_string)
+            for name, prop in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        return [example_value(schema.get("items", {}), default_string)]
+    if kind == "integer":
+        return 1
+    if kind == "number":
+        return 1.0
+    if kind == "boolean":
+        return True
+    if kind == "null":
+        return None
+    return default_string
+
+
+class StandIn:
+    """Responses and failure injection of the stand-in server, independent of HTTP."""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+        self.rng = random.Random(self.config["seed"])
+        self._rng_lock = threading.Lock()
+        corpus = self.config["corpus"]
+        chunks = CANNED_CHUNKS
+        if corpus:
+            with open(corpus, encoding="utf-8") as file:
+                chunks = [json.loads(line) for line in file if line.strip()]
+        self.index = BM25Index(chunks)
+        self.requests = Counter()
+        self.errors = Counter()
+        self._stats_lock = threading.Lock()
+
+    def _for_path(self, key: str, path: str) -> Any:
+        values = self.config[key]
+        return values.get(path, values.get("default"))
+
+    def latency(self, path: str) -> float:
+        spec = self._for_path("latency", path) or {}
+        with self._rng_lock:
+            return sample_latency(spec, self.rng)
+
+    def should_fail(self, path: str) -> bool:
+        rate = self._for_path("error_rate", path) or 0.0
+        with self._rng_lock:
+            return self.rng.random() < rate
+
+    def record(self, path: str, failed: bool) -> None:
+        with self._stats_lock:
+            self.requests[path] += 1
+            if failed:
+                self.errors[path] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {"requests": dict(self.requests), "errors": dict(self.errors)}
+
+    def match_rule(self, path: str, text: str, tool: Optional[str] = None) -> Optional[Any]:
+        """Response of the first rule matching the endpoint, tool name and request text."""
+        for rule in self.config["rules"]:
+            if rule.get("path", path) != path:
+                continue
+            if rule.get("tool") is not None and rule["tool"] != tool:
+                continue
+            if re.search(rule.get("pattern", ""), text, re.IGNORECASE | re.DOTALL):
+                return rule["response"]
+        return None
+
+    # OpenAI
+
+    def chat_completion(self, body: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+        """
+        Build a chat completion.
+
+        Returns:
+            Tuple[dict, List[str]]: The completion, and the pieces its content is streamed in
+        """
+        messages = body.get("messages", [])
+        prompt = "\n".join(
+            m["content"] if isinstance(m.get("content"), str) else json.dumps(m.get("content"))
+            for m in messages
+        )
+        last_user = next(
+            (m.get("content") for m in reversed(messages) if m.get("role") == "user"), prompt
+        )
+        if not isinstance(last_user, str):
+            last_user = json.dumps(last_user)
+
+        message: Dict[str, Any] = {"role": "assistant", "content": None}
+        finish_reason = "stop"
+        tool = self._chosen_tool(body)
+        if tool is not None:
+            name = tool["function"]["name"]
+            arguments = self.match_rule("/v1/chat/completions", prompt, tool=name)
+            if arguments is None:
+                arguments = example_value(
+                    tool["function"].get("parameters", {}), self.config["default_string"]
+                )
+            message["tool_calls"] = [
+                {
+                    "id": f"call_{uuid.uuid4().hex[:24]}",
+                    "type": "function",
+                    "function": {"name": name, "arguments": json.dumps(arguments)},
+                }
+            ]
+            finish_reason = "tool_calls"
+            completion_text = message["tool_calls"][0]["function"]["arguments"]
+        else:
+            content = self.match_rule("/v1/chat/completions", prompt)
+            if content is None:
+                content = f"Stand-in answer to: {last_user[:200]}"
+            message["content"] = content if isinstance(content, str) else json.dumps(content)
+            completion_text = message["content"]
+
+        prompt_tokens = estimate_tokens(prompt)
+        completion_tokens = estimate_tokens(completion_text)
+        completion = {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stand-in"),
+            "choices": [{"index": 0, "message": message, "logprobs": None, "finish_reason": finish_reason}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+        pieces = re.findall(r"\S+\s*", message["content"]) if message["content"] else []
+        return completion, pieces
+
+    @staticmethod
+    def _chosen_tool(body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        tools = body.get("tools") or []
+        choice = body.get("tool_choice")
+        if not tools or choice == "none":
+            return None
+        if isinstance(choice, dict):
+            name = choice.get("function", {}).get("name")
+            return next((t for t in tools if t["function"]["name"] == name), tools[0])
+        return tools[0]
+
+    def stream_chunks(self, completion: Dict[str, Any], pieces: List[str], include_usage: bool) -> List[Dict[str, Any]]:
+        """Split a completion into chat.completion.chunk events."""
+        base = {
+            "id": completion["id"],
+            "object": "chat.completion.chunk",
+            "created": completion["created"],
+            "model": completion["model"],
+        }
+        choice = completion["choices"][0]
+        message = choice["message"]
+        chunks = [{**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]}]
+        if message.get("tool_calls"):
+            call = message["tool_calls"][0]
+            delta = {"tool_calls": [{"index": 0, **call}]}
+            chunks.append({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+        for piece in pieces:
+            chunks.append({**base, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+        chunks.append({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": choice["finish_reason"]}]})
+        if include_usage:
+            chunks.append({**base, "choices": [], "usage": completion["usage"]})
+        return chunks
+
+    def embeddings(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        inputs = body.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        dim = body.get("dimensions") or self.config["embedding_dim"]
+        data = []
+        total_tokens = 0
+        for i, item in enumerate(inputs):
+            # OpenAIEmbeddings sends token IDs, other callers send text
+            tokens = tokenize(item) if isinstance(item, str) else list(item)
+            total_tokens += len(tokens)
+            vector = hash_embedding(tokens, dim)
+            if body.get("encoding_format") == "base64":
+                vector = base64.b64encode(struct.pack(f"<{dim}f", *vector)).decode("ascii")
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "stand-in"),
+            "usage": {"prompt_tokens": total_tokens, "total_tokens": total_tokens},
+        }
+
+    # Pathway
+
+    def retrieve(self, body: Dict[str, Any]) -> List[Dict[str, Any]]:
+        query = body.get("query", "")
+        canned = self.match_rule("/v1/retrieve", query)
+        if canned is not None:
+            return canned
+        return self.index.query(query, k=body.get("k", 3), metadata_filter=body.get("metadata_filter"))
+
+    def statistics(self) -> Dict[str, Any]:
+        now = int(time.time())
+        return {"file_count": len({json.dumps(c.get("metadata", {}), sort_keys=True) for c in self.index.chunks}),
+                "last_modified": now, "last_indexed": now}
+
+    def inputs(self) -> List[Dict[str, Any]]:
+        unique = {json.dumps(c.get("metadata", {}), sort_keys=True) for c in self.index.chunks}
+        return [json.loads(metadata) for metadata in sorted(unique)]
+
+    # Tavily
+
+    def search(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        query = body.get("query", "")
+        results = self.match_rule("/search", query)
+        if results is None:
+            results = [
+                {
+                    "title": f"Result {i + 1} for {query[:60]}",
+                    "url": f"https://example.com/{i + 1}",
+                    "content": chunk["text"],
+                    "score": round(1 - chunk["dist"], 4),
+                    "raw_content": None,
+                }
+                for i, chunk in enumerate(self.index.query(query, k=body.get("max_results", 5)))
+            ]
+        return {"query": query, "answer": None, "images": [], "results": results, "response_time": 0.0}
+
+    # Yahoo Finance
+
+    def chart(self, ticker: str, days: int = 2520) -> Dict[str, Any]:
+        """Daily random walk, seeded by the ticker so repeated requests agree."""
+        rng = random.Random(ticker)
+        end = int(time.time()) // 86400 * 86400
+        timestamps = [end - (days - i) * 86400 for i in range(days)]
+        close, closes = 100.0, []
+        for _ in range(days):
+            close *= math.exp(rng.gauss(0.0003, 0.015))
+            closes.append(round(close, 2))
+        quote = {
+            "open": [round(c * (1 + rng.gauss(0, 0.003)), 2) for c in closes],
+            "high": [round(c * 1.01, 2) for c in closes],
+            "low": [round(c * 0.99, 2) for c in closes],
+            "close": closes,
+            "volume": [rng.randint(1_000_000, 5_000_000) for _ in closes],
+        }
+        return {
+            "chart": {
+                "result": [
+                    {
+                        "meta": {"currency": "USD", "symbol": ticker, "exchangeName": "NYQ",
+                                 "instrumentType": "EQUITY", "regularMarketPrice": closes[-1],
+                                 "dataGranularity": "1d", "timezone": "EST", "gmtoffset": -18000,
+                                 "exchangeTimezoneName": "America/New_York", "priceHint": 2,
+                                 "validRanges": ["1d", "5d", "1mo", "3mo", "6mo", "1y", "2y", "5y", "10y", "ytd", "max"]},
+                        "timestamp": timestamps,
+                        "indicators": {"quote": [quote], "adjclose": [{"adjclose": closes}]},
+                    }
+                ],
+                "error": None,
+            }
+        }
+
+    def quote_summary(self, ticker: str) -> Dict[str, Any]:
+        """Company profile and key figures of `Ticker.info`."""
+        price = self.chart(ticker, days=1)["chart"]["result"][0]["meta"]["regularMarketPrice"]
+        return {
+            "quoteSummary": {
+                "result": [
+                    {
+                        "quoteType": {"symbol": ticker, "quoteType": "EQUITY", "shortName": f"{ticker} Inc.",
+                                      "longName": f"{ticker} Incorporated", "exchange": "NYQ"},
+                        "assetProfile": {"sector": "Industrials", "industry": "Conglomerates", "country": "United States",
+                                         "longBusinessSummary": f"{ticker} Incorporated, stand-in company profile."},
+                        "summaryDetail": {"previousClose": price, "marketCap": 50_000_000_000, "trailingPE": 18.5,
+                                          "dividendYield": 0.02, "beta": 1.0, "currency": "USD"},
+                        "financialData": {"currentPrice": price, "totalRevenue": 30_000_000_000,
+                                          "profitMargins": 0.15, "financialCurrency": "USD"},
+                        "defaultKeyStatistics": {"sharesOutstanding": 500_000_000, "bookValue": 25.0},
+                    }
+                ],
+                "error": None,
+            }
+        }
+
+
+class YahooStandInSession(requests.Session):
+    """requests session of yfinance, sending the requests for yahoo.com hosts to a stand-in."""
+
+    def __init__(self, base_url: str):
+        super().__init__()
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, method: str, url: str, *args: Any, **kwargs: Any) -> requests.Response:
+        parsed = urlparse(url)
+        if parsed.hostname and parsed.hostname.endswith("yahoo.com"):
+            url = self.base_url + (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+        return super().request(method, url, *args, **kwargs)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stand_in: StandIn
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send_json(self, payload: Any, status: int = 200) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_text(self, text: str, cookie: Optional[str] = None) -> None:
+        data = text.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(data)))
+        if cookie:
+            self.send_header("Set-Cookie", cookie)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        return json.loads(raw) if raw else {}
+
+    def _fail(self, path: str) -> bool:
+        """Sleep the sampled latency and inject an error if configured, True if one was sent."""
+        time.sleep(self.stand_in.latency(path))
+        failed = self.stand_in.should_fail(path)
+        self.stand_in.record(path, failed)
+        if failed:
+            status = self.stand_in.config["error_status"]
+            self._send_json(
+                {"error": {"message": "Injected failure", "type": "server_error", "code": status}}, status
+            )
+        return failed
+
+    def do_GET(self) -> None:
+        path = urlparse(self.path).path
+        if path == "/stats":
+            self._send_json(self.stand_in.stats())
+        elif path.startswith("/v8/finance/chart/"):
+            if not self._fail("/v8/finance/chart"):
+                self._send_json(self.stand_in.chart(path.rsplit("/", 1)[-1]))
+        elif path.startswith("/v10/finance/quoteSummary/"):
+            if not self._fail("/v10/finance/quoteSummary"):
+                self._send_json(self.stand_in.quote_summary(path.rsplit("/", 1)[-1]))
+        elif path.startswith("/ws/fundamentals-timeseries/"):
+            self._send_json({"timeseries": {"result": [{}], "error": None}})
+        elif path == "/v1/test/getcrumb":
+            self._send_text("stand-in-crumb")
+        elif path == "/":
+            # fc.yahoo.com, where yfinance gets its cookie
+            self._send_text("", cookie="A3=stand-in; Path=/")
+        else:
+            self._send_json({"error": {"message": f"Unknown path {path}"}}, 404)
+
+    def do_POST(self) -> None:
+        path = urlparse(self.path).path
+        body = self._read_body()
+        handlers = {
+            "/v1/embeddings": self.stand_in.embeddings,
+            "/v1/retrieve": self.stand_in.retrieve,
+            "/v1/statistics": lambda body: self.stand_in.statistics(),
+            "/v1/inputs": lambda body: self.stand_in.inputs(),
+            "/search": self.stand_in.search,
+        }
+        if path == "/v1/chat/completions":
+            self._chat(body)
+        elif path in handlers:
+            if not self._fail(path):
+                self._send_json(handlers[path](body))
+        else:
+            self._send_json({"error": {"message": f"Unknown path {path}"}}, 404)
+
+    def _chat(self, body: Dict[str, Any]) -> None:
+        path = "/v1/chat/completions"
+        if self._fail(path):
+            return
+        completion, pieces = self.stand_in.chat_completion(body)
+        if not body.get("stream"):
+            self._send_json(completion)
+            return
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+        tokens_per_second = self.stand_in.config["tokens_per_second"]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for chunk in self.stand_in.stream_chunks(completion, pieces, include_usage):
+            if tokens_per_second:
+                time.sleep(1 / tokens_per_second)
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def load_config(path: Optional[str] = None) -> Dict[str, Any]:
+    """Read a stand-in configuration, missing keys take their DEFAULT_CONFIG value."""
+    config = dict(DEFAULT_CONFIG)
+    if path:
+        with open(path, encoding="utf-8") as file:
+            config.update(json.load(file))
+    return config
+
+
+def start_server(config: Optional[Dict[str, Any]] = None) -> Tuple[ThreadingHTTPServer, threading.Thread]:
+    """
+    Serve the stand-in from a background thread.
+
+    Args:
+        config (dict, optional): Configuration, see DEFAULT_CONFIG. Port 0 picks a free port.
+
+    Returns:
+        Tuple[ThreadingHTTPServer, Thread]: Call server.shutdown() to stop it
+    """
+    stand_in = StandIn(config)
+    handler = type("BoundStandInHandler", (StandInHandler,), {"stand_in": stand_in})
+    server = ThreadingHTTPServer((stand_in.config["host"], stand_in.config["port"]), handler)
+    server.daemon_threads = True
+    server.request_queue_size = 1024
+    thread = threading.Thread(target=server.serve_forever, name="stand-in", daemon=True)
+    thread.start()
+    return server, thread
+
+
+def server_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+def route_clients(base_url: str) -> Callable[[], None]:
+    """
+    Point the service clients of this process at a stand-in server.
+
+    Must run before the agent modules are imported, they create their clients at import time.
+
+    Returns:
+        Callable: Restores the environment and the clients as they were, e.g. once the server is shut down
+    """
+    undo: List[Callable[[], None]] = []
+
+    def set_env(name: str, value: str) -> None:
+        previous = os.environ.get(name)
+        undo.append(lambda: os.environ.__setitem__(name, previous) if previous is not None
+                    else os.environ.pop(name, None))
+        os.environ[name] = value
+
+    set_env("OPENAI_BASE_URL", f"{base_url}/v1")
+    set_env("OPENAI_API_KEY", os.getenv("OPENAI_API_KEY") or "stand-in")
+    set_env("PATHWAY_URL", base_url)
+    set_env("TAVILY_API_KEY", os.getenv("TAVILY_API_KEY") or "stand-in")
+    try:
+        import langchain_community.utilities.tavily_search as tavily_search
+    except ImportError:
+        pass
+    else:
+        previous_url = tavily_search.TAVILY_API_URL
+        undo.append(lambda: setattr(tavily_search, "TAVILY_API_URL", previous_url))
+        tavily_search.TAVILY_API_URL = base_url
+    try:
+        from yfinance.data import YfData
+    except ImportError:
+        pass
+    else:
+        # yfinance shares one YfData (session, cookie and crumb) across tickers, reset to the stand-in's.
+        # session=None returns the instance as it is
+        data = YfData(session=None)
+        previous = data._session, data._cookie, data._crumb
+
+        def restore_yfinance() -> None:
+            session, data._cookie, data._crumb = previous
+            data._set_session(session)
+
+        undo.append(restore_yfinance)
+        data._set_session(YahooStandInSession(base_url))
+        data._cookie = data._crumb = None
+
+    def restore() -> None:
+        while undo:
+            undo.pop()()
+
+    return restore
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve local stand-ins of the OpenAI, Pathway, Tavily and Yahoo APIs.")
+    parser.add_argument("--config", help="JSON configuration file")
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    if args.host:
+        config["host"] = args.host
+    if args.port is not None:
+        config["port"] = args.port
+    server, thread = start_server(config)
+    print(f"Stand-in serving on {server_url(server)}")
+    try:
+        thread.join()
+    except KeyboardInterrupt:
+        server.shutdown()
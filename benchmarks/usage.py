@@ -0,0 +1,181 @@
+"""
+LLM call and token usage meter for the benchmarks.
+
+Patches the OpenAI client classes, so every chat completion and embedding
+request made through langchain_openai (or the raw client) in this process is
+counted. Usage is attributed to the benchmark item set in `current_item` for
+the calling context; calls made where the context is lost (plain threads)
+are reported under UNATTRIBUTED, so totals stay exact.
+
+Streamed completions (the planner streams its plan) carry no usage unless
+requested, so the meter asks for it with `stream_options={"include_usage": True}`
+and reads it from the final chunk. Streams ending without usage (e.g. replayed
+from a cassette recorded without it) are counted as `unmetered_llm_calls`.
+"""
+
+import contextvars
+import functools
+import inspect
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, Optional
+
+UNATTRIBUTED = "unattributed"
+
+# Benchmark item (e.g. FinanceBench question ID) the running code works for
+current_item: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_item", default=None)
+
+
+class MeteredStream:
+    """Pass-through wrapper of a streamed completion, recording its usage once it is consumed or closed."""
+
+    def __init__(self, stream: Any, meter: "UsageMeter", kind: str):
+        self._stream = stream
+        self._meter = meter
+        self._kind = kind
+        # The item of the context creating the stream, it may be consumed elsewhere
+        self._item = current_item.get()
+        self._usage_chunk: Any = None
+        self._recorded = False
+
+    def _collect(self, chunk: Any) -> Any:
+        if getattr(chunk, "usage", None) is not None:
+            self._usage_chunk = chunk
+        return chunk
+
+    def _finish(self) -> None:
+        if not self._recorded:
+            self._recorded = True
+            self._meter.record(self._kind, self._usage_chunk, self._item, streamed=True)
+
+    def __iter__(self):
+        for chunk in self._stream:
+            yield self._collect(chunk)
+        self._finish()
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield self._collect(chunk)
+        self._finish()
+
+    def __enter__(self) -> "MeteredStream":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._finish()
+        self._stream.close()
+
+    async def __aenter__(self) -> "MeteredStream":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self._finish()
+        # openai.AsyncStream closes asynchronously, a replayed stream synchronously
+        closed = self._stream.close()
+        if inspect.isawaitable(closed):
+            await closed
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+
+class UsageMeter:
+    """Counts OpenAI calls and tokens per benchmark item."""
+
+    def __init__(self):
+        self._usage: Dict[str, Counter] = defaultdict(Counter)
+        self._lock = threading.Lock()
+        self._originals: Dict[Any, Callable] = {}
+
+    def record(self, kind: str, response: Any, item: Optional[str] = None, streamed: bool = False) -> None:
+        """
+        Account one API response, kind is 'llm' or 'embedding'.
+
+        Args:
+            response: The response, or for a stream its chunk carrying the usage (None if none did)
+            item (str, optional): Item the call works for, defaults to the one of the calling context
+            streamed (bool): Whether the response was streamed, a stream without usage is unmetered
+        """
+        counts = Counter({f"{kind}_calls": 1})
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            if kind == "llm":
+                counts["prompt_tokens"] += usage.prompt_tokens or 0
+                counts["completion_tokens"] += usage.completion_tokens or 0
+            else:
+                counts["embedding_tokens"] += usage.prompt_tokens or 0
+        elif streamed:
+            counts[f"unmetered_{kind}_calls"] += 1
+        key = item or current_item.get() or UNATTRIBUTED
+        with self._lock:
+            self._usage[key].update(counts)
+
+    def _wrap(self, create: Callable, kind: str) -> Callable:
+        meter = self
+
+        @functools.wraps(create)
+        def wrapper(self, *args, **kwargs):
+            if kwargs.get("stream"):
+                kwargs["stream_options"] = {"include_usage": True, **(kwargs.get("stream_options") or {})}
+                return MeteredStream(create(self, *args, **kwargs), meter, kind)
+            response = create(self, *args, **kwargs)
+            meter.record(kind, response)
+            return response
+
+        return wrapper
+
+    def _wrap_async(self, create: Callable, kind: str) -> Callable:
+        meter = self
+
+        @functools.wraps(create)
+        async def wrapper(self, *args, **kwargs):
+            if kwargs.get("stream"):
+                kwargs["stream_options"] = {"include_usage": True, **(kwargs.get("stream_options") or {})}
+                return MeteredStream(await create(self, *args, **kwargs), meter, kind)
+            response = await create(self, *args, **kwargs)
+            meter.record(kind, response)
+            return response
+
+        return wrapper
+
+    def install(self) -> "UsageMeter":
+        """Patch the OpenAI client classes."""
+        from openai.resources.chat.completions import AsyncCompletions, Completions
+        from openai.resources.embeddings import AsyncEmbeddings, Embeddings
+
+        for cls, kind, is_async in (
+            (Completions, "llm", False),
+            (AsyncCompletions, "llm", True),
+            (Embeddings, "embedding", False),
+            (AsyncEmbeddings, "embedding", True),
+        ):
+            if cls in self._originals:
+                continue
+            self._originals[cls] = cls.create
+            wrap = self._wrap_async if is_async else self._wrap
+            cls.create = wrap(cls.create, kind)
+        return self
+
+    def uninstall(self) -> None:
+        for cls, create in self._originals.items():
+            cls.create = create
+        self._originals.clear()
+
+    def __enter__(self) -> "UsageMeter":
+        return self.install()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.uninstall()
+
+    def usage(self, item: str) -> Dict[str, int]:
+        """Usage of one item, zero counts omitted."""
+        with self._lock:
+            return dict(self._usage.get(item, Counter()))
+
+    def totals(self) -> Dict[str, int]:
+        """Usage summed over all items, including unattributed calls."""
+        with self._lock:
+            total = Counter()
+            for counts in self._usage.values():
+                total.update(counts)
+            return dict(total)
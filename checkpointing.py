@@ -0,0 +1,90 @@
+"""
+Durable checkpointer for the graphs built by create_agent.
+
+With a checkpointer, a graph saves its state after every step under the
+thread_id of the request (`config["configurable"]["thread_id"]`). A request
+paused for human input is then only a row in the database: nothing waits in
+memory. To resume it, update the state with the answer and continue from the
+stored checkpoint, without re-running the tools or planning again:
+
+    agent = create_agent(..., checkpointer=get_checkpointer())
+    config = {"configurable": {"thread_id": "request-42"}}
+    agent.invoke({"messages": [HumanMessage(content=query)]}, config)
+    if agent.get_state(config).next == ("hitl",):
+        agent.update_state(config, {"user_answer": answer})
+        agent.invoke(None, config)
+
+The database is a SQLite file, CHECKPOINT_DB (default checkpoints.sqlite).
+":memory:" keeps the checkpoints for the life of the process only.
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+from typing import Any, AsyncIterator, Optional
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import CheckpointTuple
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", "checkpoints.sqlite")
+
+
+class SqliteCheckpointer(SqliteSaver):
+    """
+    SqliteSaver usable from ainvoke/astream too.
+
+    SqliteSaver only implements the sync interface, the async one runs it on the
+    default executor of the loop, so the async scheduler never blocks on SQLite.
+    """
+
+    @classmethod
+    def from_path(cls, path: str = CHECKPOINT_DB) -> "SqliteCheckpointer":
+        # The connection is shared by the threads of the pool, SqliteSaver serializes its use
+        conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            conn.execute("PRAGMA journal_mode=WAL")
+        return cls(conn)
+
+    async def _run(self, fn: Any, *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await self._run(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[dict] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        checkpoints = await self._run(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for checkpoint in checkpoints:
+            yield checkpoint
+
+    async def aput(self, config: RunnableConfig, checkpoint: Any, metadata: Any, new_versions: Any) -> RunnableConfig:
+        return await self._run(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Any, task_id: str) -> None:
+        await self._run(self.put_writes, config, writes, task_id)
+
+
+_checkpointer: Optional[SqliteCheckpointer] = None
+_checkpointer_lock = threading.Lock()
+
+
+def get_checkpointer() -> SqliteCheckpointer:
+    """The process-wide checkpointer, on the CHECKPOINT_DB file."""
+    global _checkpointer
+    if _checkpointer is None:
+        with _checkpointer_lock:
+            if _checkpointer is None:
+                _checkpointer = SqliteCheckpointer.from_path()
+    return _checkpointer
+
+
+def configure_checkpointer(path: str = CHECKPOINT_DB) -> SqliteCheckpointer:
+    """Replace the process-wide checkpointer with one on the SQLite file at `path`."""
+    global _checkpointer
+    with _checkpointer_lock:
+        previous, _checkpointer = _checkpointer, SqliteCheckpointer.from_path(path)
+    if previous is not None:
+        previous.conn.close()
+    return _checkpointer
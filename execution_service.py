@@ -0,0 +1,236 @@
+"""
+Process-wide execution service for the agents built by create_agent.
+
+Every plan used to run its tool calls on a thread pool of its own, and the
+nested agents called as tools (maths_tool_agent, finance_tool_agent) created
+more pools inside those. The thread count grew with the number of requests
+times the nesting depth, and nothing bounded the load on the LLM API. All
+agents now share one service, which provides:
+
+- one bounded thread pool for the tool calls of every plan. A plan running
+  inside a worker (a nested agent) queues its tasks on a bounded pool of the
+  next nesting level when no worker is free, so nested agents cannot deadlock
+  the pool, and the scheduler threads never run tool calls themselves.
+- token-bucket rate limits per tool and per model
+- metrics: queue depth, active workers, and time spent waiting on rate limits
+
+Configuration, read when the service is created:
+
+    EXECUTION_MAX_WORKERS=32
+    EXECUTION_NESTED_WORKERS=8                                         # per nesting level
+    EXECUTION_TOOL_RATE_LIMITS="data_node_tool=5,reportgen_tool=0.5"   # calls per second
+    EXECUTION_MODEL_RATE_LIMITS="gpt-4o=10,gpt-4o-mini=20"             # requests per second
+    EXECUTION_RATE_LIMIT_BURST=1                                       # bucket size
+
+or `configure_execution_service(...)` at startup.
+"""
+
+import contextvars
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.rate_limiters import InMemoryRateLimiter
+
+
+def parse_limits(spec: str, cast: Callable[[str], Any] = float) -> Dict[str, Any]:
+    """'reportgen_tool=2,data_node_tool=8' -> {'reportgen_tool': 2.0, 'data_node_tool': 8.0}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, limit = item.rsplit("=", 1)
+        limits[name.strip()] = cast(limit)
+    return limits
+
+
+EXECUTION_MAX_WORKERS = int(os.getenv("EXECUTION_MAX_WORKERS", "32"))
+EXECUTION_NESTED_WORKERS = int(os.getenv("EXECUTION_NESTED_WORKERS", "8"))
+TOOL_RATE_LIMITS = parse_limits(os.getenv("EXECUTION_TOOL_RATE_LIMITS", ""))
+MODEL_RATE_LIMITS = parse_limits(os.getenv("EXECUTION_MODEL_RATE_LIMITS", ""))
+RATE_LIMIT_BURST = float(os.getenv("EXECUTION_RATE_LIMIT_BURST", "1"))
+
+
+class MeteredRateLimiter(InMemoryRateLimiter):
+    """InMemoryRateLimiter that adds the time callers spend blocked to a counter of the service."""
+
+    def __init__(self, *, key: str, on_wait: Callable[[str, float], None], **kwargs: Any):
+        super().__init__(**kwargs)
+        self.key = key
+        self.on_wait = on_wait
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        start = time.perf_counter()
+        acquired = super().acquire(blocking=blocking)
+        self.on_wait(self.key, time.perf_counter() - start)
+        return acquired
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        start = time.perf_counter()
+        acquired = await super().aacquire(blocking=blocking)
+        self.on_wait(self.key, time.perf_counter() - start)
+        return acquired
+
+
+class ExecutionService:
+    """
+    Bounded thread pool shared by all plans, with per-tool and per-model rate limits.
+
+    Tasks submitted from a worker go to the pool of the worker while it has a free
+    slot, else to the pool of the next nesting level. A nested task never queues
+    behind the workers waiting on it, so every level keeps making progress.
+
+    Args:
+        max_workers (int): Threads of the pool
+        nested_workers (int): Threads of the pool of each nesting level, created on first use
+        tool_rate_limits (dict): Tool name -> calls per second
+        model_rate_limits (dict): Model name -> requests per second
+        burst (float): Calls a bucket can hold, i.e. how many can go out back to back
+    """
+
+    def __init__(
+        self,
+        max_workers: int = EXECUTION_MAX_WORKERS,
+        nested_workers: int = EXECUTION_NESTED_WORKERS,
+        tool_rate_limits: Optional[Dict[str, float]] = None,
+        model_rate_limits: Optional[Dict[str, float]] = None,
+        burst: float = RATE_LIMIT_BURST,
+    ):
+        self.max_workers = max_workers
+        self.nested_workers = nested_workers
+        self.burst = burst
+        # Pool of each nesting level, the first one is the main pool
+        self._executors = [ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="execution-service")]
+        self._workers = threading.local()
+        self._lock = threading.Lock()
+        self._queued: Dict[int, int] = defaultdict(int)
+        self._active: Dict[int, int] = defaultdict(int)
+        self._submitted = 0
+        self._completed = 0
+        self._nested_submits = 0
+        self._rate_limit_waits: Dict[str, float] = defaultdict(float)
+        self._limiters: Dict[str, MeteredRateLimiter] = {}
+        for name, rate in (tool_rate_limits if tool_rate_limits is not None else TOOL_RATE_LIMITS).items():
+            self._limiters[f"tool:{name}"] = self._make_limiter(f"tool:{name}", rate)
+        for name, rate in (model_rate_limits if model_rate_limits is not None else MODEL_RATE_LIMITS).items():
+            self._limiters[f"model:{name}"] = self._make_limiter(f"model:{name}", rate)
+
+    def _make_limiter(self, key: str, rate: float) -> MeteredRateLimiter:
+        return MeteredRateLimiter(
+            key=key, on_wait=self._record_wait, requests_per_second=rate,
+            check_every_n_seconds=min(0.1, 1 / rate / 4), max_bucket_size=self.burst,
+        )
+
+    def _record_wait(self, key: str, seconds: float) -> None:
+        with self._lock:
+            self._rate_limit_waits[key] += seconds
+
+    def submit(self, fn: Callable, *args: Any, **kwargs: Any) -> Future:
+        """
+        Run `fn` on the pool, in a copy of the caller's context.
+
+        Called from a worker while every worker of its pool is taken, `fn` is queued
+        on the pool of the next nesting level instead.
+        """
+        context = contextvars.copy_context()
+        with self._lock:
+            level = getattr(self._workers, "level", None)
+            if level is None:
+                level = 0
+            elif self._active[level] + self._queued[level] >= self._capacity(level):
+                level += 1
+                self._nested_submits += 1
+            if level == len(self._executors):
+                self._executors.append(ThreadPoolExecutor(
+                    max_workers=self.nested_workers, thread_name_prefix=f"execution-service-nested-{level}"
+                ))
+            self._queued[level] += 1
+            self._submitted += 1
+            executor = self._executors[level]
+        return executor.submit(self._run, level, context, fn, args, kwargs)
+
+    def _capacity(self, level: int) -> int:
+        return self.max_workers if level == 0 else self.nested_workers
+
+    def _run(self, level: int, context: contextvars.Context, fn: Callable, args: tuple, kwargs: dict) -> Any:
+        with self._lock:
+            self._queued[level] -= 1
+            self._active[level] += 1
+        self._workers.level = level
+        try:
+            return context.run(fn, *args, **kwargs)
+        finally:
+            with self._lock:
+                self._active[level] -= 1
+                self._completed += 1
+
+    def acquire_tool(self, name: str) -> None:
+        """Block until the rate limit of the tool, if any, lets a call through."""
+        limiter = self._limiters.get(f"tool:{name}")
+        if limiter is not None:
+            limiter.acquire()
+
+    async def aacquire_tool(self, name: str) -> None:
+        limiter = self._limiters.get(f"tool:{name}")
+        if limiter is not None:
+            await limiter.aacquire()
+
+    def rate_limit_model(self, llm: BaseChatModel) -> BaseChatModel:
+        """
+        The model with the rate limiter of its model name, if one is configured.
+
+        Models that already have a rate limiter are returned as they are.
+        """
+        name = getattr(llm, "model_name", None) or getattr(llm, "model", None)
+        limiter = self._limiters.get(f"model:{name}")
+        if limiter is None or getattr(llm, "rate_limiter", None) is not None:
+            return llm
+        return llm.model_copy(update={"rate_limiter": limiter})
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "active_workers": self._active[0],
+                "queue_depth": self._queued[0],
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "nested_submits": self._nested_submits,
+                "nested_levels": {
+                    level: {"active_workers": self._active[level], "queue_depth": self._queued[level]}
+                    for level in range(1, len(self._executors))
+                },
+                "rate_limit_wait_s": dict(self._rate_limit_waits),
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            executors = list(self._executors)
+        for executor in executors:
+            executor.shutdown(wait=wait)
+
+
+_service: Optional[ExecutionService] = None
+_service_lock = threading.Lock()
+
+
+def get_execution_service() -> ExecutionService:
+    """The process-wide service, created from the environment on first use."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = ExecutionService()
+    return _service
+
+
+def configure_execution_service(**kwargs: Any) -> ExecutionService:
+    """Replace the process-wide service, taking the arguments of ExecutionService."""
+    global _service
+    with _service_lock:
+        previous, _service = _service, ExecutionService(**kwargs)
+    if previous is not None:
+        previous.shutdown(wait=False)
+    return _service
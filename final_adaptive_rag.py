@@ -44,6 +44,10 @@ from dotenv import load_dotenv#type: ignore
 from langchain.tools import StructuredTool
 from llama_index.retrievers.pathway import PathwayRetriever
 from langchain_community.vectorstores import PathwayVectorClient
+from rag.chunk_store import chunk_store
+from rag.compression import compress_context
+from rag.selection import CANDIDATE_K, adaptive_top_k, mmr_select, term_vectors
+from rag.transport import attach_transport
 
 # Load environment variables
 load_dotenv()
@@ -53,9 +57,9 @@ os.environ['OPENAI_API_KEY'] = os.getenv("OPENAI_API_KEY", "YOUR_OPENAI_API_KEY"
 
 # Initialize Pathway Vector Database Client
 # This connects to a specialized vector database for financial documents
-client = PathwayVectorClient(
-    url=os.getenv("PATHWAY_URL", "http://172.30.2.194:8767"),
-)
+# Both clients share one pooled, circuit-broken transport to the vector server
+PATHWAY_URL = os.getenv("PATHWAY_URL", "http://172.30.2.194:8767")
+client = attach_transport(PathwayVectorClient(url=PATHWAY_URL), PATHWAY_URL)
 
 
 llm = ChatOpenAI(model_name="gpt-4o-mini", temperature=0)
@@ -64,7 +68,8 @@ load_dotenv()
 embd = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
 
 # retriever = vectorstore.as_retriever()
-retriever = PathwayRetriever(url="http://172.30.2.194:8767", similarity_top_k=10)
+# A generous candidate set is fetched, retrieve() keeps an adaptive top-k of it
+retriever = attach_transport(PathwayRetriever(url=PATHWAY_URL, similarity_top_k=CANDIDATE_K), PATHWAY_URL)
 
 # query =  """Markdown Table business segment with least growth contribution"""
 query = "Markdown Table If we exclude the impact of M&A, which segment has dragged down 3M's overall growth in 2022?"
@@ -233,7 +238,7 @@ class GraphState(TypedDict):
     Attributes:
         question: question
         generation: LLM generation
-        documents: list of documents
+        documents: list of chunk IDs, the text lives in the chunk store
         count: Number of times retriever is called
     """
 
@@ -259,11 +264,16 @@ def retrieve(state):
     
     # Retrieval
     documents = retriever.retrieve(question)
-    for doc in documents:
-        print(doc.to_dict()['node']['class_name'])
+    k = adaptive_top_k([doc.score for doc in documents])
+    keys = [chunk_store.put(doc.text, doc.metadata) for doc in documents]
+    # Pick the k chunks with maximal marginal relevance to skip near-duplicates
+    selected = mmr_select([doc.score for doc in documents], term_vectors([doc.text for doc in documents]), k)
+    print(f"---KEEPING {len(selected)} OF {len(documents)} DOCUMENTS---")
+    for i in selected:
+        print(documents[i].to_dict()['node']['class_name'])
         print('==================================')
-    documents = [doc.text for doc in documents]
-    return {"documents": documents, "question": question, "count":count}
+    documents = [keys[i] for i in selected]
+    return {"documents": documents, "count":count}
 
 def generate(state):
     """
@@ -277,11 +287,11 @@ def generate(state):
     """
     print("---GENERATE---")
     question = state["question"]
-    documents = state["documents"]
+    documents = chunk_store.materialize(state["documents"])
 
     # RAG generation
     generation = rag_chain.invoke({"context": documents, "question": question})
-    return {"documents": documents, "question": question, "generation": generation}
+    return {"generation": generation}
 
 def grade_documents(state):
     """
@@ -307,7 +317,7 @@ def grade_documents(state):
         print(d)
         print('---------------------------')
         score = retrieval_grader.invoke(
-            {"question": question, "document": d}
+            {"question": question, "document": chunk_store.get(d)}
         )
         grade = score.binary_score
         if grade == "yes":
@@ -316,7 +326,7 @@ def grade_documents(state):
         else:
             print("---GRADE: DOCUMENT NOT RELEVANT---")
             continue
-    return {"documents": filtered_docs, "question": question}
+    return {"documents": filtered_docs}
 
 def transform_query(state):
     """
@@ -331,13 +341,12 @@ def transform_query(state):
 
     print("---TRANSFORM QUERY---")
     question = state["question"]
-    documents = state["documents"]
 
     # Re-write question
     better_question = question_rewriter.invoke({"question": question})
     print("better_question: ", better_question)
     print("#####################################")
-    return {"documents": documents, "question": better_question}
+    return {"question": better_question}
 
 def web_search(state):
     """
@@ -356,9 +365,8 @@ def web_search(state):
     # Web search
     docs = web_search_tool.invoke({"query": question})
     web_results = "\n".join([d["content"] for d in docs])
-    web_results = Document(page_content=web_results)
 
-    return {"documents": web_results, "question": question}
+    return {"documents": [chunk_store.put(web_results, {"source": "web_search"})]}
 
 
 class RewrittenQueries(BaseModel):
@@ -520,7 +528,7 @@ def grade_generation_v_documents_and_question(state):
 
     print("---CHECK HALLUCINATIONS---")
     question = state["question"]
-    documents = state["documents"]
+    documents = chunk_store.materialize(state["documents"])
     generation = state["generation"]
 
     score = hallucination_grader.invoke(
@@ -554,6 +562,7 @@ workflow.add_node("web_search", web_search)  # web search
 workflow.add_node("retrieve", retrieve)  # retrieve
 workflow.add_node("grade_documents", grade_documents)  # grade documents
 workflow.add_node("generate", generate)  # generatae
+workflow.add_node("compress_context", compress_context)  # compress_context
 workflow.add_node("transform_query", transform_query)  # transform_query
 
 # Build graph
@@ -572,9 +581,10 @@ workflow.add_conditional_edges(
     decide_to_generate,
     {
         "transform_query": "transform_query",
-        "generate": "generate",
+        "generate": "compress_context",
     },
 )
+workflow.add_edge("compress_context", "generate")
 
 
 # new =================================================
@@ -617,7 +627,9 @@ def data_node_function(query: str) -> str:
         "documents": [],  # Add this line to initialize documents
         "generation": ""  # Add this line to initialize generation
     }
-    results =  app.invoke(inputs)
+    # The chunk IDs in the graph state stay valid for the whole run
+    with chunk_store.session():
+        results =  app.invoke(inputs)
     return results['generation']
     # for output in app.stream(inputs):
     #     for key, value in output.items():
@@ -0,0 +1,140 @@
+"""
+Compaction of tool observations in the prompts of the joiner and the replanner.
+
+The joiner gets every FunctionMessage since the last HumanMessage and the
+replanner the whole history, whatever their size, so one report or RAG
+observation of thousands of tokens is paid for again at every replan. Before
+those prompts are built, observations are compacted:
+
+- each one is cut to `max_observation_tokens`, keeping its head and tail
+- if the observations together still exceed `max_history_tokens`, the oldest
+  ones are cut further, down to `min_observation_tokens`
+
+Only the copies sent to the LLM are compacted: the graph state keeps the full
+messages, and native outputs stay in the observation store, under the
+message's obs_key. Tokens are counted with tiktoken when its encoding is
+available, else estimated at 4 characters per token.
+"""
+
+import os
+from typing import Any, List, Optional, Sequence
+
+from langchain_core.messages import BaseMessage, FunctionMessage
+
+from observation_store import observation_store
+
+COMPACTION_OBSERVATION_TOKENS = int(os.getenv("COMPACTION_OBSERVATION_TOKENS", "1000"))
+COMPACTION_HISTORY_TOKENS = int(os.getenv("COMPACTION_HISTORY_TOKENS", "6000"))
+COMPACTION_MIN_TOKENS = int(os.getenv("COMPACTION_MIN_TOKENS", "64"))
+COMPACTION_ENCODING = os.getenv("COMPACTION_ENCODING", "o200k_base")
+
+CHARS_PER_TOKEN = 4
+
+_encoding: Any = None
+
+
+def _get_encoding() -> Any:
+    """tiktoken encoding, False when it cannot be loaded (e.g. offline without a cache)."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding(COMPACTION_ENCODING)
+        except Exception:
+            _encoding = False
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _cut(text: str, start: int, end: Optional[int] = None) -> str:
+    """Text of the tokens [start:end]."""
+    encoding = _get_encoding()
+    if encoding:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[start:end])
+    return text[start * CHARS_PER_TOKEN:None if end is None else end * CHARS_PER_TOKEN]
+
+
+def _describe(value: Any) -> str:
+    """Short description of a native output, e.g. 'list of 2500 items'."""
+    if isinstance(value, (list, tuple, set, dict)):
+        return f"{type(value).__name__} of {len(value)} items"
+    shape = getattr(value, "shape", None)
+    if shape is not None:
+        return f"{type(value).__name__} of shape {tuple(shape)}"
+    return type(value).__name__
+
+
+def truncate(text: str, max_tokens: int, note: str = "") -> str:
+    """
+    Text cut to about `max_tokens` tokens, keeping its head and its tail.
+
+    Args:
+        text (str): Text to cut
+        max_tokens (int): Tokens to keep
+        note (str): Extra information for the marker of the cut, e.g. the type of the output
+
+    Returns:
+        str: The text itself when short enough, else head + marker + tail
+    """
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    head = max(1, max_tokens * 3 // 4)
+    tail = max(1, max_tokens - head)
+    marker = f"\n... [{tokens - head - tail} of {tokens} tokens omitted{note}] ...\n"
+    return _cut(text, 0, head) + marker + _cut(text, -tail)
+
+
+def _compact(message: FunctionMessage, max_tokens: int) -> FunctionMessage:
+    text = str(message.content)
+    obs_key = message.additional_kwargs.get("obs_key")
+    note = ""
+    if obs_key and obs_key in observation_store:
+        note = f", full output is a {_describe(observation_store.get(obs_key))}"
+    compacted = truncate(text, max_tokens, note)
+    if compacted is text:
+        return message
+    return message.model_copy(update={"content": compacted})
+
+
+def compact_messages(
+    messages: Sequence[BaseMessage],
+    max_observation_tokens: int = COMPACTION_OBSERVATION_TOKENS,
+    max_history_tokens: int = COMPACTION_HISTORY_TOKENS,
+    min_observation_tokens: int = COMPACTION_MIN_TOKENS,
+) -> List[BaseMessage]:
+    """
+    Messages with their FunctionMessage observations cut to fit the budgets.
+
+    Args:
+        messages (Sequence[BaseMessage]): Messages of a prompt, oldest first
+        max_observation_tokens (int): Tokens of a single observation
+        max_history_tokens (int): Tokens of all observations together, the oldest are cut first
+        min_observation_tokens (int): Tokens an observation is never cut below
+
+    Returns:
+        List[BaseMessage]: New list, with compacted copies of the observations that were cut
+    """
+    compacted = [
+        _compact(message, max_observation_tokens) if isinstance(message, FunctionMessage) else message
+        for message in messages
+    ]
+    observations = [i for i, message in enumerate(compacted) if isinstance(message, FunctionMessage)]
+    sizes = {i: count_tokens(str(compacted[i].content)) for i in observations}
+    excess = sum(sizes.values()) - max_history_tokens
+    for i in observations:
+        if excess <= 0:
+            break
+        if sizes[i] <= min_observation_tokens:
+            continue
+        compacted[i] = _compact(messages[i], max(min_observation_tokens, sizes[i] - excess))
+        excess -= sizes[i] - count_tokens(str(compacted[i].content))
+    return compacted
+
@@ -43,7 +43,7 @@ from langchain_core.messages import (
     AIMessage,
 )
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnableBranch, as_runnable
+from langchain_core.runnables import RunnableBranch, RunnableLambda
 from langchain_core.tools import BaseTool
 
 # External services and tools
@@ -60,6 +60,11 @@ from langgraph.checkpoint.memory import MemorySaver
 from math_tools import get_math_tool
 from financial_markets import *
 from output_parser import LLMCompilerPlanParser, Task
+from execution_service import ExecutionService, get_execution_service, parse_limits
+from tool_cache import get_tool_cache
+from observation_store import observation_store
+from message_compaction import compact_messages
+import tracing
 
 # Pydantic models for structured data
 from pydantic import BaseModel, Field
@@ -123,7 +128,7 @@ def create_planner(
         return isinstance(state[-1], SystemMessage)
 
     def wrap_messages(state: list):
-        return {"messages": state}
+        return {"messages": compact_messages(state)}
 
     def wrap_and_get_last_index(state: list):
         next_task = 0
@@ -132,7 +137,7 @@ def create_planner(
                 next_task = message.additional_kwargs["idx"] + 1
                 break
         state[-1].content = state[-1].content + f" - Begin counting at : {next_task}"
-        return {"messages": state}
+        return {"messages": compact_messages(state)}
 
     return (
         RunnableBranch(
@@ -143,38 +148,240 @@ def create_planner(
         | LLMCompilerPlanParser(tools=tools)
     )
 
-llm = ChatOpenAI(model="gpt-4o-mini")
-tools=[]
-# This is the primary "agent" in our application
-prompt = hub.pull("wfh/llm-compiler")
-planner = create_planner(llm, tools, prompt)
-
+import asyncio
+import contextlib
 import re
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, wait
-from typing import Any, Dict, Iterable, List, Union
+import weakref
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Union
 
 from langchain_core.runnables import (
     chain as as_runnable,
 )
+from langchain_core.runnables.config import patch_config
 from typing_extensions import TypedDict
 
 
 def _get_observations(messages: List[BaseMessage]) -> Dict[int, Any]:
-    # Get all previous tool responses
+    # Get all previous tool responses, as the tools returned them when still in the store
     results = {}
     for message in messages[::-1]:
         if isinstance(message, FunctionMessage):
-            results[int(message.additional_kwargs["idx"])] = message.content
+            obs_key = message.additional_kwargs.get("obs_key")
+            results[int(message.additional_kwargs["idx"])] = (
+                observation_store.get(obs_key, message.content) if obs_key else message.content
+            )
     return results
 
 
-class SchedulerInput(TypedDict):
+# Tool calls of a plan running at the same time, unless the plan sets max_parallelism
+MAX_PARALLELISM = int(os.getenv("SCHEDULER_MAX_PARALLELISM", "8"))
+
+
+# Seconds a tool call may take before its task fails, per tool and for the others (0: no limit)
+TOOL_TIMEOUTS = parse_limits(os.getenv("SCHEDULER_TOOL_TIMEOUTS", ""))
+TOOL_TIMEOUT = float(os.getenv("SCHEDULER_TOOL_TIMEOUT", "0")) or None
+# Failed tool calls after which the rest of the plan is cancelled (0: never)
+MAX_FAILURES = int(os.getenv("SCHEDULER_MAX_FAILURES", "3"))
+# Seconds between checks of a cancel_event given by the caller
+CANCEL_CHECK_INTERVAL = 0.1
+
+
+class SchedulerInput(TypedDict, total=False):
     messages: List[BaseMessage]
     tasks: Iterable[Task]
+    max_parallelism: int
+    # Defaults to the process-wide service
+    execution_service: ExecutionService
+    tool_timeouts: Dict[str, float]
+    max_failures: int
+    # Set to cancel the plan, also read from config["configurable"]["cancel_event"]
+    cancel_event: threading.Event
+    # Async scheduler only
+    tool_limits: Dict[str, int]
+
+
+class ToolLatencies:
+    """Exponentially weighted moving averages of tool latencies, shared by all plans."""
+
+    def __init__(self, alpha: float = 0.2, default: float = 1.0):
+        self.alpha = alpha
+        self.default = default
+        self._estimates: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            previous = self._estimates.get(name)
+            self._estimates[name] = seconds if previous is None else previous + self.alpha * (seconds - previous)
+
+    def estimate(self, name: str) -> float:
+        """Estimate of a tool, the mean of all tools for one never seen, or the default."""
+        if name == "join":
+            return 0.0
+        with self._lock:
+            if name in self._estimates:
+                return self._estimates[name]
+            return sum(self._estimates.values()) / len(self._estimates) if self._estimates else self.default
+
+
+tool_latencies = ToolLatencies(default=float(os.getenv("SCHEDULER_DEFAULT_TOOL_LATENCY", "1.0")))
+
+
+class _PlanGraph:
+    """Tasks of a plan seen so far, to rank ready tasks by their longest downstream path."""
+
+    def __init__(self):
+        self.tools: Dict[int, str] = {}
+        self.children: Dict[int, List[int]] = defaultdict(list)
+
+    def add(self, task: Task):
+        self.tools[task["idx"]] = task["tool"] if isinstance(task["tool"], str) else task["tool"].name
+        for dep in task["dependencies"]:
+            self.children[dep].append(task["idx"])
+
+    def critical_path(self, idx: int, memo: Dict[int, float]) -> float:
+        """Estimated seconds from the start of the task to the end of its longest chain of dependents."""
+        if idx not in memo:
+            memo[idx] = 0.0  # Guards against cycles
+            memo[idx] = tool_latencies.estimate(self.tools.get(idx, "")) + max(
+                (self.critical_path(child, memo) for child in self.children.get(idx, [])), default=0.0
+            )
+        return memo[idx]
 
+    def pick(self, ready: List[Task]) -> Task:
+        """Remove and return the ready task heading the longest path, the earliest one on ties."""
+        memo: Dict[int, float] = {}
+        best = max(ready, key=lambda task: (self.critical_path(task["idx"], memo), -task["idx"]))
+        ready.remove(best)
+        return best
 
-def _execute_task(task, observations, config):
+
+def _is_failure(observation: Any) -> bool:
+    return isinstance(observation, str) and observation.startswith(("ERROR(", "Traceback"))
+
+
+def _tool_timeout(task: Task, tool_timeouts: Dict[str, float]) -> Optional[float]:
+    if isinstance(task["tool"], str):
+        return None
+    return tool_timeouts.get(task["tool"].name, TOOL_TIMEOUT)
+
+
+class _PlanState:
+    """
+    Dependency bookkeeping of a plan, shared by both schedulers (not thread safe).
+
+    A task waits until its last dependency completes. When a task fails, the tasks
+    depending on it are skipped, except join, for which a failed dependency is done.
+    """
+
+    def __init__(self, observations: Dict[int, Any], max_failures: int = MAX_FAILURES):
+        self.observations = observations
+        self.completed = set(observations)
+        self.failed = set()
+        # Failed tool calls, skipped and cancelled tasks aside
+        self.failures = 0
+        self.max_failures = max_failures
+        # Tasks waiting on dependencies, the number of dependencies they still miss,
+        # and the waiting tasks of each dependency
+        self.waiting: Dict[int, Task] = {}
+        self.missing: Dict[int, int] = {}
+        self.dependents: Dict[int, List[int]] = defaultdict(list)
+        self.graph = _PlanGraph()
+        self.task_names: Dict[int, str] = {}
+        self.args_for_tasks: Dict[int, Any] = {}
+
+    @property
+    def aborted(self) -> bool:
+        return bool(self.max_failures) and self.failures >= self.max_failures
+
+    def is_settled(self, idx: int) -> bool:
+        return idx in self.completed or idx in self.failed
+
+    def add(self, task: Task) -> bool:
+        """Register a streamed task, returning whether it can run now."""
+        idx = task["idx"]
+        self.task_names[idx] = task["tool"] if isinstance(task["tool"], str) else task["tool"].name
+        self.args_for_tasks[idx] = task["args"]
+        self.graph.add(task)
+        failed = [dep for dep in task["dependencies"] if dep in self.failed]
+        if failed and task["tool"] != "join":
+            self._skip(idx, failed[0])
+            return False
+        pending = {dep for dep in task["dependencies"] if not self.is_settled(dep)}
+        if not pending:
+            return True
+        self.waiting[idx] = task
+        self.missing[idx] = len(pending)
+        for dep in pending:
+            self.dependents[dep].append(idx)
+        return False
+
+    def settle(self, idx: int, observation: Any, ran: bool = True) -> List[Task]:
+        """
+        Record the observation of a task, returning the tasks that can now run.
+
+        Observations of settled tasks (a late result after a timeout or a cancellation) are dropped.
+        """
+        if self.is_settled(idx):
+            return []
+        self.observations[idx] = observation
+        if _is_failure(observation):
+            self.failed.add(idx)
+            self.failures += ran
+        else:
+            self.completed.add(idx)
+        ready = []
+        parents = [idx]
+        while parents:
+            parent = parents.pop()
+            for dependent in self.dependents.pop(parent, []):
+                if dependent not in self.waiting:
+                    continue
+                if parent in self.failed and self.task_names[dependent] != "join":
+                    del self.waiting[dependent], self.missing[dependent]
+                    self._skip(dependent, parent)
+                    parents.append(dependent)
+                    continue
+                self.missing[dependent] -= 1
+                if not self.missing[dependent]:
+                    del self.missing[dependent]
+                    ready.append(self.waiting.pop(dependent))
+        return ready
+
+    def _skip(self, idx: int, failed_dependency: int):
+        self.observations[idx] = f"ERROR(Skipped: depends on task {failed_dependency}, which failed.)"
+        self.failed.add(idx)
+
+    def stuck(self) -> List[Task]:
+        """Remove and return the waiting tasks, once the tasks they wait on can no longer run."""
+        stuck = [self.waiting.pop(idx) for idx in sorted(self.waiting)]
+        self.missing.clear()
+        self.dependents.clear()
+        return stuck
+
+    def cancel(self, reason: str):
+        """Settle every task not settled yet as cancelled."""
+        for idx in sorted(self.task_names):
+            if not self.is_settled(idx):
+                self.observations[idx] = f"ERROR(Cancelled: {reason}.)"
+                self.failed.add(idx)
+        self.waiting.clear()
+        self.missing.clear()
+        self.dependents.clear()
+
+    def cancel_reason(self) -> str:
+        if self.aborted:
+            return f"the plan was aborted after {self.failures} failed tool calls"
+        return "the plan was cancelled"
+
+    def to_messages(self, originals) -> List[FunctionMessage]:
+        return _to_function_messages(self.observations, originals, self.task_names, self.args_for_tasks)
+
+
+def _execute_task(task, observations, config, execution_service=None):
     tool_to_use = task["tool"]
     if isinstance(tool_to_use, str):
         return tool_to_use
@@ -194,8 +401,18 @@ def _execute_task(task, observations, config):
             f"ERROR(Failed to call {tool_to_use.name} with args {args}.)"
             f" Args could not be resolved. Error: {repr(e)}"
         )
+
+    def run():
+        (execution_service or get_execution_service()).acquire_tool(tool_to_use.name)
+        start = time.perf_counter()
+        try:
+            return tool_to_use.invoke(resolved_args, config)
+        finally:
+            tool_latencies.record(tool_to_use.name, time.perf_counter() - start)
+
     try:
-        return tool_to_use.invoke(resolved_args, config)
+        # Tools opted in to caching share results of identical calls
+        return get_tool_cache().call(tool_to_use, resolved_args, run)
     except Exception as e:
         return (
             f"ERROR(Failed to call {tool_to_use.name} with args {args}."
@@ -207,6 +424,11 @@ def _resolve_arg(arg: Union[str, Any], observations: Dict[int, Any]):
     # $1 or ${1} -> 1
     ID_PATTERN = r"\$\{?(\d+)\}?"
 
+    # An argument that is only a reference gets the output itself, not its string
+    if isinstance(arg, str) and (match := re.fullmatch(ID_PATTERN, arg.strip())):
+        if int(match.group(1)) in observations:
+            return observations[int(match.group(1))]
+
     def replace_match(match):
         # If the string is ${123}, match.group(0) is ${123}, and match.group(1) is 123.
 
@@ -229,101 +451,434 @@ def schedule_task(task_inputs, config):
     task: Task = task_inputs["task"]
     observations: Dict[int, Any] = task_inputs["observations"]
     try:
-        observation = _execute_task(task, observations, config)
+        observation = _execute_task(task, observations, config, task_inputs.get("execution_service"))
     except Exception:
         import traceback
 
-        observation = traceback.format_exception()  # repr(e) +
+        observation = traceback.format_exc()  # repr(e) +
     observations[task["idx"]] = observation
-
-
-def schedule_pending_task(
-    task: Task, observations: Dict[int, Any], retry_after: float = 0.2
-):
-    while True:
-        deps = task["dependencies"]
-        if deps and (any([dep not in observations for dep in deps])):
-            # Dependencies not yet satisfied
-            time.sleep(retry_after)
-            continue
-        schedule_task.invoke({"task": task, "observations": observations})
-        break
+    return observation
 
 
 @as_runnable
-def schedule_tasks(scheduler_input: SchedulerInput) -> List[FunctionMessage]:
+def schedule_tasks(scheduler_input: SchedulerInput, config) -> List[FunctionMessage]:
     """Group the tasks into a DAG schedule."""
-    # For streaming, we are making a few simplifying assumption:
-    # 1. The LLM does not create cyclic dependencies
-    # 2. That the LLM will not generate tasks with future deps
-    # If this ceases to be a good assumption, you can either
-    # adjust to do a proper topological sort (not-stream)
-    # or use a more complicated data structure
+    # Tasks are dispatched as soon as their last dependency completes (see
+    # _PlanState). A task may depend on one streamed after it. Tasks whose
+    # dependencies never run (an index missing from the plan, or a cycle) are run
+    # once the plan is exhausted, with those references left unresolved.
+    # Ready tasks run concurrently on the process-wide execution service, at most
+    # max_parallelism of them at a time, the others queue in `ready`. A freed slot
+    # goes to the ready task with the longest estimated chain of dependents.
+    # A task whose tool outlives its timeout fails, its thread is abandoned and
+    # its result dropped. After max_failures failed tool calls, or when the
+    # cancel event is set, the planner is no longer read and every task not done
+    # yet is cancelled. Tools can watch the event in config["configurable"].
     tasks = scheduler_input["tasks"]
-    args_for_tasks = {}
     messages = scheduler_input["messages"]
     # If we are re-planning, we may have calls that depend on previous
     # plans. Start with those.
     observations = _get_observations(messages)
-    task_names = {}
     originals = set(observations)
-    # ^^ We assume each task inserts a different key above to
-    # avoid race conditions...
-    futures = []
-    retry_after = 0.25  # Retry every quarter second
-    with ThreadPoolExecutor() as executor:
-        for task in tasks:
-            deps = task["dependencies"]
-            task_names[task["idx"]] = (
-                task["tool"] if isinstance(task["tool"], str) else task["tool"].name
+    max_parallelism = scheduler_input.get("max_parallelism") or MAX_PARALLELISM
+    service = scheduler_input.get("execution_service") or get_execution_service()
+    tool_timeouts = scheduler_input.get("tool_timeouts") or TOOL_TIMEOUTS
+    cancel = scheduler_input.get("cancel_event") or config.get("configurable", {}).get("cancel_event")
+    # An event set by the caller cannot wake the scheduler up, so it is checked periodically
+    check_interval = CANCEL_CHECK_INTERVAL if cancel is not None else None
+    cancel = cancel or threading.Event()
+    task_config = patch_config(config, configurable={**config.get("configurable", {}), "cancel_event": cancel})
+    plan = _PlanState(observations, scheduler_input.get("max_failures", MAX_FAILURES))
+    lock = threading.Condition()
+    ready: List[Task] = []
+    running = set()
+    # Running task -> (deadline, timeout)
+    deadlines: Dict[int, tuple] = {}
+    # Ready task -> when it became ready, for the queue wait of its trace
+    ready_at: Dict[int, float] = {}
+
+    def start_ready():
+        starting = []
+        with lock:
+            now = time.perf_counter()
+            for task in ready:
+                ready_at.setdefault(task["idx"], now)
+            while ready and len(running) < max_parallelism and not cancel.is_set():
+                task = plan.graph.pick(ready)
+                running.add(task["idx"])
+                # The dependencies of the task are all in the copy
+                starting.append((task, dict(observations), ready_at.pop(task["idx"])))
+        for task, snapshot, became_ready in starting:
+            service.submit(run, task, snapshot, became_ready)
+
+    def settle(idx: int, observation: Any):
+        with lock:
+            running.discard(idx)
+            deadlines.pop(idx, None)
+            ready.extend(plan.settle(idx, observation))
+            if plan.aborted:
+                cancel.set()
+            lock.notify_all()
+        start_ready()
+
+    def run(task: Task, snapshot: Dict[int, Any], became_ready: float):
+        idx = task["idx"]
+        tracing.add_span(f"queue {plan.task_names[idx]}", became_ready, time.perf_counter(), "queue", idx=idx)
+        with lock:
+            if plan.is_settled(idx):
+                # Cancelled while queued on the execution service
+                return
+            timeout = _tool_timeout(task, tool_timeouts)
+            if timeout:
+                deadlines[idx] = (time.perf_counter() + timeout, timeout)
+                lock.notify_all()
+        # Written to the copy, so a late result cannot replace the error of a timeout
+        with tracing.span(plan.task_names[idx], "task", idx=idx) as span_args:
+            observation = schedule_task.invoke(
+                {"task": task, "observations": snapshot, "execution_service": service}, task_config
             )
-            args_for_tasks[task["idx"]] = task["args"]
-            if (
-                # Depends on other tasks
-                deps and (any([dep not in observations for dep in deps]))
-            ):
-                futures.append(
-                    executor.submit(
-                        schedule_pending_task, task, observations, retry_after
-                    )
-                )
-            else:
+            span_args["failed"] = _is_failure(observation)
+        settle(idx, observation)
+
+    def expire():
+        now = time.perf_counter()
+        with lock:
+            expired = [(idx, timeout) for idx, (deadline, timeout) in deadlines.items() if deadline <= now]
+        for idx, timeout in expired:
+            settle(idx, f"ERROR(Task {idx} ({plan.task_names[idx]}) timed out after {timeout:g}s.)")
+
+    def wait_timeout() -> Optional[float]:
+        timeout = check_interval
+        if deadlines:
+            until_deadline = max(0.0, min(deadline for deadline, _ in deadlines.values()) - time.perf_counter())
+            timeout = until_deadline if timeout is None else min(timeout, until_deadline)
+        return timeout
+
+    for task in tasks:
+        expire()
+        with lock:
+            if cancel.is_set():
+                break
+            if plan.add(task):
                 # No deps or all deps satisfied
                 # can schedule now
-                schedule_task.invoke(dict(task=task, observations=observations))
-                # futures.append(executor.submit(schedule_task.invoke dict(task=task, observations=observations)))
-
-        # All tasks have been submitted or enqueued
-        # Wait for them to complete
-        wait(futures)
+                ready.append(task)
+        start_ready()
+    if cancel.is_set() and hasattr(tasks, "close"):
+        # Stops the planner LLM
+        tasks.close()
+
+    # All tasks have been submitted or are waiting on dependencies
+    # Wait for them to complete
+    while True:
+        expire()
+        with lock:
+            if cancel.is_set() or not (running or ready or plan.waiting):
+                break
+            if running or ready:
+                lock.wait(wait_timeout())
+                continue
+            # Whatever still waits depends on tasks that will never run
+            ready.extend(plan.stuck())
+        start_ready()
+    with lock:
+        if cancel.is_set():
+            ready.clear()
+            running.clear()
+            deadlines.clear()
+            plan.cancel(plan.cancel_reason())
+        return plan.to_messages(originals)
+
+def _to_function_messages(observations, originals, task_names, args_for_tasks) -> List[FunctionMessage]:
     # Convert observations to new tool messages to add to the state
     new_observations = {
         k: (task_names[k], args_for_tasks[k], observations[k])
         for k in sorted(observations.keys() - originals)
     }
+    # Outputs other than strings are kept native in the observation store for later plans
     tool_messages = [
         FunctionMessage(
             name=name,
             content=str(obs),
-            additional_kwargs={"idx": k, "args": task_args},
+            additional_kwargs={"idx": k, "args": task_args}
+            | ({} if isinstance(obs, str) else {"obs_key": observation_store.put(obs)}),
             tool_call_id=k,
         )
         for k, (name, task_args, obs) in new_observations.items()
     ]
     return tool_messages
 
+
+# Tool calls of a tool running at the same time across all plans of the process,
+# for the async scheduler. Tools not listed are only bound by max_parallelism.
+TOOL_CONCURRENCY = parse_limits(os.getenv("SCHEDULER_TOOL_CONCURRENCY", ""), int)
+
+# Semaphores of the limited tools, per event loop as asyncio primitives cannot be shared across loops
+_tool_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Any, asyncio.Semaphore]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _tool_semaphore(name: str, tool_limits: Dict[str, int]):
+    limit = tool_limits.get(name)
+    if not limit:
+        return contextlib.nullcontext()
+    semaphores = _tool_semaphores.setdefault(asyncio.get_running_loop(), {})
+    if (name, limit) not in semaphores:
+        semaphores[(name, limit)] = asyncio.Semaphore(limit)
+    return semaphores[(name, limit)]
+
+
+async def _aexecute_task(task, observations, config, execution_service=None):
+    tool_to_use = task["tool"]
+    if isinstance(tool_to_use, str):
+        return tool_to_use
+    args = task["args"]
+    try:
+        if isinstance(args, str):
+            resolved_args = _resolve_arg(args, observations)
+        elif isinstance(args, dict):
+            resolved_args = {
+                key: _resolve_arg(val, observations) for key, val in args.items()
+            }
+        else:
+            # This will likely fail
+            resolved_args = args
+    except Exception as e:
+        return (
+            f"ERROR(Failed to call {tool_to_use.name} with args {args}.)"
+            f" Args could not be resolved. Error: {repr(e)}"
+        )
+    async def run():
+        await (execution_service or get_execution_service()).aacquire_tool(tool_to_use.name)
+        start = time.perf_counter()
+        try:
+            # Tools without a coroutine are run on a thread of the loop's executor by BaseTool.ainvoke
+            return await tool_to_use.ainvoke(resolved_args, config)
+        finally:
+            tool_latencies.record(tool_to_use.name, time.perf_counter() - start)
+
+    try:
+        return await get_tool_cache().acall(tool_to_use, resolved_args, run)
+    except Exception as e:
+        return (
+            f"ERROR(Failed to call {tool_to_use.name} with args {args}."
+            + f" Args resolved to {resolved_args}. Error: {repr(e)})"
+        )
+
+
+async def _aiter_tasks(tasks):
+    if hasattr(tasks, "__aiter__"):
+        async for task in tasks:
+            yield task
+    else:
+        for task in tasks:
+            yield task
+
+
+@as_runnable
+async def aschedule_tasks(scheduler_input: SchedulerInput, config) -> List[FunctionMessage]:
+    """Asyncio version of schedule_tasks, with per-tool concurrency limits."""
+    # Same dependency tracking as schedule_tasks, on the event loop: observations
+    # are only written from the loop, so there is no shared state to guard.
+    # A task first waits for its tool's slot (tool_limits, shared by every plan of
+    # the loop), then for one of the max_parallelism slots of its plan, so tasks
+    # queued on a saturated tool do not hold slots the plan's other tools could use.
+    # Plan slots go to the task with the longest estimated chain of dependents.
+    # Timeouts and cancellation cancel the coroutine of the tool call (a sync tool
+    # keeps running on its executor thread, its result is dropped).
+    tasks = scheduler_input["tasks"]
+    messages = scheduler_input["messages"]
+    max_parallelism = scheduler_input.get("max_parallelism") or MAX_PARALLELISM
+    tool_limits = scheduler_input.get("tool_limits") or TOOL_CONCURRENCY
+    service = scheduler_input.get("execution_service") or get_execution_service()
+    tool_timeouts = scheduler_input.get("tool_timeouts") or TOOL_TIMEOUTS
+    cancel = scheduler_input.get("cancel_event") or config.get("configurable", {}).get("cancel_event")
+    check_interval = CANCEL_CHECK_INTERVAL if cancel is not None else None
+    cancel = cancel or threading.Event()
+    task_config = patch_config(config, configurable={**config.get("configurable", {}), "cancel_event": cancel})
+    observations = _get_observations(messages)
+    originals = set(observations)
+    plan = _PlanState(observations, scheduler_input.get("max_failures", MAX_FAILURES))
+    free_slots = max_parallelism
+    slot_waiters: List[Task] = []
+    slot_futures: Dict[int, asyncio.Future] = {}
+    running: Dict[int, asyncio.Task] = {}
+    # Set once the scheduler cancels the tasks still running
+    stopping = False
+
+    async def acquire_slot(task: Task):
+        nonlocal free_slots
+        if free_slots and not slot_waiters:
+            free_slots -= 1
+            return
+        future = slot_futures[task["idx"]] = asyncio.get_running_loop().create_future()
+        slot_waiters.append(task)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if task in slot_waiters:
+                slot_waiters.remove(task)
+                del slot_futures[task["idx"]]
+            else:
+                # The slot was handed over as the task got cancelled
+                release_slot()
+            raise
+
+    def release_slot():
+        nonlocal free_slots
+        if slot_waiters:
+            slot_futures.pop(plan.graph.pick(slot_waiters)["idx"]).set_result(None)
+        else:
+            free_slots += 1
+
+    async def run(task: Task):
+        idx = task["idx"]
+        became_ready = time.perf_counter()
+        try:
+            async with _tool_semaphore(plan.task_names[idx], tool_limits):
+                await acquire_slot(task)
+                tracing.add_span(f"queue {plan.task_names[idx]}", became_ready, time.perf_counter(), "queue", idx=idx)
+                timeout = _tool_timeout(task, tool_timeouts)
+                try:
+                    with tracing.span(plan.task_names[idx], "task", idx=idx):
+                        observation = await asyncio.wait_for(
+                            _aexecute_task(task, observations, task_config, service), timeout
+                        )
+                except asyncio.TimeoutError:
+                    observation = f"ERROR(Task {idx} ({plan.task_names[idx]}) timed out after {timeout:g}s.)"
+                except asyncio.CancelledError:
+                    asyncio.get_running_loop().call_soon(release_slot)
+                    raise
+                except Exception:
+                    import traceback
+
+                    observation = traceback.format_exc()
+                settle(idx, observation)
+                # Released after the dependents just dispatched by settle have reached
+                # acquire_slot, so they compete for the slot
+                asyncio.get_running_loop().call_soon(release_slot)
+        except asyncio.CancelledError:
+            if not (stopping or cancel.is_set() or plan.is_settled(idx)):
+                # Not cancelled by the scheduler, the task still needs its observation
+                settle(idx, f"ERROR(Task {idx} ({plan.task_names[idx]}) was cancelled.)")
+            # Else settled as cancelled by the scheduler
+        finally:
+            running.pop(idx, None)
+
+    def dispatch(task: Task):
+        if not cancel.is_set():
+            running[task["idx"]] = asyncio.create_task(run(task))
+
+    def settle(idx: int, observation: Any):
+        for task in plan.settle(idx, observation):
+            dispatch(task)
+        if plan.aborted:
+            cancel.set()
+
+    try:
+        async for task in _aiter_tasks(tasks):
+            if cancel.is_set():
+                break
+            if plan.add(task):
+                dispatch(task)
+        if cancel.is_set() and hasattr(tasks, "aclose"):
+            # Stops the planner LLM
+            await tasks.aclose()
+
+        while not cancel.is_set():
+            if running:
+                await asyncio.wait(
+                    list(running.values()), timeout=check_interval, return_when=asyncio.FIRST_COMPLETED
+                )
+                continue
+            if not plan.waiting:
+                break
+            # Whatever still waits depends on tasks that will never run
+            for task in plan.stuck():
+                dispatch(task)
+    finally:
+        # Cancelled, or the scheduler itself was cancelled
+        stopping = True
+        for running_task in list(running.values()):
+            running_task.cancel()
+    if cancel.is_set():
+        plan.cancel(plan.cancel_reason())
+    return plan.to_messages(originals)
+
+
 import itertools
+import queue
+
+
+# Start each task as soon as the planner emits it, instead of once the whole plan is parsed
+PIPELINE_PLAN = os.getenv("SCHEDULER_PIPELINE_PLAN", "1") == "1"
+
+_log_queue: "queue.Queue[Any]" = queue.Queue()
+_log_thread = None
+_log_thread_lock = threading.Lock()
+
+
+def _log_worker():
+    while True:
+        print(_log_queue.get())
+
+
+def _log(*items):
+    """Print items from a background thread, so logging never holds up the plan."""
+    global _log_thread
+    if _log_thread is None:
+        with _log_thread_lock:
+            if _log_thread is None:
+                _log_thread = threading.Thread(target=_log_worker, name="plan-logger", daemon=True)
+                _log_thread.start()
+    for item in items:
+        _log_queue.put(item)
+
+
+def _log_tasks(tasks: Iterable[Task], name: str) -> Iterable[Task]:
+    _log(name, 'Tasks:', '============== Task printing========================')
+    for task in tasks:
+        _log(task)
+        yield task
+    _log('============== Task printing done========================')
+
+
+async def _alog_tasks(tasks, name: str):
+    _log(name, 'Tasks:', '============== Task printing========================')
+    async for task in tasks:
+        _log(task)
+        yield task
+    _log('============== Task printing done========================')
 
 
 @as_runnable
-def plan_and_schedule(state,planner,name):
+def plan_and_schedule(state,planner,name,max_parallelism=None,pipeline=None,execution_service=None,
+                      tool_timeouts=None,max_failures=MAX_FAILURES):
     messages = state["messages"]
+    pipeline = PIPELINE_PLAN if pipeline is None else pipeline
+    tasks = planner.stream(messages)
+    if pipeline:
+        # Messages and tasks are printed by the logging thread while tasks run
+        _log('Messages before tasks breakdown:', '============== Message printing========================',
+             *messages, '============== Message printing done========================')
+        tasks = _log_tasks(tasks, name)
+        return {"messages": schedule_tasks.invoke(
+            {
+                "messages": messages,
+                "tasks": tasks,
+                "max_parallelism": max_parallelism,
+                "execution_service": execution_service,
+                "tool_timeouts": tool_timeouts,
+                "max_failures": max_failures,
+            }
+        )}
+
     print('Messages before tasks breakdown:')
     print('============== Message printing========================')
     for message in messages:
         print(message)
     print('============== Message printing done========================')
-    tasks = planner.stream(messages)
     # Begin executing the planner immediately
     try:
         tasks = itertools.chain([next(tasks)], tasks)
@@ -346,6 +901,32 @@ def plan_and_schedule(state,planner,name):
         {
             "messages": messages,
             "tasks": tasks,
+            "max_parallelism": max_parallelism,
+            "execution_service": execution_service,
+            "tool_timeouts": tool_timeouts,
+            "max_failures": max_failures,
+        }
+    )
+    return {"messages": scheduled_tasks}
+
+
+@as_runnable
+async def aplan_and_schedule(state,planner,name,max_parallelism=None,tool_limits=None,execution_service=None,
+                             tool_timeouts=None,max_failures=MAX_FAILURES):
+    # Always pipelined: tasks start as the planner streams them
+    messages = state["messages"]
+    _log('Messages before tasks breakdown:', '============== Message printing========================',
+         *messages, '============== Message printing done========================')
+    tasks = _alog_tasks(planner.astream(messages), name)
+    scheduled_tasks = await aschedule_tasks.ainvoke(
+        {
+            "messages": messages,
+            "tasks": tasks,
+            "max_parallelism": max_parallelism,
+            "execution_service": execution_service,
+            "tool_timeouts": tool_timeouts,
+            "max_failures": max_failures,
+            "tool_limits": tool_limits,
         }
     )
     return {"messages": scheduled_tasks}
@@ -382,13 +963,6 @@ class JoinOutputs(BaseModel):
 
 
 
-joiner_prompt = hub.pull("yankee/llm-compiler-joiner").partial(
-    examples=""
-)  # You can optionally add examples
-llm = ChatOpenAI(model="gpt-4o-mini")
-
-runnable = joiner_prompt | llm.with_structured_output(JoinOutputs)
-
 def _parse_joiner_output(decision: JoinOutputs) -> List[BaseMessage]:
     response = [AIMessage(content=f"Thought: {decision.thought}")]
     if isinstance(decision.action, Replan):
@@ -413,10 +987,9 @@ def select_recent_messages(state) -> dict:
         selected.append(msg)
         if isinstance(msg, HumanMessage):
             break
-    return {"messages": selected[::-1]}
-
+    # Large observations are cut for the prompt, the state keeps them whole
+    return {"messages": compact_messages(selected[::-1])}
 
-joiner = select_recent_messages | runnable | _parse_joiner_output
 
 from langgraph.graph import END, StateGraph, START
 from langgraph.graph.message import add_messages
@@ -433,37 +1006,13 @@ class State(TypedDict):
 
 from functools import partial
 
-graph_builder = StateGraph(State)
 
-# 1.  Define vertices
-# We defined plan_and_schedule above already
-# Assign each node to a state variable to update
 def plan_and_schedule_wrapper(*args, **kwargs):
     return plan_and_schedule.invoke(*args, **kwargs)
-graph_builder.add_node("plan_and_schedule", partial(plan_and_schedule_wrapper,planner=planner))
-graph_builder.add_node("join", joiner)
 
 
-## Define edges
-graph_builder.add_edge("plan_and_schedule", "join")
-
-### This condition determines looping logic
-
-
-def should_continue(state):
-    messages = state["messages"]
-    if isinstance(messages[-1], AIMessage):
-        return END
-    return "plan_and_schedule"
-
-
-graph_builder.add_conditional_edges(
-    "join",
-    # Next, we pass in the function that will determine which node is called next.
-    should_continue,
-)
-graph_builder.add_edge(START, "plan_and_schedule")
-chain = graph_builder.compile()
+async def aplan_and_schedule_wrapper(*args, **kwargs):
+    return await aplan_and_schedule.ainvoke(*args, **kwargs)
 
 
 
@@ -471,26 +1020,49 @@ chain = graph_builder.compile()
 
 
 def hitl_node(state):
-    print('=========HITL ACTIVATED============')
-    state['hitl_flag'] = True
-    print('=========HITL DEACTIVATED============')
-    print('Exiting state\n',state)
-    # return {"messages": state["messages"],"user_answer": response}
-    return state
-
-
-
-def create_agent(llm, tools,prompt,joiner_prompt,name):
+    # Without an answer the request ends with hitl_flag set, for the caller to
+    # start again. With a checkpointer the graph pauses before this node instead,
+    # and the caller resumes it after setting user_answer.
+    answer = state.get("user_answer")
+    if not answer:
+        print('=========HITL ACTIVATED============')
+        return {"hitl_flag": True}
+    # As a replan context, so the plan goes on from its observations and task indices
+    context = f"Context from last attempt: asked \"{state.get('user_question', '')}\", the user answered: {answer}"
+    return {"messages": [SystemMessage(content=context)], "user_answer": "", "hitl_flag": False}
+
+
+def after_hitl(state):
+    return END if state.get("hitl_flag") else "plan_and_schedule"
+
+
+def create_agent(llm, tools,prompt,joiner_prompt,name,max_parallelism=None,pipeline=None,tool_limits=None,execution_service=None,
+                 tool_timeouts=None,max_failures=MAX_FAILURES,checkpointer=None):
+    # Invoked with ainvoke/astream, the graph runs the asyncio scheduler, where
+    # tool_limits caps the concurrent calls of each tool.
+    # Tool calls of every agent run on the process-wide execution service, unless
+    # one is given, and the model gets the service's rate limit for its name.
+    # Tool calls outliving tool_timeouts fail, and a plan is cancelled after
+    # max_failures failed calls; a request is cancelled by setting the
+    # threading.Event passed as config["configurable"]["cancel_event"]
+    # With a checkpointer (e.g. checkpointing.get_checkpointer()), requests need a
+    # thread_id and pause before "hitl", to be resumed with user_answer set
+    llm = (execution_service or get_execution_service()).rate_limit_model(llm)
     planner = create_planner(llm, tools, prompt)    
     runnable = joiner_prompt | llm.with_structured_output(JoinOutputs)
     joiner = select_recent_messages | runnable | _parse_joiner_output
     graph_builder = StateGraph(State)
-    graph_builder.add_node("plan_and_schedule",partial(plan_and_schedule_wrapper,planner=planner,name=name))
+    graph_builder.add_node("plan_and_schedule",RunnableLambda(
+        partial(plan_and_schedule_wrapper,planner=planner,name=name,max_parallelism=max_parallelism,pipeline=pipeline,
+                execution_service=execution_service,tool_timeouts=tool_timeouts,max_failures=max_failures),
+        afunc=partial(aplan_and_schedule_wrapper,planner=planner,name=name,max_parallelism=max_parallelism,tool_limits=tool_limits,
+                      execution_service=execution_service,tool_timeouts=tool_timeouts,max_failures=max_failures),
+    ))
     graph_builder.add_node("join", joiner)
     graph_builder.add_node("hitl", hitl_node)
     # graph_builder.add_edge("plan_and_schedule", "hitl")
     graph_builder.add_edge("plan_and_schedule", "join")    
-    graph_builder.add_edge("hitl", END)
+    graph_builder.add_conditional_edges("hitl", after_hitl)
     def should_continue(state):
         messages = state["messages"]
         if isinstance(messages[-1], AIMessage):
@@ -506,7 +1078,10 @@ def create_agent(llm, tools,prompt,joiner_prompt,name):
     )
     graph_builder.add_edge(START, "plan_and_schedule")
     # memory = MemorySaver()
-    chain = graph_builder.compile()
+    if checkpointer is not None:
+        chain = graph_builder.compile(checkpointer=checkpointer, interrupt_before=["hitl"])
+    else:
+        chain = graph_builder.compile()
     # chain = graph_builder.compile()
     return chain
 
@@ -552,4 +1127,18 @@ def create_agent(llm, tools,prompt,joiner_prompt,name):
 #     # for i in agent2.channels['messages']:
 #     #     print(i)
 #     print(step)
-#     print("---")
\ No newline at end of file
+#     print("---")
+
+
+if __name__ == "__main__":
+    # Demo agent without tools. Built here rather than at import time, so importing
+    # create_agent does not pull prompts from the hub.
+    llm = ChatOpenAI(model="gpt-4o-mini")
+    prompt = hub.pull("wfh/llm-compiler")
+    joiner_prompt = hub.pull("yankee/llm-compiler-joiner").partial(
+        examples=""
+    )  # You can optionally add examples
+    chain = create_agent(llm, [], prompt, joiner_prompt, "demo")
+    for step in chain.stream({"messages": [HumanMessage(content="What is 15% of 3M's 2022 net sales of 34.2 billion USD?")]}):
+        print(step)
+        print("---")
@@ -20,13 +20,20 @@ from llama_index.retrievers.pathway import PathwayRetriever
 import os
 from dotenv import load_dotenv
 from langchain_community.vectorstores import PathwayVectorClient
+from rag.chunk_store import chunk_store
+from rag.compression import compress_context
+from rag.selection import CANDIDATE_K, adaptive_top_k, mmr_select, term_vectors
+from rag.decomposition import decompose, merge_balanced, parallel_retrieve, path_filter
+from functools import partial
+from rag.transport import attach_transport
+import tracing
 load_dotenv()
 
 os.environ['OPENAI_API_KEY'] = "YOUR_OPENAI_API_KEY"
 
-client = PathwayVectorClient(
-    url="http://172.30.2.194:8788",
-)
+PATHWAY_URL = os.getenv("PATHWAY_URL", "http://172.30.2.194:8788")
+# Both clients share one pooled, circuit-broken transport to the vector server
+client = attach_transport(PathwayVectorClient(url=PATHWAY_URL), PATHWAY_URL)
 # query =  """3M_2022.pdf business segment with least growth contribution"""
 
 # client = OpenAIEmbeddings
@@ -36,7 +43,7 @@ llm = ChatOpenAI(model_name="gpt-4o", temperature=0)
 embd = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
 
 # # retriever = vectorstore.as_retriever()
-retriever = PathwayRetriever(url="http://172.30.2.194:8788", similarity_top_k=10)
+retriever = attach_transport(PathwayRetriever(url=PATHWAY_URL, similarity_top_k=CANDIDATE_K), PATHWAY_URL)
 
 # print(client.similarity_search_with_score(query,metadata_filter =r"contains(path,`3M_2022`)"))
 
@@ -213,7 +220,7 @@ class GraphState(TypedDict):
     Attributes:
         question: question
         generation: LLM generation
-        documents: list of documents
+        documents: list of chunk IDs, the text lives in the chunk store
         count: Number of times retriever is called
         queries: list of possible queries
     """
@@ -228,41 +235,66 @@ class GraphState(TypedDict):
     table: str
     mode: str
 
-def retrieve(state):
+# Bounds of the adaptive cut applied to table and text results of a filing
+TABLE_MAX_K = 4
+TEXT_MAX_K = 3
+
+def diversify(results, max_k):
     """
-    Retrieve documents
+    Keep an adaptive top-k of search results, picked with maximal marginal relevance
 
     Args:
-        state (dict): The current graph state
+        results (list): (document, distance) pairs, best match first
+        max_k (int): Upper bound on the number of results kept
 
     Returns:
-        state (dict): New key added to state, documents, that contains retrieved documents
+        list: The kept (document, distance) pairs
     """
-    print("---RETRIEVE---")
-    question = state["question"]
-    queries = state["queries"]
-    count = state["count"]+1
-    print('======STATE BEFORE RETRIEVAL==========')
-    print(state)
-    # Retrieval
-    documents = []
+    # Pathway returns cosine distances, the cut and MMR work on similarities
+    similarities = [1 - doc[1] for doc in results]
+    k = adaptive_top_k(similarities, min_k=1, max_k=max_k)
+    vectors = term_vectors([doc[0].page_content for doc in results])
+    return [results[i] for i in mmr_select(similarities, vectors, k)]
+
+def search_filing(question, queries, first_round, company, period):
+    """
+    Search the filing of one company for one period with table and text queries
+
+    Args:
+        question (str): The current question
+        queries (list): Rephrased queries, used on the first retrieval round
+        first_round (bool): Whether this is the first retrieval round
+        company (str): Company name used in the document path
+        period (str): Fiscal year used in the document path
+
+    Returns:
+        tuple: De-duplicated (table_results, text_results), best match first
+    """
+    metadata_filter = path_filter(company, period)
+
+    def search(query):
+        with tracing.span("similarity_search", "retriever", query=query, company=company, period=period) as span_args:
+            res = client.similarity_search_with_score(query,k = CANDIDATE_K, metadata_filter =metadata_filter)
+            span_args["documents"] = len(res)
+        return res
+
     table_results = []
     text_results = []
-    if queries[0] != "" and count == 1:
+    if first_round:
         for query in queries:
             table_query = f"Markdown Table {query}"
-            res = client.similarity_search_with_score(table_query,k = 10, metadata_filter =f"contains(path,`{state['company_name']}_{state['year']}`)")
+            res = search(table_query)
             for doc in res:
                 if doc[0].metadata["category"] == "Table":
                     table_results.append(doc)
             normal_query = query
-            res = client.similarity_search_with_score(normal_query,k = 10, metadata_filter =f"contains(path,`{state['company_name']}_{state['year']}`)")
+            res = search(normal_query)
             text_results.extend(res)
     else:
         table_query = f"Markdown Table {question}"
-        table_results = client.similarity_search_with_score(table_query,metadata_filter =f"contains(path,`{state['company_name']}_{state['year']}`)")
+        table_results = search(table_query)
         normal_query = question
-        text_results = client.similarity_search_with_score(normal_query,metadata_filter =f"contains(path,`{state['company_name']}_{state['year']}`)")    
+        text_results = search(normal_query)
 
     unique_table_results = []
     for doc in table_results:
@@ -276,9 +308,43 @@ def retrieve(state):
     text_results = unique_text_results
     table_results.sort(key=lambda x: x[1], reverse=False)
     text_results.sort(key=lambda x: x[1], reverse=False)
-    documents = table_results[:3] + text_results[:2]
-    documents = [doc[0].page_content for doc in documents]
-    return {"documents": documents, "question": question, "count":count}
+    table_results = diversify(table_results, TABLE_MAX_K)
+    text_results = diversify(text_results, TEXT_MAX_K)
+    return table_results, text_results
+
+def retrieve(state):
+    """
+    Retrieve documents
+
+    Comparative questions that span several companies or fiscal years are split
+    into one filtered retrieval per (company, period), run concurrently and merged
+    so that every filing gets an equal share of the documents.
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): New key added to state, documents, that contains retrieved documents
+    """
+    print("---RETRIEVE---")
+    question = state["question"]
+    queries = state["queries"]
+    count = state["count"]+1
+    print('======STATE BEFORE RETRIEVAL==========')
+    print(state)
+    # Retrieval
+    first_round = queries[0] != "" and count == 1
+    pairs = decompose(question, state['company_name'], state['year'])
+    results = parallel_retrieve(partial(search_filing, question, queries, first_round), pairs)
+    if len(pairs) == 1:
+        table_results, text_results = results[pairs[0]]
+        documents = table_results + text_results
+    else:
+        print(f"---RETRIEVE PER PERIOD: {pairs}---")
+        ranked = [table_results + text_results for table_results, text_results in results.values()]
+        documents = merge_balanced(ranked, total_k=max(5, 3 * len(pairs)), key=lambda doc: doc[0].page_content)
+    documents = [chunk_store.put(doc[0].page_content, doc[0].metadata) for doc in documents]
+    return {"documents": documents, "count":count}
 
 def generate(state):
     """
@@ -292,7 +358,7 @@ def generate(state):
     """
     print("---GENERATE---")
     question = state["question"]
-    documents = state["documents"]
+    documents = chunk_store.materialize(state["documents"])
     print('======STATE BEFORE GENERATION==========')
     print(state)
     print(state['mode'])
@@ -301,7 +367,7 @@ def generate(state):
         generation = rag_chain.invoke({"context": documents, "question": question})
     else:
         generation = '\n\n'.join(doc for doc in documents)
-    return {"documents": documents, "question": question, "generation": generation}
+    return {"generation": generation}
 
 
 def grade_documents(state):
@@ -325,7 +391,7 @@ def grade_documents(state):
     for d in documents:
 
         score = retrieval_grader.invoke(
-            {"question": question, "document": d}
+            {"question": question, "document": chunk_store.get(d)}
         )
         grade = score.binary_score
         print("grade: ", grade)
@@ -337,7 +403,7 @@ def grade_documents(state):
         else:
             print("---GRADE: DOCUMENT NOT RELEVANT---")
             continue
-    return {"documents": filtered_docs, "question": question}
+    return {"documents": filtered_docs}
 
 def transform_query(state):
     """
@@ -352,13 +418,12 @@ def transform_query(state):
 
     print("---TRANSFORM QUERY---")
     question = state["question"]
-    documents = state["documents"]
 
     # Re-write question
     better_question = question_rewriter.invoke({"question": question})
     print("better_question: ", better_question)
     print("#####################################")
-    return {"documents": documents, "question": better_question}
+    return {"question": better_question}
 
 def web_search(state):
     """
@@ -377,9 +442,8 @@ def web_search(state):
     # Web search
     docs = web_search_tool.invoke({"query": question})
     web_results = "\n".join([d["content"] for d in docs])
-    web_results = Document(page_content=web_results)
 
-    return {"documents": web_results, "question": question, "mode": "web_search"}
+    return {"documents": [chunk_store.put(web_results, {"source": "web_search"})], "mode": "web_search"}
 
 
 #===================================QUERY REWRITER===============================================
@@ -449,7 +513,6 @@ def possible_queries(state):
 
     print("---REPHRASED QUERIES---")
     question = state["question"]
-    documents = state["documents"]
 
     # Re-write question
     result = query_rewriter.invoke({"question": question})
@@ -459,7 +522,7 @@ def possible_queries(state):
     # print("rephrased queries: ", queries)
     print(result)
     print("#####################################")
-    return {"documents": documents, "queries": [question,result.query1, result.query2, result.query3, result.query4, result.query5], "question": question, "company_name": company_name, "year": year, "table": result.table, "mode": "vectorstore"}
+    return {"queries": [question,result.query1, result.query2, result.query3, result.query4, result.query5], "company_name": company_name, "year": year, "table": result.table, "mode": "vectorstore"}
     
 #==================================================================================
 def route_question(state):
@@ -545,7 +608,7 @@ def grade_generation_v_documents_and_question(state):
 
     print("---CHECK HALLUCINATIONS---")
     question = state["question"]
-    documents = state["documents"]
+    documents = chunk_store.materialize(state["documents"])
     generation = state["generation"]
 
     score = hallucination_grader.invoke(
@@ -579,6 +642,7 @@ workflow.add_node("web_search", web_search)  # web search
 workflow.add_node("retrieve", retrieve)  # retrieve
 workflow.add_node("grade_documents", grade_documents)  # grade documents
 workflow.add_node("generate", generate)  # generatae
+workflow.add_node("compress_context", compress_context)  # compress_context
 workflow.add_node("transform_query", transform_query)  # transform_query
 workflow.add_node("possible_queries", possible_queries)  # possible_queries
 
@@ -601,9 +665,10 @@ workflow.add_conditional_edges(
     decide_to_generate,
     {
         "transform_query": "transform_query",
-        "generate": "generate",
+        "generate": "compress_context",
     },
 )
+workflow.add_edge("compress_context", "generate")
 # new =================================================
 workflow.add_conditional_edges(
     "transform_query",
@@ -634,7 +699,9 @@ def data_node_function(query: str) -> str:
         "generation": "",  # Add this line to initialize generation
         "mode" : ""  # Add this line to initialize mode
     }
-    results =  app.invoke(inputs)
+    # The chunk IDs in the graph state stay valid for the whole run
+    with chunk_store.session():
+        results =  app.invoke(inputs)
     return results['generation']
 
 
@@ -0,0 +1,66 @@
+"""
+Observation store for the schedulers of modular_agent.
+
+Tool outputs reach the graph state as FunctionMessage content, i.e. as
+strings, which is what the joiner and the replanner read. A task of a later
+plan depending on such an output would get it back as a string, to be parsed
+again by the tool's argument schema (a list of 2,500 prices goes list -> str
+-> list, losing the precision str() drops). The native outputs are kept here
+instead, the message only carries their key (`additional_kwargs["obs_key"]`),
+and the schedulers hand the native value to a task whose argument is exactly
+`$N`. Strings are only rendered for the messages the LLMs read.
+
+Keys are random, the store is process wide and bounded, so a message whose
+output has been evicted (or comes from another process, e.g. a restored
+checkpoint) falls back to its content.
+"""
+
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any
+
+# Maximum number of outputs kept in memory, least recently used are evicted first
+MAX_OBSERVATIONS = int(os.getenv("OBSERVATION_STORE_SIZE", "10000"))
+
+_MISSING = object()
+
+
+class ObservationStore:
+    """Thread safe, size bounded map of key -> native tool output."""
+
+    def __init__(self, max_observations: int = MAX_OBSERVATIONS):
+        self.max_observations = max_observations
+        self._observations: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, value: Any) -> str:
+        """Store a tool output, returning its key."""
+        key = "obs-" + uuid.uuid4().hex
+        with self._lock:
+            self._observations[key] = value
+            while len(self._observations) > self.max_observations:
+                self._observations.popitem(last=False)
+        return key
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Output stored under the key, `default` if it was never stored or has been evicted."""
+        with self._lock:
+            value = self._observations.get(key, _MISSING)
+            if value is _MISSING:
+                return default
+            self._observations.move_to_end(key)
+            return value
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._observations
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._observations)
+
+
+# Process wide store shared by all agents
+observation_store = ObservationStore()
@@ -2,6 +2,7 @@ import ast
 import re
 from typing import (
     Any,
+    AsyncIterator,
     Dict,
     Iterator,
     List,
@@ -131,6 +132,21 @@ class LLMCompilerPlanParser(BaseTransformOutputParser[dict], extra="allow"):
             if task:
                 yield task
 
+    async def _atransform(
+        self, input: AsyncIterator[Union[str, BaseMessage]]
+    ) -> AsyncIterator[Task]:
+        # Same as _transform, the default one would parse every chunk on its own
+        texts = []
+        thought = None
+        async for chunk in input:
+            text = chunk if isinstance(chunk, str) else str(chunk.content)
+            for task, thought in self.ingest_token(text, texts, thought):
+                yield task
+        if texts:
+            task, _ = self._parse_task("".join(texts), thought)
+            if task:
+                yield task
+
     def parse(self, text: str) -> List[Task]:
         return list(self._transform([text]))
 
@@ -0,0 +1,143 @@
+"""
+Chunk store for the RAG graphs.
+
+Graph state only carries chunk IDs, the chunk text lives here and is
+materialized where a prompt is built. IDs are content hashes, so the same
+chunk retrieved twice (or by two concurrent requests) is stored once and
+always gets the same ID.
+
+The store is bounded, so a graph run holds on to its chunks with `session()`:
+chunks stored during the session are pinned and never evicted until it ends,
+whatever the load of the other requests.
+"""
+
+import contextlib
+import contextvars
+import hashlib
+import os
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+# Maximum number of chunks kept in memory, least recently used are evicted first
+MAX_CHUNKS = int(os.getenv("RAG_CHUNK_STORE_SIZE", "10000"))
+
+
+def chunk_id(text: str) -> str:
+    """Stable ID of a chunk, derived from its content."""
+    return "chunk-" + hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+class ChunkStore:
+    """Thread safe, size bounded map of chunk ID -> chunk text (and metadata)."""
+
+    def __init__(self, max_chunks: int = MAX_CHUNKS):
+        self.max_chunks = max_chunks
+        self._chunks: "OrderedDict[str, str]" = OrderedDict()
+        self._metadata: Dict[str, dict] = {}
+        # Chunk ID -> number of live sessions holding it
+        self._pins: Counter = Counter()
+        # Chunk IDs held by the session of the calling context
+        self._session: contextvars.ContextVar[Optional[Set[str]]] = contextvars.ContextVar("chunk_session", default=None)
+        self._lock = threading.Lock()
+
+    def put(self, text: str, metadata: Optional[dict] = None) -> str:
+        """
+        Store a chunk.
+
+        Args:
+            text (str): Chunk text
+            metadata (dict, optional): Metadata of the chunk, e.g. its source path
+
+        Returns:
+            str: ID of the chunk
+        """
+        key = chunk_id(text)
+        held = self._session.get()
+        with self._lock:
+            self._chunks[key] = text
+            self._chunks.move_to_end(key)
+            if metadata is not None:
+                self._metadata[key] = metadata
+            if held is not None and key not in held:
+                held.add(key)
+                self._pins[key] += 1
+            self._evict()
+        return key
+
+    def _evict(self) -> None:
+        """Evict least recently used chunks no session holds, down to max_chunks. Needs the lock."""
+        excess = len(self._chunks) - self.max_chunks
+        if excess <= 0:
+            return
+        evicted = []
+        for key in self._chunks:
+            if len(evicted) == excess:
+                break
+            if not self._pins[key]:
+                evicted.append(key)
+        for key in evicted:
+            del self._chunks[key]
+            self._pins.pop(key, None)
+            self._metadata.pop(key, None)
+
+    @contextlib.contextmanager
+    def session(self) -> Iterator[None]:
+        """
+        Pin the chunks stored in the block, e.g. a graph run, until it ends.
+
+        The session follows the context, so nodes running on other threads (with a copy of
+        the context) pin into it. Nested sessions share the outer one.
+        """
+        if self._session.get() is not None:
+            yield
+            return
+        held: Set[str] = set()
+        token = self._session.set(held)
+        try:
+            yield
+        finally:
+            self._session.reset(token)
+            with self._lock:
+                for key in held:
+                    self._pins[key] -= 1
+                    if self._pins[key] <= 0:
+                        del self._pins[key]
+                self._evict()
+
+    def put_many(self, texts: Iterable[str]) -> List[str]:
+        """Store several chunks, returning their IDs in order."""
+        return [self.put(text) for text in texts]
+
+    def get(self, key: str) -> str:
+        """
+        Text of a chunk.
+
+        Raises:
+            KeyError: If the chunk was never stored or has been evicted
+        """
+        with self._lock:
+            text = self._chunks[key]
+            self._chunks.move_to_end(key)
+            return text
+
+    def metadata(self, key: str) -> dict:
+        """Metadata of a chunk, empty if none was stored."""
+        with self._lock:
+            return self._metadata.get(key, {})
+
+    def materialize(self, keys: Iterable[str]) -> List[str]:
+        """Texts of the given chunks, in order."""
+        return [self.get(key) for key in keys]
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._chunks
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._chunks)
+
+
+# Process wide store shared by the RAG graphs
+chunk_store = ChunkStore()
@@ -0,0 +1,296 @@
+"""
+Local extractive context compression for the RAG pipeline.
+
+Retrieved 10-K chunks are usually whole pages, while only a handful of
+sentences or table rows actually answer the question. This module scores
+every sentence / table row of the graded chunks against the question using
+lexical and numeric overlap, keeps the best spans together with their
+neighbours and tags each kept excerpt with a citation back to its chunk.
+No LLM calls are made.
+"""
+
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from rag.chunk_store import chunk_store
+
+# Number of best scoring spans kept across all chunks
+TOP_SPANS = int(os.getenv("RAG_COMPRESSION_TOP_SPANS", "8"))
+# Number of neighbouring spans kept on each side of a selected span
+NEIGHBOURS = int(os.getenv("RAG_COMPRESSION_NEIGHBOURS", "1"))
+# Chunks shorter than this are passed through untouched
+MIN_CHUNK_CHARS = int(os.getenv("RAG_COMPRESSION_MIN_CHARS", "600"))
+# PDF extracted pages put every table cell on its own line, these are grouped
+# into spans of roughly this many characters
+MAX_SPAN_CHARS = 160
+
+WORD_PATTERN = r"[a-z][a-z&\-]+"
+NUMBER_PATTERN = r"\(?-?\$?\d[\d,]*(?:\.\d+)?%?\)?"
+SENTENCE_SPLIT_PATTERN = r"(?<=[.!?;])\s+(?=[A-Z(\$])"
+
+STOPWORDS = frozenset(
+    """a an and are as at be by did do does for from had has have how in is it its
+    of on or that the their this to was were what when which who why will with
+    give provide response question based using shown details relying company
+    company's""".split()
+)
+
+
+### Helper functions
+
+
+def _normalize_number(token: str) -> Optional[str]:
+    """Canonical form of a number so that '1,577' and '1577.00' match."""
+    negative = (token.startswith("(") and token.endswith(")")) or token.startswith("-")
+    digits = re.sub(r"[^\d.]", "", token)
+    if not digits or digits == ".":
+        return None
+    try:
+        value = float(digits)
+    except ValueError:
+        return None
+    if negative:
+        value = -value
+    return f"{value:g}"
+
+
+def _tokenize(text: str) -> List[str]:
+    words = re.findall(WORD_PATTERN, text.lower())
+    # Very light stemming, enough to match 'segments' with 'segment'
+    return [w[:-1] if w.endswith("s") and len(w) > 3 else w for w in words if w not in STOPWORDS]
+
+
+def _numbers(text: str) -> List[str]:
+    numbers = (_normalize_number(n) for n in re.findall(NUMBER_PATTERN, text))
+    return [n for n in numbers if n is not None]
+
+
+def _is_table_row(line: str) -> bool:
+    return line.lstrip().startswith("|")
+
+
+def split_spans(text: str) -> List[Tuple[str, bool]]:
+    """
+    Split a chunk into scoreable spans.
+
+    Markdown table rows become one span each, prose is split into sentences and
+    runs of very short lines (flattened PDF tables) are grouped together.
+
+    Args:
+        text (str): Chunk text
+
+    Returns:
+        List[Tuple[str, bool]]: Spans in document order, flagged when they are table rows
+    """
+    spans = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        lines = [line for line in paragraph.split("\n") if line.strip()]
+        if not lines:
+            continue
+        prose = []
+
+        def flush_prose():
+            if not prose:
+                return
+            average = sum(len(line) for line in prose) / len(prose)
+            if average < 40:
+                # Flattened table, one cell per line: group lines into spans
+                group = []
+                for line in prose:
+                    group.append(line.strip())
+                    if sum(len(g) for g in group) >= MAX_SPAN_CHARS:
+                        spans.append((" ".join(group), False))
+                        group = []
+                if group:
+                    spans.append((" ".join(group), False))
+            else:
+                joined = " ".join(line.strip() for line in prose)
+                for sentence in re.split(SENTENCE_SPLIT_PATTERN, joined):
+                    if sentence.strip():
+                        spans.append((sentence.strip(), False))
+            prose.clear()
+
+        for line in lines:
+            if _is_table_row(line):
+                flush_prose()
+                spans.append((line.rstrip(), True))
+            else:
+                prose.append(line)
+        flush_prose()
+    return spans
+
+
+def score_spans(
+    question: str, chunks_spans: Sequence[Sequence[Tuple[str, bool]]]
+) -> List[List[float]]:
+    """
+    Score every span of every chunk against the question.
+
+    The lexical part is an idf weighted term overlap normalised by span length,
+    the numeric part rewards spans that contain numbers (years, amounts) mentioned
+    in the question and, to a lesser degree, spans that contain numbers at all.
+
+    Args:
+        question (str): User question
+        chunks_spans: Spans of each chunk, as returned by split_spans
+
+    Returns:
+        List[List[float]]: One score per span, grouped by chunk
+    """
+    query_terms = set(_tokenize(question))
+    query_numbers = set(_numbers(question))
+
+    tokenized = [[_tokenize(span) for span, _ in spans] for spans in chunks_spans]
+    n_spans = sum(len(spans) for spans in tokenized) or 1
+    document_frequency = Counter()
+    for spans in tokenized:
+        for tokens in spans:
+            document_frequency.update(set(tokens) & query_terms)
+    idf = {
+        term: math.log(1 + n_spans / (1 + document_frequency[term])) for term in query_terms
+    }
+
+    scores = []
+    for spans, tokens_per_span in zip(chunks_spans, tokenized):
+        chunk_scores = []
+        for (span, _), tokens in zip(spans, tokens_per_span):
+            overlap = set(tokens) & query_terms
+            lexical = sum(idf[t] for t in overlap) / math.sqrt(1 + len(tokens) / 8)
+            span_numbers = set(_numbers(span))
+            numeric = 2.0 * len(span_numbers & query_numbers) + (0.25 if span_numbers else 0.0)
+            chunk_scores.append(lexical + numeric if overlap or span_numbers & query_numbers else 0.0)
+        scores.append(chunk_scores)
+    return scores
+
+
+def compress_documents(
+    question: str,
+    documents: Sequence[str],
+    top_spans: int = TOP_SPANS,
+    neighbours: int = NEIGHBOURS,
+    min_chunk_chars: int = MIN_CHUNK_CHARS,
+    citations: Optional[Sequence[str]] = None,
+) -> List[str]:
+    """
+    Compress graded chunks down to the spans that matter for the question.
+
+    The best span of every chunk is kept, then the best spans across all chunks
+    until `top_spans` are selected, each along with `neighbours` spans on each
+    side. Table header rows are kept whenever a row of their table is selected.
+    Every excerpt is prefixed with a citation to its source chunk and gaps are
+    marked with '...'. Chunks shorter than `min_chunk_chars` are kept whole. If
+    no span of the longer chunks scores at all the documents are returned
+    unchanged so evidence is never lost.
+
+    Args:
+        question (str): User question
+        documents (Sequence[str]): Graded chunk texts
+        top_spans (int): Number of spans kept across all chunks
+        neighbours (int): Context spans kept on each side of a selected span
+        min_chunk_chars (int): Chunks shorter than this are not compressed
+        citations (Sequence[str], optional): Citation label per chunk, defaults to 'chunk <i>'
+
+    Returns:
+        List[str]: Compressed chunk texts
+    """
+    documents = list(documents)
+    if not documents:
+        return documents
+    if citations is None:
+        citations = [f"chunk {i + 1}" for i in range(len(documents))]
+
+    chunks_spans = [split_spans(doc) for doc in documents]
+    scores = score_spans(question, chunks_spans)
+
+    ranked = sorted(
+        (
+            (score, chunk_idx, span_idx)
+            for chunk_idx, chunk_scores in enumerate(scores)
+            for span_idx, score in enumerate(chunk_scores)
+            if score > 0 and len(documents[chunk_idx]) >= min_chunk_chars
+        ),
+        reverse=True,
+    )
+    if not ranked:
+        return documents
+    short_chunks = [i for i, doc in enumerate(documents) if len(doc) < min_chunk_chars]
+
+    # Every graded chunk keeps at least its best span, the rest of the budget
+    # goes to the best spans overall
+    best = {}
+    for entry in ranked:
+        best.setdefault(entry[1], entry)
+    for chunk_idx, chunk_scores in enumerate(scores):
+        if chunk_idx not in best and chunk_idx not in short_chunks and chunk_scores:
+            best[chunk_idx] = (0.0, chunk_idx, 0)
+    kept = set(best.values())
+    remaining = [entry for entry in ranked if entry not in kept]
+    chosen = sorted(kept, reverse=True) + remaining[:max(0, top_spans - len(kept))]
+
+    selected: Dict[int, set] = {}
+    for _, chunk_idx, span_idx in chosen:
+        spans = chunks_spans[chunk_idx]
+        keep = selected.setdefault(chunk_idx, set())
+        keep.update(
+            range(max(0, span_idx - neighbours), min(len(spans), span_idx + neighbours + 1))
+        )
+        if spans[span_idx][1]:
+            # Keep the header (and separator) of the table the row belongs to
+            start = span_idx
+            while start > 0 and spans[start - 1][1]:
+                start -= 1
+            for header_idx in range(start, min(start + 2, len(spans))):
+                if spans[header_idx][1]:
+                    keep.add(header_idx)
+
+    compressed = []
+    for chunk_idx, doc in enumerate(documents):
+        if chunk_idx in short_chunks:
+            compressed.append(f"[{citations[chunk_idx]}] {doc}")
+            continue
+        spans = chunks_spans[chunk_idx]
+        parts = []
+        previous = None
+        for span_idx in sorted(selected[chunk_idx]):
+            if previous is not None and span_idx != previous + 1:
+                parts.append("...")
+            parts.append(spans[span_idx][0])
+            previous = span_idx
+        compressed.append(f"[{citations[chunk_idx]}] " + "\n".join(parts))
+    return compressed
+
+
+def compress_context(state):
+    """
+    Compress the graded documents down to the sentences and table rows relevant to the question.
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): Updates documents key with cited extracts of the relevant documents
+    """
+
+    print("---COMPRESS CONTEXT---")
+    question = state["question"]
+    documents = chunk_store.materialize(state["documents"])
+
+    compressed = compress_documents(question, documents, citations=state["documents"])
+    print(f"compressed {sum(len(d) for d in documents)} chars to {sum(len(d) for d in compressed)} chars")
+    return {"documents": chunk_store.put_many(compressed)}
+
+
+# Example Usage
+if __name__ == "__main__":
+    import json
+
+    with open("test.json") as file:
+        evidence = json.load(file)[0]
+    question = "Which segment dragged down 3M's overall growth in 2022?"
+    page = evidence["evidence_text_full_page"]
+    result = compress_documents(question, [page])
+    print(f"Original: {len(page)} chars, compressed: {sum(len(r) for r in result)} chars")
+    print("\n\n".join(result))
@@ -0,0 +1,181 @@
+"""
+Decomposition of comparative questions into per (company, period) retrievals.
+
+Questions such as "which segment dragged down 3M's growth in 2022 vs 2021"
+need evidence from several filings. Instead of one mixed search, the question
+is split into one filtered retrieval per (company, fiscal period) pair, the
+retrievals run concurrently and their results are merged with a balanced
+quota so every filing is represented in the context.
+"""
+
+import contextvars
+import itertools
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+# FY2022, FY 2022, 2022 -> 2022
+YEAR_PATTERN = r"\b(?:FY\s?)?((?:19|20)\d{2})\b"
+# FY22 -> 2022
+SHORT_FY_PATTERN = r"\bFY\s?'?(\d{2})\b"
+# Years of a question that name a filing: after 'FY', 'fiscal (year)', 'in', 'for',
+# 'during', '(years) ended' or before '10-K' / 'annual report', along with the years
+# listed right after them ('in 2022 vs 2021'). 'notes due 2026' names no filing.
+FISCAL_YEAR_PATTERN = (
+    r"(?:\b(?:FY\s?|fiscal\s+(?:years?\s+)?|(?:in|for|during|of)\s+(?:fiscal\s+)?(?:years?\s+)?"
+    r"|years?\s+(?:ended\s+)?)(?:19|20)\d{2}\b(?!\s+(?:notes|senior|bonds|debentures)\b)"
+    r"|\b(?:19|20)\d{2}\s+(?:10-?K|annual\s+report|fiscal\s+year)\b)"
+    r"(?:\s*(?:,|;|&|/|-|\band\b|\bto\b|\bvs\.?|\bversus\b)\s*(?:FY\s?)?(?:19|20)\d{2}\b)*"
+)
+# Company names are only split on these, 'and', '&' and '/' are part of names
+# like 'Johnson & Johnson' or 'AT&T'
+LIST_SEPARATOR_PATTERN = r"\s*(?:,|;|\bvs\.?|\bversus\b)\s*"
+# 'Adobe and AMD' is two companies only when both are known ones
+NAME_SEPARATOR_PATTERN = r"\s*(?:&|/|\band\b)\s*"
+
+# Companies of the FinanceBench filings in the corpus
+KNOWN_COMPANIES = frozenset(name.lower() for name in (
+    "3M", "AES Corporation", "AES", "AMD", "Activision Blizzard", "Adobe", "Amazon", "Amcor",
+    "American Express", "American Water Works", "Best Buy", "Block", "Boeing", "CVS Health",
+    "Coca-Cola", "Corning", "Costco", "Foot Locker", "General Mills", "JPMorgan",
+    "Johnson & Johnson", "Kraft Heinz", "Lockheed Martin", "MGM Resorts", "Microsoft", "Netflix",
+    "Nike", "Paypal", "PepsiCo", "Pfizer", "Ulta Beauty", "Verizon", "Walmart",
+))
+
+# Upper bound on concurrent sub-retrievals for a single question
+MAX_PARALLEL_RETRIEVALS = 8
+
+
+def detect_periods(question: str, year: str = "") -> List[str]:
+    """
+    Detect the fiscal years a question asks about.
+
+    Args:
+        question (str): User question
+        year (str): Year(s) of the filing already inferred by the query rewriter, may list several
+
+    Returns:
+        List[str]: Distinct four digit years in order of appearance. Years of the
+        question only count in a fiscal-year context, not e.g. in 'notes due 2026'.
+    """
+    periods = re.findall(YEAR_PATTERN, year or "")
+    for match in re.finditer(FISCAL_YEAR_PATTERN, question, flags=re.IGNORECASE):
+        periods += re.findall(YEAR_PATTERN, match.group(0))
+    periods += [f"20{short}" for short in re.findall(SHORT_FY_PATTERN, f"{year} {question}")]
+    return list(dict.fromkeys(periods))
+
+
+def _split_names(name: str) -> List[str]:
+    """A name joined with 'and', '&' or '/' split into its known companies, else itself."""
+    if name.lower() in KNOWN_COMPANIES:
+        return [name]
+    parts = [part.strip() for part in re.split(NAME_SEPARATOR_PATTERN, name, flags=re.IGNORECASE)]
+    parts = [part for part in parts if part]
+    if len(parts) > 1 and all(part.lower() in KNOWN_COMPANIES for part in parts):
+        return parts
+    return [name]
+
+
+def detect_companies(company_name: str) -> List[str]:
+    """
+    Split the company name(s) inferred by the query rewriter.
+
+    Args:
+        company_name (str): e.g. '3M', 'Johnson & Johnson' or '3M, Adobe and AMD'
+
+    Returns:
+        List[str]: Distinct company names
+    """
+    companies = []
+    for name in re.split(LIST_SEPARATOR_PATTERN, company_name or "", flags=re.IGNORECASE):
+        # '3M, Adobe, and AMD'
+        name = re.sub(r"^(?:and|&)\s+", "", name.strip(), flags=re.IGNORECASE)
+        if name:
+            companies += _split_names(name)
+    return list(dict.fromkeys(companies))
+
+
+def decompose(question: str, company_name: str, year: str) -> List[Tuple[str, str]]:
+    """
+    Build the (company, period) pairs a question needs evidence for.
+
+    Args:
+        question (str): User question
+        company_name (str): Company name(s) inferred by the query rewriter
+        year (str): Year(s) inferred by the query rewriter
+
+    Returns:
+        List[Tuple[str, str]]: One pair per filing to search, a single pair for simple questions
+    """
+    companies = detect_companies(company_name) or [company_name]
+    periods = detect_periods(question, year) or [year]
+    return list(itertools.product(companies, periods))
+
+
+def path_filter(company: str, period: str) -> str:
+    """Pathway metadata filter selecting the filing of a company for a period."""
+    return f"contains(path,`{company}_{period}`)"
+
+
+def merge_balanced(
+    results_per_pair: Sequence[Sequence[Any]],
+    total_k: int,
+    key: Callable[[Any], Any] = lambda result: result,
+) -> List[Any]:
+    """
+    Merge ranked result lists so that each pair gets an equal share of the context.
+
+    Results are taken round-robin, best first, from every list until `total_k`
+    results are collected. Duplicates (by `key`) are skipped, and lists that run
+    dry leave their share to the others.
+
+    Args:
+        results_per_pair: One ranked result list per (company, period) pair
+        total_k (int): Number of results to keep
+        key (Callable): Identity of a result used for de-duplication
+
+    Returns:
+        List[Any]: Merged results
+    """
+    merged = []
+    seen = set()
+    iterators = [iter(results) for results in results_per_pair]
+    while iterators and len(merged) < total_k:
+        for iterator in list(iterators):
+            for result in iterator:
+                if key(result) not in seen:
+                    seen.add(key(result))
+                    merged.append(result)
+                    break
+            else:
+                iterators.remove(iterator)
+                continue
+            if len(merged) >= total_k:
+                break
+    return merged
+
+
+def parallel_retrieve(
+    retrieve_pair: Callable[[str, str], List[Any]],
+    pairs: Sequence[Tuple[str, str]],
+) -> Dict[Tuple[str, str], List[Any]]:
+    """
+    Run one retrieval per (company, period) pair concurrently.
+
+    Args:
+        retrieve_pair (Callable): Function (company, period) -> ranked results
+        pairs: (company, period) pairs to retrieve
+
+    Returns:
+        Dict[Tuple[str, str], List[Any]]: Ranked results per pair, in the order of `pairs`
+    """
+    if len(pairs) == 1:
+        return {pairs[0]: retrieve_pair(*pairs[0])}
+    with ThreadPoolExecutor(max_workers=min(len(pairs), MAX_PARALLEL_RETRIEVALS)) as executor:
+        # Each retrieval runs in a copy of the caller's context, so context variables
+        # (callbacks, usage attribution) follow it into the worker threads
+        futures = [
+            executor.submit(contextvars.copy_context().run, retrieve_pair, company, period)
+            for company, period in pairs
+        ]
+        return {pair: future.result() for pair, future in zip(pairs, futures)}
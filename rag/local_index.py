@@ -0,0 +1,176 @@
+"""
+Local BM25 index over document chunks.
+
+Used as a fallback when the Pathway vector server is unhealthy. The index
+answers queries in the same shape as the Pathway `/v1/retrieve` endpoint
+(list of {"text", "metadata", "dist"}), so callers do not need to know
+which backend served them.
+
+The chunks are read from a JSON lines file, one {"text": ..., "metadata": {...}}
+object per line, RAG_LOCAL_INDEX. It is built from the filings served by the
+vector server:
+
+    python -m rag.local_index Financial_Reports --output local_index.jsonl
+"""
+
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
+
+# JSON lines file with the chunks of the local index
+LOCAL_INDEX_PATH = os.getenv("RAG_LOCAL_INDEX", "")
+
+TOKEN_PATTERN = r"[a-z0-9][a-z0-9&\-\.]*"
+# contains(path,`3M_2022`) -> path, 3M_2022
+CONTAINS_FILTER_PATTERN = r"contains\((\w+),\s*`([^`]*)`\)"
+
+
+def tokenize(text: str) -> List[str]:
+    return [token.rstrip(".") for token in re.findall(TOKEN_PATTERN, text.lower())]
+
+
+def _matches_filter(metadata: dict, metadata_filter: Optional[str]) -> bool:
+    """Evaluate the `contains(field, `value`)` filters used by the RAG graphs, joined with &&."""
+    if not metadata_filter:
+        return True
+    for field, value in re.findall(CONTAINS_FILTER_PATTERN, metadata_filter):
+        if value not in str(metadata.get(field, "")):
+            return False
+    return True
+
+
+class BM25Index:
+    """In-memory Okapi BM25 index."""
+
+    def __init__(self, chunks: Sequence[dict], k1: float = 1.5, b: float = 0.75):
+        """
+        Args:
+            chunks (Sequence[dict]): {"text": str, "metadata": dict} entries
+            k1 (float): Term frequency saturation
+            b (float): Length normalisation
+        """
+        self.chunks = list(chunks)
+        self.k1 = k1
+        self.b = b
+        self.term_frequencies = [Counter(tokenize(chunk["text"])) for chunk in self.chunks]
+        self.lengths = [sum(tf.values()) for tf in self.term_frequencies]
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        document_frequency = Counter()
+        for tf in self.term_frequencies:
+            document_frequency.update(tf.keys())
+        n = len(self.chunks)
+        self.idf: Dict[str, float] = {
+            term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in document_frequency.items()
+        }
+
+    @classmethod
+    def from_jsonl(cls, path: str, **kwargs) -> "BM25Index":
+        with open(path, encoding="utf-8") as file:
+            chunks = [json.loads(line) for line in file if line.strip()]
+        return cls(chunks, **kwargs)
+
+    def scores(self, query: str) -> List[float]:
+        """BM25 score of every chunk for the query."""
+        terms = [term for term in tokenize(query) if term in self.idf]
+        scores = []
+        for tf, length in zip(self.term_frequencies, self.lengths):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * length / (self.average_length or 1.0))
+            for term in terms:
+                freq = tf.get(term, 0)
+                if freq:
+                    score += self.idf[term] * freq * (self.k1 + 1) / (freq + norm)
+            scores.append(score)
+        return scores
+
+    def query(self, query: str, k: int = 3, metadata_filter: Optional[str] = None) -> List[dict]:
+        """
+        Retrieve the best matching chunks.
+
+        Args:
+            query (str): Query text
+            k (int): Number of chunks returned
+            metadata_filter (str, optional): `contains(field, `value`)` filter as sent to Pathway
+
+        Returns:
+            List[dict]: {"text", "metadata", "dist"} entries, closest first. The distance is
+            1 - score / best score so that it ranks like a Pathway cosine distance.
+        """
+        scores = self.scores(query)
+        candidates = [
+            (score, i)
+            for i, score in enumerate(scores)
+            if score > 0 and _matches_filter(self.chunks[i].get("metadata", {}), metadata_filter)
+        ]
+        candidates.sort(reverse=True)
+        best = candidates[0][0] if candidates else 1.0
+        return [
+            {
+                "text": self.chunks[i]["text"],
+                "metadata": self.chunks[i].get("metadata", {}),
+                "dist": 1 - score / best,
+            }
+            for score, i in candidates[:k]
+        ]
+
+    __call__ = query
+
+
+def load_local_index(path: str = LOCAL_INDEX_PATH) -> Optional[BM25Index]:
+    """The local index configured through RAG_LOCAL_INDEX, None if there is none."""
+    if not path or not os.path.exists(path):
+        return None
+    return BM25Index.from_jsonl(path)
+
+
+def build_local_index(directory: str, output: str, chunk_size: int = 1000, chunk_overlap: int = 100) -> int:
+    """
+    Write the chunks of the PDF filings of a directory as a local index file.
+
+    Chunk paths are the file paths, e.g. Financial_Reports/3M_2022.pdf, so the path
+    filters of the RAG graphs select the same filings as on the vector server. All
+    chunks are "NarrativeText": page text extraction does not tell tables apart.
+
+    Args:
+        directory (str): Directory of the filings, searched recursively for .pdf files
+        output (str): JSON lines file written
+        chunk_size (int): Characters per chunk
+        chunk_overlap (int): Characters shared by consecutive chunks
+
+    Returns:
+        int: Number of chunks written
+    """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from pypdf import PdfReader
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    written = 0
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        for root, _, names in sorted(os.walk(directory)):
+            for name in sorted(names):
+                if not name.lower().endswith(".pdf"):
+                    continue
+                path = os.path.join(root, name)
+                for page_num, page in enumerate(PdfReader(path).pages):
+                    for text in splitter.split_text(page.extract_text() or ""):
+                        metadata = {"path": path, "category": "NarrativeText", "page": page_num}
+                        file.write(json.dumps({"text": text, "metadata": metadata}) + "\n")
+                        written += 1
+    return written
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the local fallback index from a directory of PDF filings.")
+    parser.add_argument("directory")
+    parser.add_argument("--output", default=LOCAL_INDEX_PATH or "local_index.jsonl")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    args = parser.parse_args()
+    count = build_local_index(args.directory, args.output, args.chunk_size, args.chunk_overlap)
+    print(f"{count} chunks written to {args.output}, set RAG_LOCAL_INDEX={args.output}")
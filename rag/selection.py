@@ -0,0 +1,177 @@
+"""
+Selection of retrieved chunks.
+
+Instead of a constant top-k, a generous candidate set is fetched from the
+vector store and cut where the similarity scores stop being informative:
+at the knee of the score curve, or once the selected chunks hold a given
+share of the total score mass. The cut is clamped to configurable bounds,
+so narrow questions pass two chunks to the graders while broad ones can
+still get many.
+
+The kept chunks are then picked with maximal marginal relevance, so that
+near-duplicates (the same segment table in MD&A and in the notes, repeated
+boilerplate) do not crowd out distinct evidence. Relevance is the score of
+the retriever, redundancy the cosine similarity of tf-idf term vectors of
+the chunk texts: the vector stores return no embeddings, and no candidate is
+embedded again for the selection.
+"""
+
+import math
+import os
+from collections import Counter
+from typing import List, Sequence, TypeVar
+
+import numpy as np
+
+from rag.local_index import tokenize
+
+T = TypeVar("T")
+
+# Number of candidates fetched from the vector store before the cut
+CANDIDATE_K = int(os.getenv("RAG_CANDIDATE_K", "20"))
+# Bounds of the adaptive cut
+MIN_K = int(os.getenv("RAG_MIN_K", "2"))
+MAX_K = int(os.getenv("RAG_MAX_K", "12"))
+# 'knee' or 'cumulative'
+TOP_K_METHOD = os.getenv("RAG_TOP_K_METHOD", "knee")
+# Share of the score mass kept by the 'cumulative' method
+CUMULATIVE_THRESHOLD = float(os.getenv("RAG_CUMULATIVE_THRESHOLD", "0.8"))
+# Trade-off between relevance (1.0) and diversity (0.0) of the MMR selection
+MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+# Curves closer than this to a straight line have no knee
+MIN_KNEE_DISTANCE = 0.05
+
+
+def _knee(scores: Sequence[float]) -> int:
+    """Number of scores ranked above the knee of a descending curve, 0 if there is none."""
+    n = len(scores)
+    top, bottom = scores[0], scores[-1]
+    if n < 3 or top - bottom <= 1e-12:
+        return 0
+    # Distance of the normalised curve below the chord joining its end points
+    distances = [
+        1 - i / (n - 1) - (score - bottom) / (top - bottom) for i, score in enumerate(scores)
+    ]
+    knee = max(range(n), key=distances.__getitem__)
+    if distances[knee] < MIN_KNEE_DISTANCE:
+        return 0
+    return knee
+
+
+def _cumulative(scores: Sequence[float], threshold: float) -> int:
+    """Smallest number of scores holding `threshold` of the mass above the weakest candidate."""
+    weights = [score - scores[-1] for score in scores]
+    total = sum(weights)
+    if total <= 1e-12:
+        return 0
+    running = 0.0
+    for k, weight in enumerate(weights, start=1):
+        running += weight
+        if running >= threshold * total:
+            return k
+    return len(scores)
+
+
+def adaptive_top_k(
+    scores: Sequence[float],
+    min_k: int = MIN_K,
+    max_k: int = MAX_K,
+    method: str = TOP_K_METHOD,
+    cumulative_threshold: float = CUMULATIVE_THRESHOLD,
+) -> int:
+    """
+    Decide how many of the ranked candidates to keep.
+
+    Args:
+        scores (Sequence[float]): Similarity of each candidate, best first, higher is more similar
+        min_k (int): Minimum number of candidates kept
+        max_k (int): Maximum number of candidates kept
+        method (str): 'knee' to cut at the knee of the score curve, 'cumulative' to cut
+            once `cumulative_threshold` of the score mass is covered
+        cumulative_threshold (float): Share of the score mass kept by the 'cumulative' method
+
+    Returns:
+        int: Number of candidates to keep
+    """
+    if method not in ("knee", "cumulative"):
+        raise ValueError(f"Unknown top-k method '{method}', expected 'knee' or 'cumulative'.")
+    scores = list(scores)
+    if len(scores) <= min_k:
+        return len(scores)
+    if method == "knee":
+        k = _knee(scores)
+    else:
+        k = _cumulative(scores, cumulative_threshold)
+    if k == 0:
+        # Flat curve, the scores do not tell the candidates apart
+        k = len(scores)
+    return max(min_k, min(k, max_k))
+
+
+def select_top_k(candidates: Sequence[T], scores: Sequence[float], **kwargs) -> List[T]:
+    """
+    Keep the adaptive top-k of ranked candidates.
+
+    Args:
+        candidates (Sequence): Candidates, best first
+        scores (Sequence[float]): Similarity of each candidate, higher is more similar
+        **kwargs: Forwarded to adaptive_top_k
+
+    Returns:
+        List: The kept candidates
+    """
+    return list(candidates[: adaptive_top_k(scores, **kwargs)])
+
+
+def term_vectors(texts: Sequence[str]) -> np.ndarray:
+    """
+    Unit length tf-idf vectors of texts, over their shared vocabulary.
+
+    Args:
+        texts (Sequence[str]): Chunk texts
+
+    Returns:
+        np.ndarray: One row per text, rows of texts without terms are zero
+    """
+    counts = [Counter(tokenize(text)) for text in texts]
+    vocabulary = {term: i for i, term in enumerate(sorted(set().union(*counts)))}
+    document_frequency = Counter(term for count in counts for term in count)
+    vectors = np.zeros((len(texts), len(vocabulary)))
+    for row, count in enumerate(counts):
+        for term, frequency in count.items():
+            idf = math.log(1 + len(texts) / document_frequency[term])
+            vectors[row, vocabulary[term]] = (1 + math.log(frequency)) * idf
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def mmr_select(
+    scores: Sequence[float],
+    vectors: np.ndarray,
+    k: int,
+    lambda_mult: float = MMR_LAMBDA,
+) -> List[int]:
+    """
+    Pick `k` candidates that are relevant to the query but not redundant with each other.
+
+    Args:
+        scores (Sequence[float]): Similarity of each candidate to the query, higher is more similar
+        vectors (np.ndarray): Unit length vector of each candidate, e.g. from term_vectors
+        k (int): Number of candidates to pick
+        lambda_mult (float): 1.0 ranks purely by relevance, 0.0 purely by diversity
+
+    Returns:
+        List[int]: Indices of the picked candidates, in selection order
+    """
+    relevance = np.asarray(scores, dtype=float)
+    k = min(k, len(relevance))
+    if k <= 0:
+        return []
+    similarity = vectors @ vectors.T
+    selected = [int(np.argmax(relevance))]
+    while len(selected) < k:
+        redundancy = similarity[:, selected].max(axis=1)
+        marginal = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        marginal[selected] = -np.inf
+        selected.append(int(np.argmax(marginal)))
+    return selected
@@ -0,0 +1,250 @@
+"""
+Shared HTTP transport for the Pathway vector store.
+
+`PathwayVectorClient` and `PathwayRetriever` each post to the vector server
+with a fresh connection per request and no bound on how many requests are in
+flight, so a slow server stalls every worker thread. This transport is shared
+by all clients of a server URL and provides:
+
+- connection pooling and keep-alive through a `requests.Session`
+- per-request connect / read timeouts
+- a bound on concurrent requests to the server
+- a circuit breaker that fails fast while the server is unhealthy and,
+  when a local index is configured, answers from it instead. Only 5xx
+  responses, connection errors and timeouts count as failures: a 4xx is a bad
+  request (filter, payload) to a healthy server.
+
+It speaks the same interface as the libraries' internal `_VectorStoreClient`
+(`query`, `get_vectorstore_statistics`, `get_input_files`), so it is plugged
+into them by replacing their `client` attribute, see `attach_transport`.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rag.local_index import BM25Index, load_local_index
+
+PATHWAY_CONNECT_TIMEOUT = float(os.getenv("PATHWAY_CONNECT_TIMEOUT", "1.0"))
+PATHWAY_READ_TIMEOUT = float(os.getenv("PATHWAY_READ_TIMEOUT", "5.0"))
+PATHWAY_POOL_SIZE = int(os.getenv("PATHWAY_POOL_SIZE", "16"))
+PATHWAY_MAX_CONCURRENCY = int(os.getenv("PATHWAY_MAX_CONCURRENCY", "16"))
+# Consecutive failures that open the circuit, and seconds before a trial request
+PATHWAY_BREAKER_FAILURES = int(os.getenv("PATHWAY_BREAKER_FAILURES", "5"))
+PATHWAY_BREAKER_RESET = float(os.getenv("PATHWAY_BREAKER_RESET", "30"))
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a server whose circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    closed: requests go through, failures are counted.
+    open: requests fail fast until `reset_timeout` seconds have passed.
+    half-open: a single trial request goes through, its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = PATHWAY_BREAKER_FAILURES, reset_timeout: float = PATHWAY_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now."""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def record_release(self) -> None:
+        """End a request that tells nothing about the health of the server, e.g. a bad request."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class VectorStoreTransport:
+    """Pooled, bounded and circuit-broken client for one Pathway vector server."""
+
+    def __init__(
+        self,
+        url: str,
+        connect_timeout: float = PATHWAY_CONNECT_TIMEOUT,
+        read_timeout: float = PATHWAY_READ_TIMEOUT,
+        pool_size: int = PATHWAY_POOL_SIZE,
+        max_concurrency: int = PATHWAY_MAX_CONCURRENCY,
+        breaker: Optional[CircuitBreaker] = None,
+        fallback: Optional[BM25Index] = None,
+    ):
+        """
+        Args:
+            url (str): Base URL of the vector server
+            connect_timeout (float): Seconds to establish a connection
+            read_timeout (float): Seconds to wait for a response
+            pool_size (int): Keep-alive connections kept open to the server
+            max_concurrency (int): Requests allowed in flight at once, others wait for a slot
+                for at most `read_timeout` seconds
+            breaker (CircuitBreaker, optional): Defaults to a breaker configured from the environment
+            fallback (BM25Index, optional): Local index answering queries while the server is unhealthy
+        """
+        self.url = url.rstrip("/")
+        self.timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+        self.breaker = breaker or CircuitBreaker()
+        self.fallback = fallback
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def _post(self, path: str, payload: Dict[str, Any]) -> Any:
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Vector store at {self.url} is unhealthy, circuit is open.")
+        if not self._slots.acquire(timeout=self.timeout[1]):
+            self.breaker.record_failure()
+            raise requests.Timeout(f"No free connection slot to {self.url} within {self.timeout[1]}s.")
+        # None while the outcome says nothing about the health of the server
+        healthy: Optional[bool] = None
+        try:
+            try:
+                response = self.session.post(self.url + path, json=payload, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+                healthy = False
+                raise
+            healthy = response.status_code < 500
+            response.raise_for_status()
+            return response.json()
+        finally:
+            self._slots.release()
+            if healthy is None:
+                self.breaker.record_release()
+            elif healthy:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+    def query(self, query: str, k: int = 3, metadata_filter: Optional[str] = None) -> List[dict]:
+        """
+        Retrieve the `k` chunks closest to the query.
+
+        Args:
+            query (str): Query text
+            k (int): Number of chunks returned
+            metadata_filter (str, optional): JMESPath filter on the chunk metadata
+
+        Returns:
+            List[dict]: {"text", "metadata", "dist"} entries, closest first
+
+        Raises:
+            CircuitOpenError, requests.RequestException: If the server cannot answer and no
+                fallback index is configured
+        """
+        data: Dict[str, Any] = {"query": query, "k": k}
+        if metadata_filter is not None:
+            data["metadata_filter"] = metadata_filter
+        try:
+            responses = self._post("/v1/retrieve", data)
+        except (CircuitOpenError, requests.RequestException, ValueError) as e:
+            if self.fallback is None:
+                raise
+            print(f"---VECTOR STORE UNAVAILABLE ({e!r}), USING LOCAL INDEX---")
+            return self.fallback.query(query, k=k, metadata_filter=metadata_filter)
+        return sorted(responses, key=lambda x: x["dist"])
+
+    # Make an alias, PathwayRetriever calls the client directly
+    __call__ = query
+
+    def get_vectorstore_statistics(self) -> dict:
+        """Fetch basic statistics about the vector store."""
+        return self._post("/v1/statistics", {})
+
+    def get_input_files(
+        self,
+        metadata_filter: Optional[str] = None,
+        filepath_globpattern: Optional[str] = None,
+    ) -> list:
+        """Fetch information on documents in the vector store."""
+        return self._post(
+            "/v1/inputs",
+            {"metadata_filter": metadata_filter, "filepath_globpattern": filepath_globpattern},
+        )
+
+
+_transports: Dict[str, VectorStoreTransport] = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(url: str) -> VectorStoreTransport:
+    """
+    The process wide transport for a vector server URL.
+
+    The first call creates it, with the local index configured through RAG_LOCAL_INDEX
+    as fallback, later calls for the same URL share its connection pool and breaker.
+    """
+    url = url.rstrip("/")
+    with _transports_lock:
+        if url not in _transports:
+            _transports[url] = VectorStoreTransport(url, fallback=load_local_index())
+        return _transports[url]
+
+
+def attach_transport(client: Any, url: str) -> Any:
+    """
+    Route a `PathwayVectorClient` or `PathwayRetriever` through the shared transport of `url`.
+
+    Both keep their HTTP client in a `client` attribute with the interface implemented by
+    VectorStoreTransport.
+
+    Returns:
+        The same client, for chaining
+    """
+    client.client = get_transport(url)
+    return client
+
+
+# Example Usage, point PATHWAY_URL to a real server or to the local stand-in server
+if __name__ == "__main__":
+    transport = get_transport(os.getenv("PATHWAY_URL", "http://127.0.0.1:8767"))
+    for _ in range(3):
+        try:
+            print(transport.query("3M capital expenditure 2018", k=2))
+        except Exception as e:
+            print(f"Query failed: {e!r}, breaker is {transport.breaker.state}")
@@ -0,0 +1,60 @@
+import threading
+
+from rag.chunk_store import ChunkStore
+
+
+def test_chunks_of_a_live_session_are_not_evicted():
+    store = ChunkStore(max_chunks=2)
+    started, flooded = threading.Event(), threading.Event()
+    result = {}
+
+    def request():
+        with store.session():
+            keys = [store.put("kept a"), store.put("kept b")]
+            started.set()
+            flooded.wait()
+            result["texts"] = store.materialize(keys)
+
+    thread = threading.Thread(target=request)
+    thread.start()
+    started.wait()
+    # Another request's retrievals, outside the session
+    for i in range(10):
+        store.put(f"other {i}")
+    flooded.set()
+    thread.join()
+    assert result["texts"] == ["kept a", "kept b"]
+
+
+def test_store_shrinks_back_once_sessions_end():
+    store = ChunkStore(max_chunks=2)
+    with store.session():
+        keys = [store.put(f"chunk {i}") for i in range(5)]
+        assert len(store) == 5
+    assert len(store) == 2
+    assert keys[-1] in store and keys[0] not in store
+
+
+def test_chunk_shared_by_two_sessions_stays_until_both_end():
+    store = ChunkStore(max_chunks=1)
+    # Sessions are per context, so the first one runs on its own thread
+    shared = {}
+    stored, release = threading.Event(), threading.Event()
+
+    def hold():
+        with store.session():
+            shared["key"] = store.put("shared")
+            stored.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    stored.wait()
+    with store.session():
+        store.put("shared")
+        store.put("filler")
+    assert shared["key"] in store
+    release.set()
+    thread.join()
+    store.put("later")
+    assert shared["key"] not in store
@@ -0,0 +1,28 @@
+from rag.compression import compress_documents
+
+FILLER = "The company continued to invest in research and development across its businesses. " * 8
+SEGMENTS = "Safety and Industrial sales declined 4.5% in 2022, driven by lower disposable respirator demand. "
+CASH = "Operating cash flow was $5.6 billion in 2022, while capital expenditures were $1.7 billion. "
+QUESTION = "Which segment's sales declined in 2022?"
+
+
+def test_nothing_scoring_returns_documents_unchanged():
+    documents = [FILLER, "Short note."]
+    assert compress_documents("What was the dividend policy?", documents) == documents
+
+
+def test_every_graded_chunk_keeps_its_best_span():
+    # Both chunks mention 2022, but the budget only has room for one span
+    documents = [SEGMENTS + FILLER, FILLER + CASH + FILLER]
+    compressed = compress_documents(QUESTION, documents, top_spans=1, neighbours=0)
+    assert len(compressed) == 2
+    assert "Safety and Industrial" in compressed[0]
+    assert "$5.6 billion" in compressed[1]
+
+
+def test_long_chunk_kept_next_to_short_chunk():
+    documents = [FILLER + SEGMENTS + FILLER, "Revenue by geography."]
+    compressed = compress_documents(QUESTION, documents, neighbours=0)
+    assert compressed[0].startswith("[chunk 1] ")
+    assert "Safety and Industrial" in compressed[0] and len(compressed[0]) < len(documents[0])
+    assert compressed[1] == "[chunk 2] Revenue by geography."
@@ -0,0 +1,26 @@
+from rag.decomposition import decompose, detect_companies, detect_periods
+
+
+def test_company_names_with_ampersands_stay_whole():
+    assert detect_companies("Johnson & Johnson") == ["Johnson & Johnson"]
+    assert detect_companies("AT&T") == ["AT&T"]
+    assert detect_companies("Procter and Gamble") == ["Procter and Gamble"]
+
+
+def test_company_lists_are_split():
+    assert detect_companies("3M, Adobe, and AMD") == ["3M", "Adobe", "AMD"]
+    assert detect_companies("Johnson & Johnson vs Pfizer") == ["Johnson & Johnson", "Pfizer"]
+    # Joined with 'and' or '&', only known companies are split
+    assert detect_companies("Adobe & AMD") == ["Adobe", "AMD"]
+
+
+def test_only_fiscal_years_name_filings():
+    assert detect_periods("Which segment dragged down 3M's growth in 2022 vs 2021?") == ["2022", "2021"]
+    assert detect_periods("What is the FY2018 capital expenditure amount for 3M?") == ["2018"]
+    assert detect_periods("How much of the notes due 2026 were repaid?", "2022") == ["2022"]
+    assert detect_periods("In the 2022 10-K, what rate do the 2025 senior notes pay?") == ["2022"]
+
+
+def test_decompose_into_filings():
+    pairs = decompose("Did revenue grow faster in FY2022 than in FY2021?", "Johnson & Johnson", "2022")
+    assert pairs == [("Johnson & Johnson", "2022"), ("Johnson & Johnson", "2021")]
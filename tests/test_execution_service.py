@@ -0,0 +1,37 @@
+import threading
+
+from execution_service import ExecutionService
+
+
+def test_nested_tasks_queue_on_the_next_level_when_the_pool_is_full():
+    service = ExecutionService(max_workers=1, nested_workers=1, tool_rate_limits={}, model_rate_limits={})
+    threads = {}
+
+    def task(depth):
+        threads[depth] = threading.current_thread()
+        if depth < 3:
+            # The worker is busy with this task, the nested plan must not wait for it
+            service.submit(task, depth + 1).result(timeout=5)
+        return depth
+
+    try:
+        assert service.submit(task, 0).result(timeout=5) == 0
+        # Every level ran on a thread of its own pool, never inline on the caller
+        assert len({thread.ident for thread in threads.values()}) == 4
+        assert threads[0].name.startswith("execution-service_")
+        assert threads[2].name.startswith("execution-service-nested-2")
+        metrics = service.metrics()
+        assert metrics["nested_submits"] == 3
+        assert metrics["completed"] == metrics["submitted"] == 4
+        assert sorted(metrics["nested_levels"]) == [1, 2, 3]
+    finally:
+        service.shutdown()
+
+
+def test_nested_tasks_share_the_pool_while_it_has_room():
+    service = ExecutionService(max_workers=2, tool_rate_limits={}, model_rate_limits={})
+    try:
+        assert service.submit(lambda: service.submit(lambda: 1).result(timeout=5)).result(timeout=5) == 1
+        assert service.metrics()["nested_submits"] == 0
+    finally:
+        service.shutdown()
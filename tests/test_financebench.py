@@ -0,0 +1,26 @@
+from benchmarks.financebench import extract_quantities, score_answer
+
+GOLD = "Pepsico's restructuring costs in FY2022 amounted to $411 million"
+
+
+def test_year_in_the_gold_answer_is_not_the_target():
+    assert score_answer("I could not find the restructuring costs for FY2022.", GOLD)["correct"] is False
+    assert score_answer("I could not find the restructuring costs for 2022.", GOLD)["correct"] is False
+    assert score_answer("Restructuring costs were $411 million in FY 2022.", GOLD)["correct"] is True
+
+
+def test_yes_no_gold_with_a_year_is_judged_on_the_answer_word():
+    gold = "No, American Water Works had negative working capital of -$1561M in FY 2022."
+    assert score_answer("Yes, in FY 2022 working capital was -$1561M.", gold) == {"numeric": False, "correct": False}
+    assert score_answer("No, it was negative.", gold) == {"numeric": False, "correct": True}
+
+
+def test_unit_bearing_number_is_preferred():
+    gold = "The quick ratio improved from 0.67 times in 2022 to 0.69 times, a 3.4% jump"
+    assert score_answer("It was 0.67", gold)["correct"] is True
+    assert score_answer("It rose 2023", gold)["correct"] is False
+
+
+def test_years_and_identifiers_are_left_out():
+    text = "3M's 1.500% Notes due 2026 (MMM26) traded at 0.96 in Jun'23 and Q2 FY2024, $1561M"
+    assert extract_quantities(text) == [(1.5, True), (0.96, False), (1561.0, True)]
@@ -0,0 +1,9 @@
+from benchmarks.retrieval import chunk_pages, evaluate
+from rag.local_index import BM25Index
+
+PAGES = {("3M_2022_10K", 3): "Safety and Industrial organic sales declined 0.8% in 2022."}
+
+
+def test_no_question_reports_no_latency():
+    index = BM25Index(chunk_pages(PAGES, 500, 50))
+    assert evaluate(index, [], [1, 3], "corpus") == {"latency_ms": {"p50": None, "p95": None}, "metrics": {}}
@@ -0,0 +1,71 @@
+"""
+Smoke run of the RAG graph of new_adaptive_rag against the local stand-in.
+
+The stand-in serves OpenAI, Pathway and Tavily. The LangChain hub prompt is
+pulled at import time and the embeddings need a tiktoken encoding, neither
+available offline, so the test replaces the prompt and sends raw text to the
+embeddings endpoint.
+"""
+
+import importlib
+import sys
+
+import pytest
+from langchain import hub
+from langchain_core.documents import Document
+from langchain_core.prompts import ChatPromptTemplate
+
+from benchmarks.stand_in import route_clients, server_url, start_server
+
+RAG_PROMPT = ChatPromptTemplate.from_messages([("human", "Question: {question}\nContext: {context}\nAnswer:")])
+
+
+@pytest.fixture(scope="module")
+def rag():
+    server, _ = start_server({
+        "port": 0,
+        "rules": [{"path": "/v1/chat/completions", "tool": "RewrittenQueries",
+                   "response": {"query1": "3M segment sales", "query2": "3M organic growth",
+                                "query3": "3M capital expenditures", "query4": "3M net sales",
+                                "query5": "3M Health Care", "company_name": "3M", "year": "2022",
+                                "table": "YES"}}],
+    })
+    unroute = route_clients(server_url(server))
+    monkeypatch = pytest.MonkeyPatch()
+    monkeypatch.setattr(hub, "pull", lambda *args, **kwargs: RAG_PROMPT)
+    try:
+        sys.modules.pop("new_adaptive_rag", None)
+        module = importlib.import_module("new_adaptive_rag")
+        module.embd.check_embedding_ctx_length = False
+        yield module
+    finally:
+        # Its clients point at this server, later imports must create their own
+        sys.modules.pop("new_adaptive_rag", None)
+        monkeypatch.undo()
+        unroute()
+        server.shutdown()
+
+
+def test_rag_graph_answers_from_the_stand_in(rag):
+    # From the vector store, the generation is the graded chunks themselves
+    answer = rag.data_node_function("Which segment of 3M had the lowest organic growth in 2022?")
+    assert "Safety and Industrial" in answer
+
+
+def test_retrieve_reads_the_category_of_canned_chunks(rag):
+    table_results, text_results = rag.search_filing("3M segment sales 2022", ["3M segment sales"], True, "3M", "2022")
+    assert table_results and all(doc[0].metadata["category"] == "Table" for doc in table_results)
+    assert text_results
+
+
+def test_diversify_drops_near_duplicates_without_embedding(rag, monkeypatch):
+    # Any embedding call fails with AttributeError
+    monkeypatch.setattr(rag, "embd", object())
+    table = "| Segment | 2022 sales | Change |\n| Safety and Industrial | 11,604 | (4.5)% |"
+    results = [
+        (Document(page_content=table, metadata={}), 0.10),
+        (Document(page_content="Segment table: " + table, metadata={}), 0.11),
+        (Document(page_content="Health Care sales grew 2.0% on organic growth in 2022.", metadata={}), 0.12),
+    ]
+    # The copy of the best chunk gives way to the distinct one
+    assert rag.diversify(results, 2) == [results[0], results[2]]
@@ -0,0 +1,43 @@
+"""yfinance, as used by the report generator, fetches from the stand-in once the clients are routed."""
+
+import os
+
+import pytest
+
+from benchmarks.stand_in import route_clients, server_url, start_server
+
+yf = pytest.importorskip("yfinance")
+
+
+@pytest.fixture
+def stand_in():
+    server, _ = start_server({"port": 0})
+    unroute = route_clients(server_url(server))
+    try:
+        yield server
+    finally:
+        unroute()
+        server.shutdown()
+
+
+def test_ticker_history_and_info_come_from_the_stand_in(stand_in):
+    stock = yf.Ticker("MMM")
+    history = stock.history(period="10y")
+    assert len(history) == 2520
+    assert stock.info["sector"] == "Industrials"
+    requests = stand_in.RequestHandlerClass.stand_in.stats()["requests"]
+    assert requests["/v8/finance/chart"] >= 1
+    assert requests["/v10/finance/quoteSummary"] == 1
+
+
+def test_route_clients_is_undone():
+    from langchain_community.utilities import tavily_search
+    from yfinance.data import YfData
+
+    before = os.environ.get("PATHWAY_URL"), tavily_search.TAVILY_API_URL, YfData(session=None)._session
+    server, _ = start_server({"port": 0})
+    try:
+        route_clients(server_url(server))()
+    finally:
+        server.shutdown()
+    assert (os.environ.get("PATHWAY_URL"), tavily_search.TAVILY_API_URL, YfData(session=None)._session) == before
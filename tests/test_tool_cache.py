@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+from langchain_core.tools import StructuredTool
+
+import tool_cache
+from execution_service import ExecutionService
+from modular_agent import aschedule_tasks
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = tool_cache.ToolCache(policies={})
+    monkeypatch.setattr(tool_cache, "_cache", cache)
+    return cache
+
+
+def make_lookup(calls):
+    async def lookup(query: str) -> str:
+        """Slow lookup"""
+        calls.append(query)
+        await asyncio.sleep(0.3)
+        return f"result of {query}"
+
+    return StructuredTool.from_function(coroutine=lookup, name="lookup", metadata={"cache": {"ttl": 60}})
+
+
+def plan(tool):
+    return [{"idx": 1, "tool": tool, "args": {"query": "3M revenue"}, "dependencies": [], "thought": None}]
+
+
+def test_waiters_rerun_the_call_when_the_leader_times_out(cache):
+    calls = []
+    lookup = make_lookup(calls)
+    service = ExecutionService(max_workers=2, tool_rate_limits={}, model_rate_limits={})
+
+    async def both_plans():
+        leader = asyncio.create_task(aschedule_tasks.ainvoke(
+            {"messages": [], "tasks": plan(lookup), "tool_timeouts": {"lookup": 0.1}, "execution_service": service}
+        ))
+        await asyncio.sleep(0.05)
+        # Same call from another plan, without a timeout: waits on the leader's execution
+        waiter = aschedule_tasks.ainvoke({"messages": [], "tasks": plan(lookup), "execution_service": service})
+        return await asyncio.wait_for(asyncio.gather(leader, waiter), 5)
+
+    try:
+        leader_messages, waiter_messages = asyncio.run(both_plans())
+    finally:
+        service.shutdown()
+    assert "timed out" in leader_messages[0].content
+    # The waiter ran the call again instead of inheriting the leader's cancellation
+    assert waiter_messages[0].content == "result of 3M revenue"
+    assert calls == ["3M revenue", "3M revenue"]
+    assert cache.stats()["deduplicated"] == 1
+
+
+def test_cancelled_waiter_leaves_the_execution_to_the_others(cache):
+    calls = []
+    lookup = make_lookup(calls)
+
+    async def run():
+        return await lookup.ainvoke({"query": "3M revenue"})
+
+    async def callers():
+        leader = asyncio.create_task(cache.acall(lookup, {"query": "3M revenue"}, run))
+        await asyncio.sleep(0.05)
+        impatient = asyncio.create_task(cache.acall(lookup, {"query": "3M revenue"}, run))
+        patient = asyncio.create_task(cache.acall(lookup, {"query": "3M revenue"}, run))
+        await asyncio.sleep(0.05)
+        impatient.cancel()
+        return await asyncio.gather(leader, patient)
+
+    assert asyncio.run(callers()) == ["result of 3M revenue"] * 2
+    assert calls == ["3M revenue"]
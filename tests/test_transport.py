@@ -0,0 +1,96 @@
+import time
+
+import pytest
+import requests
+
+from benchmarks.stand_in import CANNED_CHUNKS, server_url, start_server
+from rag.local_index import BM25Index
+from rag.transport import CircuitBreaker, CircuitOpenError, VectorStoreTransport
+
+
+@pytest.fixture
+def stand_in():
+    server, _ = start_server({"port": 0})
+    yield server
+    server.shutdown()
+
+
+def inject(server, error_rate, status=503):
+    config = server.RequestHandlerClass.stand_in.config
+    config["error_rate"] = {"default": 0.0, "/v1/retrieve": error_rate}
+    config["error_status"] = status
+
+
+def retrieve_requests(server):
+    return server.RequestHandlerClass.stand_in.stats()["requests"].get("/v1/retrieve", 0)
+
+
+def make_transport(server, **kwargs):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+    return VectorStoreTransport(server_url(server), read_timeout=1.0, breaker=breaker, **kwargs)
+
+
+def test_server_errors_open_the_circuit_and_the_local_index_answers(stand_in):
+    inject(stand_in, 1.0)
+    transport = make_transport(stand_in, fallback=BM25Index(CANNED_CHUNKS))
+    for _ in range(3):
+        results = transport.query("Safety and Industrial organic growth", k=1)
+        assert "Safety and Industrial" in results[0]["text"]
+    # Two failures opened the circuit, the third query never reached the server
+    assert transport.breaker.state == "open"
+    assert retrieve_requests(stand_in) == 2
+
+
+def test_trial_request_closes_the_circuit_once_the_server_recovers(stand_in):
+    inject(stand_in, 1.0)
+    transport = make_transport(stand_in)
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            transport.query("3M", k=1)
+    with pytest.raises(CircuitOpenError):
+        transport.query("3M", k=1)
+    inject(stand_in, 0.0)
+    transport.breaker.opened_at -= 0.2
+    assert transport.query("3M", k=1)
+    assert transport.breaker.state == "closed"
+
+
+def test_bad_requests_do_not_open_the_circuit(stand_in):
+    inject(stand_in, 1.0, status=400)
+    transport = make_transport(stand_in)
+    for _ in range(3):
+        with pytest.raises(requests.HTTPError):
+            transport.query("3M", k=1)
+    assert transport.breaker.state == "closed"
+
+
+def test_unexpected_error_of_the_trial_request_releases_it(stand_in, monkeypatch):
+    transport = make_transport(stand_in)
+    # Half-open, the next request is the trial
+    transport.breaker.opened_at = time.monotonic() - 1
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("bug in the client")
+
+    monkeypatch.setattr(transport.session, "post", broken)
+    with pytest.raises(RuntimeError):
+        transport.query("3M", k=1)
+    monkeypatch.undo()
+    # The circuit did not stay half-open with a trial that never ends
+    assert transport.query("3M", k=1)
+    assert transport.breaker.state == "closed"
+
+
+def test_no_free_slot_times_out_and_falls_back(stand_in):
+    transport = VectorStoreTransport(
+        server_url(stand_in), read_timeout=0.1, max_concurrency=1,
+        breaker=CircuitBreaker(failure_threshold=1), fallback=BM25Index(CANNED_CHUNKS),
+    )
+    transport._slots.acquire()
+    try:
+        results = transport.query("Safety and Industrial", k=1)
+    finally:
+        transport._slots.release()
+    assert "Safety and Industrial" in results[0]["text"]
+    assert transport.breaker.state == "open"
+    assert retrieve_requests(stand_in) == 0
@@ -0,0 +1,40 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from langchain_openai import ChatOpenAI
+
+from benchmarks.cassette import ReplayStream
+from benchmarks.stand_in import server_url, start_server
+from benchmarks.usage import MeteredStream, UsageMeter, current_item
+
+
+@pytest.fixture
+def llm():
+    server, _ = start_server({"port": 0})
+    try:
+        yield ChatOpenAI(model="gpt-4o", base_url=f"{server_url(server)}/v1", api_key="stand-in", streaming=True)
+    finally:
+        server.shutdown()
+
+
+def test_streamed_completions_are_metered(llm):
+    token = current_item.set("q1")
+    try:
+        with UsageMeter() as meter:
+            llm.invoke("What were 3M's 2022 net sales?")
+            asyncio.run(llm.ainvoke("What were 3M's 2022 net sales?"))
+    finally:
+        current_item.reset(token)
+    usage = meter.usage("q1")
+    assert usage["llm_calls"] == 2
+    assert usage["prompt_tokens"] > 0 and usage["completion_tokens"] > 0
+    assert "unmetered_llm_calls" not in usage
+
+
+def test_stream_without_usage_is_unmetered():
+    meter = UsageMeter()
+    chunks = [SimpleNamespace(usage=None, choices=[]) for _ in range(3)]
+    with MeteredStream(ReplayStream(chunks, 0, 0), meter, "llm") as stream:
+        assert list(stream) == chunks
+    assert meter.totals() == {"llm_calls": 1, "unmetered_llm_calls": 1}
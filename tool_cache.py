@@ -0,0 +1,224 @@
+"""
+Cache of tool results for the schedulers of modular_agent.
+
+Planners often emit the same tool call with the same resolved arguments:
+twice in a plan, again after a replan, or for another user. Tools opt in to
+caching, keyed by tool name and canonicalized resolved arguments, with a
+policy of their own:
+
+- ttl: seconds a result stays valid
+- deterministic: the result never changes for the same arguments, so it never expires
+
+A call whose result is already being computed waits for that execution
+instead of starting another one, whether or not it may be stored. Errors
+(exceptions, and the "ERROR(" observations of the schedulers) are never
+stored. When the execution is cancelled (its task timed out, or its plan was
+cancelled), the waiters do not inherit the cancellation: they run the call
+again, one of them executing it for the others.
+
+Opting in, either through the environment:
+
+    TOOL_CACHE_POLICIES="data_node_tool=600,finance_group_tool=deterministic"
+
+or on the tool itself:
+
+    tool.metadata = {"cache": {"ttl": 600}}
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from langchain_core.tools import BaseTool
+
+# Maximum number of results kept, least recently used are evicted first
+TOOL_CACHE_SIZE = int(os.getenv("TOOL_CACHE_SIZE", "1024"))
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    ttl: Optional[float] = None
+    deterministic: bool = False
+
+    def expires_at(self, now: float) -> float:
+        if self.deterministic or self.ttl is None:
+            return float("inf")
+        return now + self.ttl
+
+
+def parse_policies(spec: str) -> Dict[str, CachePolicy]:
+    """'data_node_tool=600,finance_group_tool=deterministic' -> {name: CachePolicy}"""
+    policies = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, value = (part.strip() for part in item.rsplit("=", 1))
+        policies[name] = CachePolicy(deterministic=True) if value == "deterministic" else CachePolicy(ttl=float(value))
+    return policies
+
+
+TOOL_CACHE_POLICIES = parse_policies(os.getenv("TOOL_CACHE_POLICIES", ""))
+
+# Result of an execution abandoned by a cancelled caller, its waiters claim the call again
+_ABANDONED = object()
+
+
+def _canonical(value: Any) -> Any:
+    # Native outputs of earlier tasks, e.g. NumPy arrays, whose str() elides items
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return repr(value)
+
+
+def cache_key(tool_name: str, args: Any) -> str:
+    """Key of a call, independent of the order of dict keys in the arguments."""
+    canonical = json.dumps(args, sort_keys=True, separators=(",", ":"), default=_canonical)
+    return tool_name + ":" + hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _is_error(result: Any) -> bool:
+    return isinstance(result, str) and result.startswith("ERROR(")
+
+
+class ToolCache:
+    """Thread safe, size bounded cache of tool results, with in-flight de-duplication."""
+
+    def __init__(self, policies: Optional[Dict[str, CachePolicy]] = None, max_entries: int = TOOL_CACHE_SIZE):
+        self.policies = TOOL_CACHE_POLICIES if policies is None else policies
+        self.max_entries = max_entries
+        self._results: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+
+    def policy(self, tool: BaseTool) -> Optional[CachePolicy]:
+        """Policy of the tool, None if it does not opt in."""
+        if tool.name in self.policies:
+            return self.policies[tool.name]
+        metadata = (tool.metadata or {}).get("cache")
+        if metadata:
+            return CachePolicy(**metadata) if isinstance(metadata, dict) else CachePolicy(deterministic=True)
+        return None
+
+    def _claim(self, key: str) -> Tuple[bool, Any, Optional[Future]]:
+        """
+        (True, result, None) on a hit, (False, None, future) to wait on a running execution,
+        (False, None, None) after registering the caller as the one executing.
+        """
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None:
+                expires_at, result = entry
+                if expires_at > time.monotonic():
+                    self._results.move_to_end(key)
+                    self.hits += 1
+                    return True, result, None
+                del self._results[key]
+            if key in self._in_flight:
+                self.deduplicated += 1
+                return False, None, self._in_flight[key]
+            self.misses += 1
+            # Running, so that a waiter giving up cannot cancel it for the others
+            future = self._in_flight[key] = Future()
+            future.set_running_or_notify_cancel()
+            return False, None, None
+
+    def _settle(self, key: str, policy: CachePolicy, result: Any = None, error: Optional[BaseException] = None) -> None:
+        if error is not None and not isinstance(error, Exception):
+            # Cancelled (CancelledError, KeyboardInterrupt...): nothing the waiters should see
+            error, result = None, _ABANDONED
+        with self._lock:
+            future = self._in_flight.pop(key)
+            if error is None and result is not _ABANDONED and not _is_error(result):
+                self._results[key] = (policy.expires_at(time.monotonic()), result)
+                self._results.move_to_end(key)
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def call(self, tool: BaseTool, args: Any, run: Callable[[], Any]) -> Any:
+        """Result of `run()`, the tool call with the resolved `args`, from the cache when possible."""
+        policy = self.policy(tool)
+        if policy is None:
+            return run()
+        key = cache_key(tool.name, args)
+        while True:
+            hit, result, running = self._claim(key)
+            if hit:
+                return result
+            if running is None:
+                break
+            result = running.result()
+            if result is not _ABANDONED:
+                return result
+        try:
+            result = run()
+        except BaseException as e:
+            self._settle(key, policy, error=e)
+            raise
+        self._settle(key, policy, result)
+        return result
+
+    async def acall(self, tool: BaseTool, args: Any, run: Callable[[], Awaitable[Any]]) -> Any:
+        """Async version of call, which can share executions with sync callers."""
+        policy = self.policy(tool)
+        if policy is None:
+            return await run()
+        key = cache_key(tool.name, args)
+        while True:
+            hit, result, running = self._claim(key)
+            if hit:
+                return result
+            if running is None:
+                break
+            result = await asyncio.wrap_future(running)
+            if result is not _ABANDONED:
+                return result
+        try:
+            result = await run()
+        except BaseException as e:
+            self._settle(key, policy, error=e)
+            raise
+        self._settle(key, policy, result)
+        return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._results.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._results), "hits": self.hits, "misses": self.misses,
+                    "deduplicated": self.deduplicated}
+
+
+_cache: Optional[ToolCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_tool_cache() -> ToolCache:
+    """The process-wide cache, with the policies of TOOL_CACHE_POLICIES."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ToolCache()
+    return _cache
+
+
+def configure_tool_cache(**kwargs: Any) -> ToolCache:
+    """Replace the process-wide cache, taking the arguments of ToolCache."""
+    global _cache
+    with _cache_lock:
+        _cache = ToolCache(**kwargs)
+    return _cache
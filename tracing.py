@@ -0,0 +1,260 @@
+"""
+Per-request tracer, exporting a timeline in the Chrome trace-event format.
+
+A request traced with `trace()` records nested spans for:
+
+- each LangGraph node, and each LLM call with its token counts, from the
+  callback handler added to the config of the request. Streamed LLM calls
+  (the planner) also get their streamed tokens and time to first token.
+- each task of the schedulers: time waiting for a free slot, then the tool call
+- each retrieval of the RAG, from `span()` around the vector store calls
+
+    with trace("supervisor") as tracer:
+        supervisor.invoke(inputs, tracer.attach(config))
+    tracer.export("traces/request.json")
+
+The file opens in chrome://tracing or https://ui.perfetto.dev. With TRACE_DIR
+set, every trace is also written there when it ends. Spans are collected
+through a context variable, which the execution service and the asyncio tasks
+copy, so tool calls on other threads land in the trace of their request.
+Outside a trace, `span()` does nothing.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+# Directory every finished trace is written to, none when empty
+TRACE_DIR = os.getenv("TRACE_DIR", "")
+
+_current: contextvars.ContextVar[Optional["Tracer"]] = contextvars.ContextVar("tracer", default=None)
+
+
+def _lane() -> Tuple[int, Optional[int]]:
+    """(thread, asyncio task) the caller runs on. Concurrent tasks of a loop get lanes of their own."""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return threading.get_ident(), None if task is None else id(task)
+
+
+class Tracer:
+    """Thread safe collection of the spans of one request."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+        self._events: List[Dict[str, Any]] = []
+        self._lanes: Dict[Tuple[int, Optional[int]], int] = {}
+        self._lock = threading.Lock()
+        self.handler = TracingCallbackHandler(self)
+
+    def _tid(self, lane: Tuple[int, Optional[int]]) -> int:
+        with self._lock:
+            if lane not in self._lanes:
+                self._lanes[lane] = tid = len(self._lanes) + 1
+                thread, task = lane
+                label = threading.current_thread().name if thread == threading.get_ident() else str(thread)
+                self._events.append({
+                    "name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                    "args": {"name": label if task is None else f"{label} task-{tid}"},
+                })
+            return self._lanes[lane]
+
+    def add_span(self, name: str, start: float, end: float, cat: str = "",
+                 lane: Optional[Tuple[int, Optional[int]]] = None, **args: Any) -> None:
+        """Record a span from perf_counter times, on the caller's lane unless given."""
+        event = {
+            "name": name, "cat": cat, "ph": "X", "pid": self.pid, "tid": self._tid(lane or _lane()),
+            "ts": (start - self.origin) * 1e6, "dur": max(0.0, end - start) * 1e6,
+            "args": {key: value if isinstance(value, (int, float, bool)) or value is None else str(value)
+                     for key, value in args.items()},
+        }
+        with self._lock:
+            self._events.append(event)
+
+    def attach(self, config: Optional[dict] = None) -> dict:
+        """A copy of the config of a request, with the callback handler of the trace."""
+        config = dict(config or {})
+        callbacks = config.get("callbacks")
+        if callbacks is None:
+            config["callbacks"] = [self.handler]
+        elif isinstance(callbacks, list):
+            config["callbacks"] = callbacks + [self.handler]
+        else:
+            callbacks = callbacks.copy()
+            callbacks.add_handler(self.handler, inherit=True)
+            config["callbacks"] = callbacks
+        return config
+
+    def to_chrome(self) -> Dict[str, Any]:
+        with self._lock:
+            events = sorted(self._events, key=lambda event: (event["ph"] != "M", event.get("ts", 0)))
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"name": self.name}}
+
+    def export(self, path: str) -> str:
+        """Write the trace as Chrome trace-event JSON, returning the path."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.to_chrome(), f)
+        return path
+
+
+@contextlib.contextmanager
+def trace(name: str = "request", path: Optional[str] = None) -> Iterator[Tracer]:
+    """
+    Trace the request run in the block.
+
+    Args:
+        name (str): Name of the request, the span covering the whole block
+        path (str): File the trace is written to when the block ends, by default
+            TRACE_DIR/<name>-<time>.json when TRACE_DIR is set
+
+    Yields:
+        Tracer: The trace, whose `attach(config)` must be used for the LangChain runs of the request
+    """
+    tracer = Tracer(name)
+    token = _current.set(tracer)
+    start = time.perf_counter()
+    try:
+        yield tracer
+    finally:
+        tracer.add_span(name, start, time.perf_counter(), "request")
+        _current.reset(token)
+        if path is None and TRACE_DIR:
+            path = os.path.join(TRACE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{id(tracer):x}.json")
+        if path:
+            tracer.export(path)
+
+
+def current_tracer() -> Optional[Tracer]:
+    return _current.get()
+
+
+@contextlib.contextmanager
+def span(name: str, cat: str = "", **args: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Record the block as a span of the current trace, if any.
+
+    Yields the args of the span, to add values known at its end (e.g. result counts).
+    """
+    tracer = _current.get()
+    if tracer is None:
+        yield args
+        return
+    lane = _lane()
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        tracer.add_span(name, start, time.perf_counter(), cat, lane, **args)
+
+
+def add_span(name: str, start: float, end: float, cat: str = "", **args: Any) -> None:
+    """Record a span measured by the caller (perf_counter times) in the current trace, if any."""
+    tracer = _current.get()
+    if tracer is not None:
+        tracer.add_span(name, start, end, cat, **args)
+
+
+def _token_usage(response: LLMResult) -> Dict[str, int]:
+    # usage_metadata of the message (also set when streaming), else the OpenAI token_usage
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return {"prompt_tokens": usage.get("input_tokens", 0),
+                        "completion_tokens": usage.get("output_tokens", 0)}
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return {key: usage[key] for key in ("prompt_tokens", "completion_tokens") if key in usage}
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Spans of the LangGraph nodes, LLM calls and retrievers of a run, added to a Tracer."""
+
+    # Called on the thread or task of the run, so spans land on its lane
+    run_inline = True
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+        # run_id -> (name, cat, start, lane, args)
+        self._runs: Dict[UUID, tuple] = {}
+        self._graphs: set = set()
+        self._lock = threading.Lock()
+
+    def _start(self, run_id: UUID, name: str, cat: str, **args: Any) -> None:
+        with self._lock:
+            self._runs[run_id] = (name, cat, time.perf_counter(), _lane(), args)
+
+    def _end(self, run_id: UUID, **args: Any) -> None:
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is not None:
+            name, cat, start, lane, start_args = run
+            self.tracer.add_span(name, start, time.perf_counter(), cat, lane, **start_args, **args)
+
+    def on_chain_start(self, serialized: Optional[Dict[str, Any]], inputs: Any, *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, metadata: Optional[Dict[str, Any]] = None,
+                       **kwargs: Any) -> None:
+        # Only the graphs and their nodes, not every runnable of a chain
+        name = kwargs.get("name") or (serialized or {}).get("name", "")
+        node = (metadata or {}).get("langgraph_node")
+        if parent_run_id is None or name == "LangGraph":
+            with self._lock:
+                self._graphs.add(run_id)
+            self._start(run_id, name, "graph")
+        elif node is not None and name == node and parent_run_id in self._graphs:
+            self._start(run_id, name, "node", step=(metadata or {}).get("langgraph_step"))
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._graphs.discard(run_id)
+        self._end(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._graphs.discard(run_id)
+        self._end(run_id, error=repr(error))
+
+    def on_chat_model_start(self, serialized: Optional[Dict[str, Any]], messages: Any, *, run_id: UUID,
+                            metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        model = (metadata or {}).get("ls_model_name") or kwargs.get("name") or (serialized or {}).get("id", ["llm"])[-1]
+        self._start(run_id, f"llm {model}", "llm", node=(metadata or {}).get("langgraph_node"), streamed_tokens=0)
+
+    def on_llm_start(self, serialized: Optional[Dict[str, Any]], prompts: Any, *, run_id: UUID,
+                     metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        self.on_chat_model_start(serialized, prompts, run_id=run_id, metadata=metadata, **kwargs)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is not None:
+                args = run[4]
+                if not args["streamed_tokens"]:
+                    args["first_token_ms"] = (time.perf_counter() - run[2]) * 1000
+                args["streamed_tokens"] += 1
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, **_token_usage(response))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error=repr(error))
+
+    def on_retriever_start(self, serialized: Optional[Dict[str, Any]], query: str, *, run_id: UUID,
+                           **kwargs: Any) -> None:
+        self._start(run_id, kwargs.get("name") or "retriever", "retriever", query=query)
+
+    def on_retriever_end(self, documents: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, documents=len(documents))
+
+    def on_retriever_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error=repr(error))